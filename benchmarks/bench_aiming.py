@@ -0,0 +1,82 @@
+"""
+Benchmark turning napari shapes into aiming points.
+
+Compares `polygon_laser_focus` against the loop implementation it replaced,
+which made one shapely `Point` per lattice point, over a range of shape sizes
+and lattice densities.
+
+Usage::
+
+    python benchmarks/bench_aiming.py
+    python benchmarks/bench_aiming.py --sizes 100 1000 --densities 2 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import timeit
+from functools import partial
+
+import numpy as np
+
+from raman_mda_engine.aiming._reference import (
+    loop_ellipse,
+    loop_polygon,
+    loop_rectangle,
+)
+from raman_mda_engine.aiming.util import polygon_laser_focus
+
+LOOPS = {"rectangle": loop_rectangle, "ellipse": loop_ellipse, "polygon": loop_polygon}
+
+
+def make_shape(shape_type: str, size: float) -> np.ndarray:
+    """Make a shape of *shape_type* about *size* pixels across."""
+    if shape_type == "polygon":
+        # a star so that much of the lattice is rejected
+        angle = np.linspace(0, 2 * np.pi, 20, endpoint=False)
+        radius = np.where(np.arange(20) % 2, 0.4, 1) * size / 2
+        return (
+            size / 2 + np.column_stack([np.cos(angle), np.sin(angle)]) * radius[:, None]
+        )
+    # napari's corners of the bounding box, a bit wider than tall
+    h, w = 0.8 * size, size
+    return np.array([[0, 0], [0, w], [h, w], [h, 0]], dtype=float)
+
+
+def best_time(func, repeat: int = 5) -> float:
+    """Get the fastest seconds per call of *func* over *repeat* runs."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def main(argv=None) -> int:
+    """Run the benchmark and print a table of the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--densities", type=int, nargs="+", default=[2, 5, 15])
+    args = parser.parse_args(argv)
+
+    print(
+        f"{'shape':<10} {'size':>6} {'density':>7} {'points':>8}"
+        f" {'loop ms':>10} {'vector ms':>10} {'speedup':>8}"
+    )
+    for shape_type, loop in LOOPS.items():
+        for size in args.sizes:
+            for density in args.densities:
+                data = make_shape(shape_type, size)
+                n = len(polygon_laser_focus(data, shape_type, density, plot=False))
+                old = best_time(partial(loop, data, density), repeat=3)
+                new = best_time(
+                    partial(polygon_laser_focus, data, shape_type, density, plot=False)
+                )
+                print(
+                    f"{shape_type:<10} {size:>6.0f} {density:>7} {n:>8}"
+                    f" {old * 1e3:>10.3f} {new * 1e3:>10.3f} {old / new:>7.1f}x"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
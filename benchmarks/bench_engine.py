@@ -0,0 +1,196 @@
+"""
+End to end throughput benchmarks of `RamanEngine` on the demo config.
+
+Runs a matrix of sequences (positions x timepoints x z x aiming points) through
+the engine with a `SimulatedSpectraCollector` that takes as long as the hardware
+would and reports events/s, Raman points/s and the latency percentiles of each
+phase.
+
+Usage::
+
+    python benchmarks/bench_engine.py
+    python benchmarks/bench_engine.py --quick --writer zarr
+    python benchmarks/bench_engine.py --save benchmarks/baseline.json
+    python benchmarks/bench_engine.py --compare benchmarks/baseline.json
+
+``--compare`` exits with a non-zero status if any case got slower than the
+baseline by more than ``--tolerance``.
+
+No baseline is checked in. The numbers depend on the machine and the
+script needs the Micro-Manager demo adapters, so record one with
+``--save`` on the machine you want to compare on.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from pymmcore_plus import CMMCorePlus
+from useq import MDASequence
+
+from raman_mda_engine import (
+    RamanEngine,
+    RamanTiffAndNumpyWriter,
+    RamanZarrWriter,
+    SimulatedSpectraCollector,
+)
+from raman_mda_engine.aiming import SimpleGridSource
+
+CONFIG = Path(__file__).parent.parent / "tests" / "test-config.cfg"
+
+# (positions, timepoints, z planes, grid points per side)
+CASES = [
+    (1, 5, 1, 5),
+    (4, 5, 1, 5),
+    (4, 5, 5, 5),
+    (4, 5, 5, 20),
+    (16, 3, 3, 10),
+    (4, 3, 3, 50),
+]
+QUICK_CASES = CASES[:3]
+
+
+def case_name(case: tuple[int, int, int, int]) -> str:
+    """Get the name a case is reported and saved under."""
+    n_p, n_t, n_z, n_grid = case
+    return f"p{n_p}-t{n_t}-z{n_z}-pts{n_grid**2}"
+
+
+def make_sequence(n_p: int, n_t: int, n_z: int, overlap: bool) -> MDASequence:
+    """Make the sequence of a case, with raman at every event."""
+    return MDASequence(
+        metadata={"raman": {"z": "all", "overlap": overlap}},
+        channels=["BF"],
+        time_plan={"interval": 0, "loops": n_t},
+        z_plan={"relative": [float(z) for z in range(n_z)]},
+        stage_positions=[(100 * p, 100 * p, 0) for p in range(n_p)],
+        axis_order="tpcz",
+    )
+
+
+def run_case(
+    core: CMMCorePlus,
+    case: tuple[int, int, int, int],
+    writer: str = "none",
+    overlap: bool = False,
+    collector=None,
+) -> dict:
+    """Run one case and get its throughput and phase latencies."""
+    n_p, n_t, n_z, n_grid = case
+    engine = RamanEngine(
+        spectra_collector=collector or SimulatedSpectraCollector(seed=0),
+        sources=[SimpleGridSource(n_grid, n_grid)],
+    )
+    engine.timer.enabled = True
+    core.register_mda_engine(engine)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        handler = None
+        if writer == "npy":
+            handler = RamanTiffAndNumpyWriter(Path(tmp) / "data", core)
+        elif writer == "npy-async":
+            handler = RamanTiffAndNumpyWriter(
+                Path(tmp) / "data", core, async_raman=True
+            )
+        elif writer == "zarr":
+            handler = RamanZarrWriter(Path(tmp) / "data", core)
+
+        seq = make_sequence(n_p, n_t, n_z, overlap)
+        try:
+            start = time.perf_counter()
+            core.mda.run(seq)
+            elapsed = time.perf_counter() - start
+        finally:
+            # otherwise every later case also writes into this case's folder
+            if handler is not None:
+                handler.disconnect()
+            if engine._executor is not None:
+                engine._executor.shutdown(wait=True)
+                engine._executor = None
+
+    n_events = n_p * n_t * n_z
+    phases = {
+        name: {k: stats[k] * 1e3 for k in ("p50", "p95", "max")}
+        for name, stats in engine.timer.summary().items()
+    }
+    return {
+        "elapsed_s": elapsed,
+        "events_per_s": n_events / elapsed,
+        "points_per_s": n_events * n_grid**2 / elapsed,
+        "phases_ms": phases,
+    }
+
+
+def print_result(name: str, result: dict):
+    """Print the throughput and phase latencies of a case."""
+    print(
+        f"{name:<24} {result['events_per_s']:>9.1f} events/s"
+        f" {result['points_per_s']:>10.0f} points/s"
+    )
+    for phase, stats in result["phases_ms"].items():
+        print(
+            f"    {phase:<20} p50 {stats['p50']:8.2f} ms"
+            f"  p95 {stats['p95']:8.2f} ms  max {stats['max']:8.2f} ms"
+        )
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Get the cases that are slower than the baseline."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]["events_per_s"]
+        new = result["events_per_s"]
+        if new < old * (1 - tolerance):
+            regressions.append(f"{name}: {old:.1f} -> {new:.1f} events/s")
+    return regressions
+
+
+def main(argv=None) -> int:
+    """Run the benchmark, return non-zero if --compare found regressions."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action="store_true", help="only the small cases")
+    parser.add_argument(
+        "--writer", choices=["none", "npy", "npy-async", "zarr"], default="none"
+    )
+    parser.add_argument("--overlap", action="store_true", help="raman overlap mode")
+    parser.add_argument("--save", type=Path, help="save the results as a baseline")
+    parser.add_argument("--compare", type=Path, help="baseline to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="fractional slowdown allowed by --compare (default 0.1)",
+    )
+    args = parser.parse_args(argv)
+
+    core = CMMCorePlus.instance()
+    core.loadSystemConfiguration(str(CONFIG))
+
+    results = {}
+    for case in QUICK_CASES if args.quick else CASES:
+        name = case_name(case)
+        results[name] = run_case(core, case, args.writer, args.overlap)
+        print_result(name, results[name])
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+    if args.compare:
+        regressions = compare(
+            results, json.loads(args.compare.read_text()), args.tolerance
+        )
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            return 1
+        print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
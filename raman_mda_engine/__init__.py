@@ -11,10 +11,21 @@ __all__ = [
     "__email__",
     "RamanEngine",
     "RamanTiffAndNumpyWriter",
+    "RamanZarrWriter",
+    "RemoteSpectraCollector",
+    "SharedSpectraPublisher",
+    "SharedSpectraReader",
+    "SimulatedSpectraCollector",
+    "SpectraServer",
     "fakeAcquirer",
+    "open_raman",
     "set_webhook_url",
 ]
 
 from ._engine import RamanEngine, fakeAcquirer
 from ._error_handling import set_webhook_url
-from ._writers import RamanTiffAndNumpyWriter
+from ._readers import open_raman
+from ._remote import RemoteSpectraCollector, SpectraServer
+from ._shared_memory import SharedSpectraPublisher, SharedSpectraReader
+from ._simulation import SimulatedSpectraCollector
+from ._writers import RamanTiffAndNumpyWriter, RamanZarrWriter
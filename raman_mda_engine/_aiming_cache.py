@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+from itertools import chain, repeat
+from typing import TYPE_CHECKING, Hashable, Iterable, NamedTuple
+
+import numpy as np
+from useq import MDAEvent
+
+if TYPE_CHECKING:
+    from .aiming import RamanAimingSource
+
+__all__ = [
+    "AimingPlan",
+    "AimingPlanCache",
+]
+
+
+class AimingPlan(NamedTuple):
+    """
+    Where to aim the laser for one event.
+
+    Attributes
+    ----------
+    points : (N, 2) array
+        All the points in relative coordinates, read only.
+    which : list[str]
+        The name of the source of each point.
+    offsets : (n_sources + 1,) array of int
+        Source ``i`` contributed ``points[offsets[i]:offsets[i + 1]]``.
+    """
+
+    points: np.ndarray
+    which: list[str]
+    offsets: np.ndarray
+
+
+def make_plan(sources: list[RamanAimingSource], points: list[np.ndarray]):
+    """Combine the points from each source into one `AimingPlan`."""
+    counts = [len(p) for p in points]
+    all_points = np.vstack(points) if points else np.empty((0, 2))
+    all_points.flags.writeable = False
+    which = list(
+        chain.from_iterable(repeat(s.name, n) for s, n in zip(sources, counts))
+    )
+    return AimingPlan(all_points, which, np.cumsum([0, *counts]))
+
+
+def _stamp(source: RamanAimingSource) -> Hashable | None:
+    """Identify the current points of a source, or None if they can't be reused."""
+    if not getattr(source, "cacheable", False):
+        return None
+    return id(source), getattr(source, "version", 0)
+
+
+class AimingPlanCache:
+    """
+    Cache the aiming points of each position so they are only computed once.
+
+    A source's points are reused if it has ``cacheable = True`` and its
+    ``version`` has not changed. Cacheable sources promise that their points only
+    depend on the position of the event. Sources without a ``cacheable`` attribute
+    are asked for their points at every event.
+    """
+
+    def __init__(self) -> None:
+        # (id(source), p) -> (version, points)
+        self._source_points: dict[tuple[int, int], tuple[Hashable, np.ndarray]] = {}
+        # (p, ids of the sources) -> (stamps, plan)
+        self._plans: dict[tuple, tuple[tuple, AimingPlan]] = {}
+
+    def clear(self):
+        self._source_points.clear()
+        self._plans.clear()
+
+    def build(self, sources: list[RamanAimingSource], positions: Iterable[int]):
+        """
+        Compute the points of the cacheable sources at every position ahead of time.
+
+        Sources that can't be cached are left until their events, as their
+        points can't be known before then.
+        """
+        cacheable = [s for s in sources if _stamp(s) is not None]
+        for p in positions:
+            event = MDAEvent(index={"p": p})
+            if len(cacheable) == len(sources):
+                self.get(sources, event)
+            else:
+                for source in cacheable:
+                    self._points(source, event)
+
+    def counts(self, sources: list[RamanAimingSource], p: int) -> np.ndarray:
+        """
+        Count the points of each source at position *p*.
+
+        Uses the cached points where possible. Sources that can't be cached
+        count as 0 as their points are only known at their events.
+        """
+        event = MDAEvent(index={"p": p})
+        return np.array(
+            [
+                len(self._points(s, event)) if _stamp(s) is not None else 0
+                for s in sources
+            ],
+            dtype=int,
+        )
+
+    def _points(self, source: RamanAimingSource, event: MDAEvent) -> np.ndarray:
+        stamp = _stamp(source)
+        if stamp is None:
+            return source.get_mda_points(event)
+        key = (id(source), event.index.get("p"))
+        cached = self._source_points.get(key)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, source.get_mda_points(event))
+            self._source_points[key] = cached
+        return cached[1]
+
+    def get(self, sources: list[RamanAimingSource], event: MDAEvent) -> AimingPlan:
+        """Get the plan for *event*, reusing whatever is still valid."""
+        # keyed by the sources too as not every source is collected every event
+        key = (event.index.get("p"), tuple(map(id, sources)))
+        stamps = tuple(_stamp(s) for s in sources)
+        cached = self._plans.get(key)
+        if cached is not None and cached[0] == stamps:
+            return cached[1]
+        plan = make_plan(sources, [self._points(s, event) for s in sources])
+        if None not in stamps:
+            self._plans[key] = (stamps, plan)
+        return plan
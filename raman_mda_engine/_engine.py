@@ -1,22 +1,40 @@
 from __future__ import annotations
 
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from numbers import Real
-from typing import TYPE_CHECKING, Any, NamedTuple
+from typing import TYPE_CHECKING, Any, Callable, NamedTuple
 
 import numpy as np
 from loguru import logger
 from pymmcore_plus import CMMCorePlus
 from pymmcore_plus.mda import MDAEngine
-from useq import MDAEvent
+from useq import MDAEvent, MDASequence
 
+from ._aiming_cache import AimingPlanCache
 from ._error_handling import slack_notify
 from ._events import QRamanSignaler as RamanSignaler
-from .aiming import RamanAimingSource, SnappableRamanAimingSource
+from ._focus import FocusDriftModel
+from ._hardware_state import HardwareStateCache
+from ._merge import merge_points
+from ._path import PathOptimizer
+from ._plan import (
+    PLAN_DTYPE,
+    DeviceLatencies,
+    autofocus_mode,
+    compile_plan,
+    estimate_duration,
+    event_key,
+    event_overhead,
+    interval_seconds,
+)
+from ._profiling import PhaseTimer, timed
+from ._scheduler import PointScheduler, SkippedPoints
+from .aiming import RamanAimingSource, Schedule, SnappableRamanAimingSource
 
 if TYPE_CHECKING:
     from mda_simulator import ImageGenerator
-    from useq import MDASequence
 
 
 class EventPayload(NamedTuple):
@@ -27,6 +45,10 @@ class fakeAcquirer:
     """For development."""
 
     def collect_spectra_relative(self, points, exposure=20):
+        return self.collect_spectra_volts(self._relative_to_volts(points), exposure)
+
+    @staticmethod
+    def _relative_to_volts(points):
         points = np.asarray(points)
         if points.min() < 0 or points.max() > 1:
             raise ValueError("Points must be in [0, 1]")
@@ -34,8 +56,7 @@ class fakeAcquirer:
             raise ValueError(
                 f"volts must have shape (N, 2) but has shape {points.shape}"
             )
-        points = (np.ascontiguousarray(points) - 0.5) * 1.2
-        return self.collect_spectra_volts(points, exposure)
+        return (np.ascontiguousarray(points) - 0.5) * 1.2
 
     def collect_spectra_volts(self, points, exposure=20):
         points = np.ascontiguousarray(points)
@@ -51,6 +72,8 @@ class RamanEngine(MDAEngine):
         default_rm_exp: float = 20.0,
         spectra_collector=None,
         sources: list[RamanAimingSource] = None,
+        filter_settle: Callable[[], None] | None = None,
+        cache_hardware_state: bool = True,
     ) -> None:
         """
         Create a pymmcore-plus mda engine that also collects Raman data.
@@ -65,7 +88,16 @@ class RamanEngine(MDAEngine):
             If None use the default - or nothign if not importable
         sources : iterable
             Collection of aiming sources to aim the raman laser.
+        filter_settle : callable, optional
+            Called after the autofocus filter is inserted or removed and should
+            block until it has settled, e.g. by polling the DAQ. Defaults to
+            sleeping for 4 seconds.
+        cache_hardware_state : bool, default True
+            Whether to skip stage moves, config and exposure changes that would not
+            change anything.
         """
+        if mmc is None:
+            mmc = CMMCorePlus.instance()
         super().__init__(mmc)
         self.raman_events = RamanSignaler()
         self._rng = np.random.default_rng()
@@ -84,12 +116,39 @@ class RamanEngine(MDAEngine):
                     "Could not import SpectraCollector - No raman collection"
                 )
 
+        self.filter_settle = filter_settle or partial(time.sleep, 4)
+        # set `timer.enabled = True` to record how long each phase takes
+        self.timer = PhaseTimer()
+        # kept between sequences so each run starts from the last known focus
+        self.focus_model = FocusDriftModel()
         self._rm_meta = None
+        self._rm_overlap = False
+        self._rm_optimize_path = False
+        self._rm_min_spacing = 0.0
+        self._rm_max_rounds = 3
+        self._path_optimizer = PathOptimizer()
+        # points per request to collectors with a ``submit`` method
+        self.submit_batch = 256
+        self._executor: ThreadPoolExecutor | None = None
+        self._aiming_cache = AimingPlanCache()
+        self._plan = np.zeros(0, dtype=PLAN_DTYPE)
+        self._plan_index: dict[tuple, int] = {}
+        # measured seconds per raman point, including the exposure
+        self._rm_point_cost: float | None = None
+        # the length of the last spectra, for events without any points
+        self._rm_n_wavenumbers = 1340
+        # what the hardware costs, for estimates and the raman time budget
+        self.latencies = DeviceLatencies()
+        # which points to collect when they don't all fit in the time budget
+        self.scheduler = PointScheduler()
         self.aiming_sources = sources if sources is not None else []
         self._sources: list[RamanAimingSource]
+        # `image_ready` of the sources that want every image that is snapped
+        self._image_hooks: list[Callable[[MDAEvent, np.ndarray], Any]] = []
 
         # default engine doesn't do this in super to avoid import loops
-        self._mmc = CMMCorePlus.instance()
+        self._mmc = mmc
+        self._hw_state = HardwareStateCache(self._mmc, enabled=cache_hardware_state)
 
     @property
     def aiming_sources(self) -> list[RamanAimingSource]:
@@ -129,9 +188,14 @@ class RamanEngine(MDAEngine):
     def _event_to_index(self, event: MDAEvent) -> tuple[int, ...]:
         return tuple(event.index[a] for a in self._axis_order)
 
-    def record_raman(self, event: MDAEvent):
+    @timed("collect_raman")
+    def _collect_raman(
+        self, event: MDAEvent
+    ) -> tuple[np.ndarray, np.ndarray, list[str]]:
         """
-        Record and save the raman spectra for the current position and time.
+        Aim the laser and collect the raman spectra for an event.
+
+        This does not emit any signals so that it can be run from a worker thread.
 
         Parameters
         ----------
@@ -141,30 +205,271 @@ class RamanEngine(MDAEngine):
         Returns
         -------
         spec : (N, 1340) array of float
+        points : (N, 2) relative positions where the laser was aimed
+        which : (N,) label for each point
         """
-        points = []
-        which = []
-        for source in self.aiming_sources:
-            new_points = source.get_mda_points(event)
-            points.append(new_points)
-            which.extend([source.name] * len(new_points))
-        points = np.vstack(points)
+        sources = self._event_sources(event)
+        plan = self._aiming_cache.get(sources, event)
+        points, which = plan.points, plan.which
+        exposure = np.repeat(
+            [self._source_exposure(s) for s in sources], np.diff(plan.offsets)
+        )
+        # the index in *sources* of each point
+        owner = np.repeat(np.arange(len(sources)), np.diff(plan.offsets))
 
         p, t = event.index["p"], event.index.get("t", 0)
+        # worked out once, the refinement rounds get what the first pass leaves
+        capacity = self.scheduler.capacity(
+            self._plan_index.get(event_key(event)), self._point_cost(), len(points)
+        )
+        keep = self.scheduler.fit(event, sources, plan, capacity)
+        if keep is not None:
+            logger.warning(
+                f"raman time budget: collecting {len(keep)} of {len(points)} points"
+                f" at {p=}, {t=}"
+            )
+            points = points[keep]
+            which = [which[i] for i in keep]
+            exposure = exposure[keep]
+            owner = owner[keep]
         logger.info(f"collecting raman: {p=}, {t=}")
+        spec, points = self._collect_merged(points, exposure)
+        left = None if capacity is None else capacity - len(points)
+        return self._refine(event, sources, owner, left, spec, points, which)
 
-        spec = self._spectra_collector.collect_spectra_relative(
-            points, self._default_rm_exp
+    def _collect_merged(
+        self, points: np.ndarray, exposure: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Collect spectra at *points*, only once for points closer than min_spacing.
+
+        Returns the spectrum of each point and where it was actually collected,
+        which for a merged point is the point it was merged into. Merged points
+        share both so they can be told apart from separate measurements.
+        """
+        if self._rm_min_spacing > 0:
+            # overlapping sources share the spectrum of each merged point
+            unique, inverse = merge_points(points, self._rm_min_spacing, exposure)
+        else:
+            unique = inverse = np.arange(len(points))
+        if len(unique) < len(points):
+            logger.debug(f"merged {len(points)} raman points into {len(unique)}")
+            spec = self._collect_spectra(
+                points[unique], exposure[unique], self._rm_optimize_path
+            )
+            return spec[inverse], points[unique][inverse]
+        return self._collect_spectra(points, exposure, self._rm_optimize_path), points
+
+    def _refine(
+        self,
+        event: MDAEvent,
+        sources: list[RamanAimingSource],
+        owner: np.ndarray,
+        left: int | None,
+        spec: np.ndarray,
+        points: np.ndarray,
+        which: list[str],
+    ) -> tuple[np.ndarray, np.ndarray, list[str]]:
+        """
+        Collect more points for the sources that choose them from the spectra.
+
+        Sources with a ``refine(event, points, spectra)`` method are given their
+        points and spectra from the last round and return the points to collect
+        in the next one, until none of them return any or after
+        ``max_rounds`` rounds. The points of every round are returned together.
+        *owner* is the index in *sources* of each of *points* and *left* how
+        many more points fit in the time budget, None if there is no budget.
+
+        Refined points are merged like the others and count against the time
+        budget. Once they use up *left* the refined points of the sources with the
+        lowest priority are dropped.
+        """
+        refiners = [s for s in sources if callable(getattr(s, "refine", None))]
+        if not refiners:
+            return spec, points, which
+        # by identity rather than name, two sources may share a name
+        last = {
+            id(s): (points[owner == i], spec[owner == i])
+            for i, s in enumerate(sources)
+            if callable(getattr(s, "refine", None))
+        }
+        all_spec, all_points, all_which = [spec], [points], list(which)
+        for _ in range(self._rm_max_rounds):
+            if left is not None and left <= 0:
+                break
+            new = []
+            for source in refiners:
+                pts, sp = last.get(id(source), (np.empty((0, 2)), None))
+                if len(pts):
+                    extra = np.asarray(source.refine(event, pts, sp), dtype=float)
+                    if len(extra):
+                        new.append((source, extra.reshape(-1, 2)))
+            if new and left is not None:
+                new = self._fit_refined(event, new, left)
+                left -= sum(len(extra) for _, extra in new)
+            if not new:
+                break
+            counts = [len(extra) for _, extra in new]
+            new_points = np.vstack([extra for _, extra in new])
+            exposure = np.repeat([self._source_exposure(s) for s, _ in new], counts)
+            new_spec, new_points = self._collect_merged(new_points, exposure)
+            logger.debug(f"collected {len(new_points)} refined raman points")
+            last = {}
+            offsets = np.cumsum([0, *counts])
+            for (source, extra), start, stop in zip(new, offsets[:-1], offsets[1:]):
+                last[id(source)] = (new_points[start:stop], new_spec[start:stop])
+                all_which.extend([source.name] * len(extra))
+            all_spec.append(new_spec)
+            all_points.append(new_points)
+        if len(all_spec) == 1:
+            return spec, points, which
+        return np.concatenate(all_spec), np.vstack(all_points), all_which
+
+    def _fit_refined(
+        self,
+        event: MDAEvent,
+        new: list[tuple[RamanAimingSource, np.ndarray]],
+        left: int,
+    ) -> list[tuple[RamanAimingSource, np.ndarray]]:
+        """Keep at most *left* of the refined points, highest priority first."""
+        if sum(len(extra) for _, extra in new) <= left:
+            return new
+        p, t = event.index["p"], event.index.get("t", 0)
+        order = sorted(
+            range(len(new)),
+            key=lambda i: getattr(new[i][0], "priority", 0),
+            reverse=True,
         )
+        keep: dict[int, np.ndarray] = {}
+        for i in order:
+            source, extra = new[i]
+            k = max(min(len(extra), left), 0)
+            left -= k
+            if k < len(extra):
+                logger.warning(
+                    f"raman time budget: collecting {k} of {len(extra)} refined"
+                    f" points of {source.name} at {p=}, {t=}"
+                )
+                self.scheduler.skipped.append(
+                    SkippedPoints(dict(event.index), source.name, len(extra), k)
+                )
+            if k:
+                keep[i] = extra[:k]
+        return [(new[i][0], keep[i]) for i in sorted(keep)]
+
+    def _event_sources(self, event: MDAEvent) -> list[RamanAimingSource]:
+        """Get the aiming sources whose schedule includes *event*."""
+        row = self._plan_index.get(event_key(event))
+        if row is None:
+            return self.aiming_sources
+        mask = int(self._plan["sources"][row])
+        return [s for i, s in enumerate(self.aiming_sources) if mask >> i & 1]
+
+    def _source_exposure(self, source: RamanAimingSource) -> Real:
+        exposure = getattr(source, "schedule", Schedule()).exposure
+        return self._default_rm_exp if exposure is None else exposure
+
+    def _point_cost(self) -> float:
+        """Seconds per raman point, measured if possible."""
+        if self._rm_point_cost is not None:
+            return self._rm_point_cost
+        return self._default_rm_exp / 1000 + self.latencies.raman_per_point
+
+    def _collect_spectra(
+        self,
+        points: np.ndarray,
+        exposure: Real | np.ndarray,
+        optimize_path: bool = False,
+    ) -> np.ndarray:
+        """
+        Collect spectra at *points*, optionally visiting them in a shorter order.
 
-        self.raman_events.ramanSpectraReady.emit(event, spec, points, which)
+        *exposure* can also be given per point, in which case the points with the
+        same exposure are collected in a single call. The spectra are always
+        returned in the same order as *points*.
+        """
+        if not len(points):
+            # e.g. a segmentation that found no cells, which the collector may
+            # not accept
+            return np.empty((0, self._rm_n_wavenumbers))
+        collector = self._spectra_collector
+        # collectors that can have several requests in flight, e.g.
+        # `RemoteSpectraCollector`, get every batch up front so that sending
+        # the next batch overlaps collecting the last one
+        submit = getattr(collector, "submit", None)
+        exposure = np.asarray(exposure)
+        groups = np.unique(exposure)
+        if len(groups) <= 1:
+            exp = groups[0] if len(groups) else self._default_rm_exp
+            group_idx = [(float(exp), np.arange(len(points)))]
+        else:
+            group_idx = [(float(e), np.flatnonzero(exposure == e)) for e in groups]
+        start = time.perf_counter()
+        parts = []
+        for exp, idx in group_idx:
+            if optimize_path:
+                idx = idx[self._path_optimizer.permutation(points[idx])]
+            if callable(submit):
+                for chunk in np.array_split(idx, -(-len(idx) // self.submit_batch)):
+                    parts.append((chunk, submit(points[chunk], exp)))
+            else:
+                parts.append(
+                    (idx, collector.collect_spectra_relative(points[idx], exp))
+                )
+        if len(parts) == 1 and not optimize_path:
+            spec = parts[0][1]
+            spec = spec.result() if isinstance(spec, Future) else spec
+        else:
+            spec = None
+            for idx, part in parts:
+                if isinstance(part, Future):
+                    part = part.result()
+                if spec is None:
+                    spec = np.empty((len(points), *part.shape[1:]), dtype=part.dtype)
+                spec[idx] = part
+        cost = (time.perf_counter() - start) / len(points)
+        if self._rm_point_cost is None:
+            self._rm_point_cost = cost
+        else:
+            self._rm_point_cost = 0.8 * self._rm_point_cost + 0.2 * cost
+        self._rm_n_wavenumbers = spec.shape[-1]
+        return spec
+
+    def record_raman(self, event: MDAEvent):
+        """
+        Record and save the raman spectra for the current position and time.
+
+        Parameters
+        ----------
+        event : MDAEvent
+            From the mda sequence.
+
+        Returns
+        -------
+        spec : (N, 1340) array of float
+        """
+        spec, points, which = self._collect_raman(event)
+        with self.timer.span("emit_raman", event):
+            self.raman_events.ramanSpectraReady.emit(event, spec, points, which)
+        return spec
+
+    def _submit_raman(self, event: MDAEvent) -> Future:
+        """Start collecting raman for *event* on the worker thread."""
+        if self._executor is None:
+            # a single worker so that collections can never interleave
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="raman"
+            )
+        return self._executor.submit(self._collect_raman, event)
 
     @slack_notify
     def snap_raman(
         self,
         exposure: Real = None,
-        aiming_sources: None
-        | (SnappableRamanAimingSource | list[SnappableRamanAimingSource]) = None,
+        aiming_sources: None | (
+            SnappableRamanAimingSource | list[SnappableRamanAimingSource]
+        ) = None,
+        optimize_path: bool = False,
     ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
         Record raman.
@@ -175,6 +480,9 @@ class RamanEngine(MDAEngine):
             The exposure time to use, defaults to the *default_rm_exposure*
         aiming_sources : list[SnappableAimingSource]
             The aiming sources to use
+        optimize_path : bool, default False
+            Whether to reorder the points to minimize galvo travel. The returned
+            spectra are in the same order as the points either way.
 
         Returns
         -------
@@ -206,14 +514,120 @@ class RamanEngine(MDAEngine):
         if exposure is None:
             exposure = self._default_rm_exp  # type: ignore
 
-        spec = self._spectra_collector.collect_spectra_relative(points, exposure)
+        spec = self._collect_spectra(points, exposure, optimize_path)
 
         return spec, points, which
 
+    def _raman_z(self, raman_meta: dict, sequence: MDASequence) -> np.ndarray:
+        """Get the z indices to collect raman at from the sequence metadata."""
+        z = raman_meta.get("z", "all")
+        z_index = self._sequence_axis_order(sequence).index("z")
+        if isinstance(z, str):
+            if z.lower() == "center":
+                n_z = sequence.shape[z_index]
+                if n_z % 2 == 0:
+                    raise ValueError("for z=center n_z must be odd.")
+                z = np.array(n_z // 2)
+            elif z.lower() in ["all", "stack"]:
+                z = np.arange(sequence.shape[z_index])
+        else:
+            z = np.asanyarray(z)
+        return z
+
+    def _compile(self, sequence: MDASequence) -> tuple[np.ndarray, dict]:
+        raman_meta = sequence.metadata.get("raman", None)
+        auto_meta = sequence.metadata.get("autofocus", None)
+        af_mode = None
+        if auto_meta:
+            af_mode = autofocus_mode(sequence, auto_meta.get("mode", "position"))
+        if not raman_meta:
+            return compile_plan(sequence, autofocus=af_mode)
+        # reuses the points built in setup_sequence
+        n_points = {
+            p: self._aiming_cache.counts(self.aiming_sources, p)
+            for p in range(max(len(sequence.stage_positions), 1))
+        }
+        schedules = []
+        for source in self.aiming_sources:
+            schedule = getattr(source, "schedule", Schedule())
+            z = schedule.z
+            if z is not None:
+                z = self._raman_z({"z": z}, sequence)
+            schedules.append((schedule.t_stride, z, schedule.exposure))
+        return compile_plan(
+            sequence,
+            raman_channel=raman_meta.get("channel", "BF"),
+            raman_z=self._raman_z(raman_meta, sequence),
+            n_points=n_points,
+            autofocus=af_mode,
+            schedules=schedules,
+            raman_exposure=self._default_rm_exp,
+        )
+
+    def estimate(
+        self,
+        sequence: MDASequence,
+        latencies: DeviceLatencies | None = None,
+        camera_exposure: float | None = None,
+    ) -> float:
+        """
+        Predict how long a sequence will take without running it.
+
+        Parameters
+        ----------
+        sequence : MDASequence
+            The sequence to estimate.
+        latencies : DeviceLatencies, optional
+            How long each hardware step takes, see `DeviceLatencies.measure`.
+            Defaults to `latencies`, with the raman cost per point measured from
+            previous collections if there were any.
+        camera_exposure : float, optional
+            Exposure in ms for events that don't set one. Defaults to the
+            current camera exposure.
+
+        Returns
+        -------
+        float
+            The predicted duration in seconds.
+        """
+        if latencies is None:
+            latencies = self.latencies
+            if self._rm_point_cost is not None:
+                latencies = latencies._replace(
+                    raman_per_point=max(
+                        self._rm_point_cost - self._default_rm_exp / 1000, 0
+                    )
+                )
+        if camera_exposure is None:
+            camera_exposure = self._mmc.getExposure()
+        plan, _ = self._compile(sequence)
+        raman_meta = sequence.metadata.get("raman", None) or {}
+        return estimate_duration(
+            plan,
+            sequence,
+            latencies,
+            camera_exposure,
+            overlap=bool(raman_meta.get("overlap", False)),
+        )
+
     @slack_notify
     def setup_sequence(self, sequence: MDASequence) -> None:
         super().setup_sequence(sequence)
+        # the hardware may have been touched since the last sequence
+        self._hw_state.clear()
+        self._hw_state.connect()
+        self.timer.clear()
+        # sources that remember images forget those of the last sequence
+        for source in self.aiming_sources:
+            reset = getattr(source, "reset", None)
+            if callable(reset):
+                reset()
         raman_meta = sequence.metadata.get("raman", None)
+        self._rm_meta = None
+        self._rm_overlap = False
+        self._rm_optimize_path = False
+        self._rm_min_spacing = 0.0
+        self._rm_max_rounds = 3
         if raman_meta:
             if self._spectra_collector is None:
                 raise RuntimeError("Spectra Collector not set - cannot collect Raman.")
@@ -221,55 +635,136 @@ class RamanEngine(MDAEngine):
                 raise RuntimeError("No aiming sources - cannot collect Raman.")
             self._rm_channel = raman_meta.get("channel", "BF")
 
-            z = raman_meta.get("z", "all")
-            z_index = self._sequence_axis_order(sequence).index("z")
-            if isinstance(z, str):
-                if z.lower() == "center":
-                    n_z = sequence.shape[z_index]
-                    if n_z % 2 == 0:
-                        raise ValueError("for z=center n_z must be odd.")
-                    z = np.array(n_z // 2)
-                elif z.lower() in ["all", "stack"]:
-                    z = np.arange(sequence.shape[z_index])
-            else:
-                z = np.asanyarray(z)
-
-            self._rm_z = z
+            self._rm_z = self._raman_z(raman_meta, sequence)
+            # collect raman on a worker thread while the camera snaps
+            self._rm_overlap = bool(raman_meta.get("overlap", False))
+            # visit the points in an order that minimizes galvo travel
+            self._rm_optimize_path = bool(raman_meta.get("optimize_path", False))
+            # collect points closer than this, in relative coordinates, only once
+            self._rm_min_spacing = float(raman_meta.get("min_spacing", 0) or 0)
+            # most extra rounds of points from sources that refine their points
+            self._rm_max_rounds = int(raman_meta.get("max_rounds", 3))
+            # "budget": True to fit the points into the time plan interval, or
+            # seconds per event. Points that don't fit are collected later.
             self._rm_meta = raman_meta
 
-        self._z_rel = sequence.z_plan.positions()
+            # resolve the aiming points of each position once up front
+            self._aiming_cache.clear()
+            self._aiming_cache.build(
+                self.aiming_sources, range(max(len(sequence.stage_positions), 1))
+            )
+
+        self._z_rel = sequence.z_plan.positions() if sequence.z_plan else []
         if "autofocus" in sequence.metadata:
             auto_meta = sequence.metadata["autofocus"]
             self._autofocus = True
             self._auto_device = auto_meta["autofocus_device"]
             self._rel_device = auto_meta["rel_focus_device"]
+            # "position": focus whenever the position changes
+            # "timepoint": focus every position in one pass at the start of each
+            # timepoint so that the filter only moves twice per timepoint
+            self._af_mode = auto_meta.get("mode", "position")
+            if self._af_mode not in ("position", "timepoint"):
+                raise ValueError(
+                    "autofocus mode must be 'position' or 'timepoint',"
+                    f" got {self._af_mode!r}"
+                )
+            mode = autofocus_mode(sequence, self._af_mode)
+            if mode != self._af_mode:
+                logger.warning(
+                    "autofocus mode 'timepoint' needs stage positions inside t in"
+                    " the axis order, using 'position'"
+                )
+                self._af_mode = mode
+            # skip the autofocus when the predicted drift is smaller than this
+            self._af_skip_tol = auto_meta.get("skip_tolerance", None)
+            # but measure at least every this many autofocuses of a position
+            self._af_max_skips = int(auto_meta.get("max_skips", 5))
+            # pos -> autofocuses skipped in a row
+            self._af_skips: dict[int, int] = {}
             self._ref_z = {}
         else:
             self._autofocus = False
 
+        self._image_hooks = [
+            source.image_ready
+            for source in self.aiming_sources
+            if callable(getattr(source, "image_ready", None))
+        ]
+        self._positions = list(sequence.stage_positions)
         self._last_pos = -1
+        self._last_t = -1
+        # what each event does, looked up in the hot path
+        self._plan, self._plan_index = self._compile(sequence)
+
+        budget = (self._rm_meta or {}).get("budget", None)
+        overhead = np.zeros(len(self._plan))
+        if budget is True:
+            overhead = event_overhead(
+                self._plan, self.latencies, self._mmc.getExposure()
+            )
+        self.scheduler.start(
+            self._plan, overhead, interval_seconds(sequence), budget=budget
+        )
 
-    def _run_autofocus(self, event: MDAEvent, pos: int):
-        if (self._spectra_collector is not None) and (
-            type(self._spectra_collector) is not fakeAcquirer
-        ):
+    def teardown_sequence(self, sequence: MDASequence) -> None:
+        # wait for any raman still in flight and stop the worker thread
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        # stop following the core until the next sequence
+        self._hw_state.close()
+        super().teardown_sequence(sequence)
+
+    def _is_raman_event(self, event: MDAEvent) -> bool:
+        row = self._plan_index.get(event_key(event))
+        if row is not None:
+            return bool(self._plan["raman"][row])
+        # not from the sequence, e.g. added by hand
+        return (
+            event.channel is not None
+            and event.channel.config == self._rm_channel
+            and event.index.get("z", 0) in self._rm_z
+        )
+
+    def _has_filter(self) -> bool:
+        # only the real spectra collector has a filter to move
+        return (self._spectra_collector is not None) and not isinstance(
+            self._spectra_collector, fakeAcquirer
+        )
+
+    def _insert_filter(self):
+        if self._has_filter():
             # we're at MIT and should insert the filter
             self._spectra_collector.daq.insert_filter()
-            time.sleep(4)
-        # set to the last known good z for this position
+            self.filter_settle()
+
+    def _remove_filter(self):
+        if self._has_filter():
+            self._spectra_collector.daq.remove_filter()
+            self.filter_settle()
+
+    def _focus_position(
+        self, pos: int, pfs_z: float | None, xy: tuple[float, float] | None = None
+    ):
+        """Run the hardware autofocus at the current XY and store the result."""
+        now = time.time()
+        # set to the predicted z for this position
         # to give ourselves the best shot of PFS working
-        if pos in self._ref_z:
-            self._mmc.setPosition(self._rel_device, self._ref_z[pos])
-        elif (pos - 1) in self._ref_z:
-            # nothing found here yet, use the previous position as
+        guess = self.focus_model.predict(pos, xy, now)
+        if guess is None and (pos - 1) in self._ref_z:
+            # nothing known about here or nearby, use the previous position as
             # guessed starting point
-            self._mmc.setPosition(self._rel_device, self._ref_z[pos - 1])
+            guess = self._ref_z[pos - 1]
+        if guess is not None:
+            self._mmc.setPosition(self._rel_device, guess)
         self._mmc.waitForSystem()
 
         # compute new focus
         self._mmc.enableContinuousFocus(False)
-        pfs_z = np.array(event.z_pos - self._z_rel)
-        self._mmc.setPosition(self._auto_device, pfs_z[0])
+        # without a z to go on keep the current offset
+        if pfs_z is not None:
+            self._mmc.setPosition(self._auto_device, pfs_z)
         self._mmc.waitForSystem()
         try:
             self._mmc.fullFocus()
@@ -282,60 +777,153 @@ class RamanEngine(MDAEngine):
                 self._mmc.fullFocus()
                 self._mmc.waitForSystem()
         self._ref_z[pos] = self._mmc.getPosition(self._rel_device)
+        self.focus_model.record(pos, self._ref_z[pos], xy, now)
+        self._af_skips[pos] = 0
         self._mmc.enableContinuousFocus(False)
+
+    def _skip_autofocus(self, pos: int, xy: tuple[float, float] | None) -> bool:
+        """
+        Use the predicted focus of *pos* if it is unlikely to have drifted.
+
+        Decided before the filter is inserted so that a skip costs nothing.
+        """
+        if self._af_skip_tol is None:
+            return False
+        skips = self._af_skips.get(pos, 0)
+        if skips >= self._af_max_skips:
+            return False
+        now = time.time()
+        drift = self.focus_model.predicted_drift(pos, now, xy)
+        if drift is None or drift >= self._af_skip_tol:
+            return False
+        # not recorded in the model so that the predicted drift keeps
+        # growing until a real measurement is needed
+        self._ref_z[pos] = self.focus_model.predict(pos, xy, now)
+        self._af_skips[pos] = skips + 1
+        logger.info(f"skipping autofocus: {pos=}, {drift=:.3f}")
+        return True
+
+    def _base_z(self, event: MDAEvent) -> float | None:
+        """Get the z of *event* without its z plan offset, None if it has no z."""
+        if event.z_pos is None:
+            return None
+        if "z" not in event.index or not len(self._z_rel):
+            return event.z_pos
+        return event.z_pos - self._z_rel[event.index["z"]]
+
+    @timed("autofocus")
+    def _run_autofocus(self, event: MDAEvent, pos: int):
+        xy = None
+        if event.x_pos is not None and event.y_pos is not None:
+            xy = (event.x_pos, event.y_pos)
+        if self._skip_autofocus(pos, xy):
+            return
+        self._insert_filter()
+        self._focus_position(pos, self._base_z(event), xy)
         # put before the wait for system, so that these independent
         # parts can run at the same time.
-        if (self._spectra_collector is not None) and (
-            type(self._spectra_collector) is not fakeAcquirer
-        ):
-            # we're at MIT and should insert the filter
-            self._spectra_collector.daq.remove_filter()
-            time.sleep(4)
+        self._remove_filter()
+        self._mmc.waitForSystem()
+        # the focus drives were moved directly
+        self._hw_state.clear()
+
+    @timed("autofocus")
+    def _run_autofocus_all(self, event: MDAEvent):
+        """Autofocus every position of the sequence with one filter insertion."""
+        todo = []
+        for pos, position in enumerate(self._positions):
+            x = position.x if position.x is not None else self._mmc.getXPosition()
+            y = position.y if position.y is not None else self._mmc.getYPosition()
+            if not self._skip_autofocus(pos, (x, y)):
+                todo.append((pos, position, (x, y)))
+        if not todo:
+            # every position was skipped so the filter doesn't need to move
+            return
+        self._insert_filter()
+        for pos, position, xy in todo:
+            self._mmc.setXYPosition(*xy)
+            pfs_z = position.z if position.z is not None else self._base_z(event)
+            self._focus_position(pos, pfs_z, xy)
+        self._remove_filter()
         self._mmc.waitForSystem()
+        # the stages were moved directly
+        self._hw_state.clear()
 
     @slack_notify
+    @timed("setup_event")
     def setup_event(self, event: MDAEvent) -> None:
+        if self._autofocus and self._af_mode == "timepoint" and self._positions:
+            t = event.index.get("t", 0)
+            if t != self._last_t:
+                self._last_t = t
+                # before moving to this event's XY as this visits every position
+                self._run_autofocus_all(event)
+
+        # only wait for the system if something was actually asked to move
+        moved = False
         if event.x_pos is not None or event.y_pos is not None:
             x = event.x_pos if event.x_pos is not None else self._mmc.getXPosition()
             y = event.y_pos if event.y_pos is not None else self._mmc.getYPosition()
-            self._mmc.setXYPosition(x, y)
+            moved |= self._hw_state.set_xy(x, y)
         if event.channel is not None:
-            self._mmc.setConfig(event.channel.group, event.channel.config)
+            moved |= self._hw_state.set_config(
+                event.channel.group, event.channel.config
+            )
 
         if event.z_pos is not None:
             if self._autofocus:
                 pos = event.index["p"]
-                if pos != self._last_pos:
+                if self._af_mode == "position" and pos != self._last_pos:
                     self._last_pos = pos
                     # moved to a new position
                     # figure out what the PFS-Offset was
                     self._run_autofocus(event, pos)
-                z_pos = self._ref_z[pos] + self._z_rel[event.index["z"]]
-                self._mmc.setPosition(self._rel_device, z_pos)
+                z_pos = self._ref_z[pos] + (event.z_pos - self._base_z(event))
+                moved |= self._hw_state.set_position(z_pos, self._rel_device)
             else:
-                self._mmc.setPosition(event.z_pos)
+                moved |= self._hw_state.set_position(event.z_pos)
 
         if event.exposure is not None:
-            self._mmc.setExposure(event.exposure)
+            self._hw_state.set_exposure(event.exposure)
 
-        self._mmc.waitForSystem()
+        if moved:
+            with self.timer.span("wait_for_system", event):
+                self._mmc.waitForSystem()
 
     @slack_notify
     def exec_event(self, event: MDAEvent) -> Any:
-        if self._rm_meta:
-            if (
-                event.channel.config == self._rm_channel
-                and event.index["z"] in self._rm_z
-            ):
+        raman_future = None
+        if self._rm_meta and self._is_raman_event(event):
+            if self._rm_overlap:
+                raman_future = self._submit_raman(event)
+            else:
                 self.record_raman(event)
         try:
-            self._mmc.snapImage()
-        except RuntimeError:
-            time.sleep(0.5)
-            self._mmc.waitForSystem()
-            self._mmc.snapImage()
+            with self.timer.span("snap", event):
+                try:
+                    self._mmc.snapImage()
+                except RuntimeError:
+                    with self.timer.span("snap_retry", event):
+                        time.sleep(0.5)
+                        self._mmc.waitForSystem()
+                        self._mmc.snapImage()
+                image = self._mmc.getImage()
+        finally:
+            if raman_future is not None:
+                # Block until the galvo is done so the next setup_event can't
+                # move the stage mid collection, even if the snap failed.
+                with self.timer.span("wait_raman", event):
+                    raman_result = raman_future.result()
+        for image_ready in self._image_hooks:
+            # e.g. sources that segment the image to find where to aim
+            image_ready(event, image)
+        if raman_future is not None:
+            # emitting here rather than from the worker keeps ramanSpectraReady
+            # on this thread and in event order
+            with self.timer.span("emit_raman", event):
+                self.raman_events.ramanSpectraReady.emit(event, *raman_result)
         # TODO: need a return object including the raman channel so that
         # napari-micro can interpret. Currently cannot make raman events
         # bc they mess with the shape of the acquisition for napari-micro
         # and it messes up display.
-        return EventPayload(image=self._mmc.getImage())
+        return EventPayload(image=image)
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import json
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+
+import numpy as np
+
+__all__ = [
+    "FocusDriftModel",
+]
+
+
+class FocusDriftModel:
+    """
+    Predict the focus of each position from its history.
+
+    Each position's focus is fit with a line over time using its most recent
+    measurements. A position without any history borrows the most recent focus of
+    the nearest position in XY. The history is kept between sequences so later
+    runs start from a good guess. A position's history is dropped when it is
+    recorded at an XY further than *xy_tolerance* from where it was before, so a
+    new sequence whose position list differs doesn't inherit another place's
+    drift.
+
+    Parameters
+    ----------
+    window : int, default 5
+        How many of the most recent measurements of a position to fit.
+    min_history : int, default 3
+        How many measurements a position needs before its drift is trusted enough
+        to skip the autofocus.
+    xy_tolerance : float, default 10
+        How far in stage units a position can move and keep its history.
+    """
+
+    def __init__(
+        self, window: int = 5, min_history: int = 3, xy_tolerance: float = 10.0
+    ) -> None:
+        self._window = window
+        self._min_history = min_history
+        self._xy_tolerance = xy_tolerance
+        # pos -> deque of (timestamp, z)
+        self._history: defaultdict[int, deque] = defaultdict(
+            lambda: deque(maxlen=self._window)
+        )
+        self._xy: dict[int, tuple[float, float]] = {}
+
+    def clear(self):
+        self._history.clear()
+        self._xy.clear()
+
+    def _moved(self, pos: int, xy: tuple[float, float] | None) -> bool:
+        """Whether *xy* is somewhere else than the history of *pos* is from."""
+        known = self._xy.get(pos)
+        if xy is None or known is None:
+            return False
+        return bool(np.hypot(xy[0] - known[0], xy[1] - known[1]) > self._xy_tolerance)
+
+    def record(
+        self,
+        pos: int,
+        z: float,
+        xy: tuple[float, float] | None = None,
+        timestamp: float | None = None,
+    ):
+        """
+        Add a focus measurement.
+
+        Parameters
+        ----------
+        pos : int
+            The position index.
+        z : float
+            The focus that was found.
+        xy : (float, float), optional
+            The stage position, used to guess the focus of nearby positions.
+        timestamp : float, optional
+            In seconds since the epoch, defaults to now.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        if self._moved(pos, xy):
+            self._history.pop(pos, None)
+        self._history[pos].append((timestamp, float(z)))
+        if xy is not None:
+            self._xy[pos] = (float(xy[0]), float(xy[1]))
+
+    def _nearest(self, xy: tuple[float, float]) -> int | None:
+        known = [p for p in self._xy if self._history.get(p)]
+        if not known:
+            return None
+        dist = np.linalg.norm(np.array([self._xy[p] for p in known]) - xy, axis=1)
+        return known[int(np.argmin(dist))]
+
+    def predict(
+        self,
+        pos: int,
+        xy: tuple[float, float] | None = None,
+        timestamp: float | None = None,
+    ) -> float | None:
+        """
+        Predict the focus of a position.
+
+        The history of *pos* is ignored if *xy* is not where it was recorded.
+
+        Returns
+        -------
+        z : float or None
+            None if there is nothing to base a guess on.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        history = None if self._moved(pos, xy) else self._history.get(pos)
+        if not history:
+            if xy is None:
+                return None
+            nearest = self._nearest(xy)
+            if nearest is None:
+                return None
+            return self._history[nearest][-1][1]
+        if len(history) == 1:
+            return history[-1][1]
+        t, z = np.array(history).T
+        # relative to the latest to keep the fit well conditioned
+        slope, intercept = np.polyfit(t - t[-1], z, 1)
+        return float(intercept + slope * (timestamp - t[-1]))
+
+    def predicted_drift(
+        self,
+        pos: int,
+        timestamp: float | None = None,
+        xy: tuple[float, float] | None = None,
+    ) -> float | None:
+        """
+        Predict how far the focus has moved since it was last measured.
+
+        Returns None if the position has too little history to trust the
+        estimate, or if *xy* is not where the history was recorded.
+        """
+        if self._moved(pos, xy):
+            return None
+        history = self._history.get(pos)
+        if not history or len(history) < self._min_history:
+            return None
+        return abs(self.predict(pos, timestamp=timestamp) - history[-1][1])
+
+    def save(self, path: str | Path):
+        """Save the history to a json file."""
+        data = {
+            "window": self._window,
+            "min_history": self._min_history,
+            "xy_tolerance": self._xy_tolerance,
+            "history": {str(p): list(h) for p, h in self._history.items()},
+            "xy": {str(p): xy for p, xy in self._xy.items()},
+        }
+        Path(path).write_text(json.dumps(data))
+
+    @classmethod
+    def load(cls, path: str | Path) -> FocusDriftModel:
+        """Load a model saved with `save`."""
+        data = json.loads(Path(path).read_text())
+        model = cls(data["window"], data["min_history"], data.get("xy_tolerance", 10.0))
+        for p, history in data["history"].items():
+            model._history[int(p)].extend(tuple(h) for h in history)
+        model._xy = {int(p): tuple(xy) for p, xy in data["xy"].items()}
+        return model
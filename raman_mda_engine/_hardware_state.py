@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pymmcore_plus import CMMCorePlus
+
+__all__ = [
+    "HardwareStateCache",
+]
+
+
+class HardwareStateCache:
+    """
+    Remember what was last sent to the hardware and skip calls that change nothing.
+
+    Each ``set_*`` method returns whether it actually issued a call, so the caller
+    can skip ``waitForSystem`` when nothing moved. Moves made outside of this
+    cache are picked up from the core's signals, so the cache only skips calls
+    while it is connected to them. Call `close` when done with it.
+
+    Parameters
+    ----------
+    mmc : CMMCorePlus
+        The core to control.
+    enabled : bool, default True
+        If False every call is issued, as if there were no cache.
+    tolerance : float, default 0.1
+        Stage positions reported by the core that are within this many microns of
+        the commanded position are not considered a change.
+    """
+
+    def __init__(
+        self, mmc: CMMCorePlus, enabled: bool = True, tolerance: float = 0.1
+    ) -> None:
+        self._mmc = mmc
+        self.enabled = enabled
+        self._tolerance = tolerance
+        self._connected = False
+        self.clear()
+        self.connect()
+
+    def _signals(self):
+        events = self._mmc.events
+        return (
+            (events.XYStagePositionChanged, self._on_xy_changed),
+            (events.stagePositionChanged, self._on_z_changed),
+            (events.exposureChanged, self._on_exposure_changed),
+            (events.systemConfigurationLoaded, self.clear),
+        )
+
+    def connect(self):
+        """Start following the core's signals, if not already."""
+        if self._connected:
+            return
+        # anything may have happened while not connected
+        self.clear()
+        for signal, slot in self._signals():
+            signal.connect(slot)
+        self._connected = True
+
+    def close(self):
+        """Stop following the core's signals, every call is issued until reconnected."""
+        if not self._connected:
+            return
+        for signal, slot in self._signals():
+            signal.disconnect(slot)
+        self._connected = False
+        self.clear()
+
+    @property
+    def _active(self) -> bool:
+        return self.enabled and self._connected
+
+    def clear(self):
+        """Forget everything so that the next calls are always issued."""
+        self._xy: tuple[float, float] | None = None
+        self._z: dict[str, float] = {}
+        self._config: dict[str, str] = {}
+        self._exposure: float | None = None
+
+    def _on_xy_changed(self, name: str, x: float, y: float):
+        if self._xy is None or name != self._mmc.getXYStageDevice():
+            return
+        if max(abs(x - self._xy[0]), abs(y - self._xy[1])) > self._tolerance:
+            self._xy = None
+
+    def _on_z_changed(self, name: str, z: float):
+        if name in self._z and abs(z - self._z[name]) > self._tolerance:
+            del self._z[name]
+
+    def _on_exposure_changed(self, camera: str, exposure: float):
+        if self._exposure is not None and exposure != self._exposure:
+            self._exposure = None
+
+    def set_xy(self, x: float, y: float) -> bool:
+        if self._active and self._xy == (x, y):
+            return False
+        self._mmc.setXYPosition(x, y)
+        self._xy = (x, y)
+        return True
+
+    def set_position(self, z: float, device: str | None = None) -> bool:
+        key = device or self._mmc.getFocusDevice()
+        if self._active and self._z.get(key) == z:
+            return False
+        if device is None:
+            self._mmc.setPosition(z)
+        else:
+            self._mmc.setPosition(device, z)
+        self._z[key] = z
+        return True
+
+    def set_config(self, group: str, config: str) -> bool:
+        # the core keeps the state of every property in memory so checking it
+        # is cheap and catches properties changed behind our back
+        if (
+            self._active
+            and self._config.get(group) == config
+            and self._mmc.getCurrentConfigFromCache(group) == config
+        ):
+            return False
+        self._mmc.setConfig(group, config)
+        self._config[group] = config
+        return True
+
+    def set_exposure(self, exposure: float) -> bool:
+        if self._active and self._exposure == exposure:
+            return False
+        self._mmc.setExposure(exposure)
+        self._exposure = exposure
+        return True
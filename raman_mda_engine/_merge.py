@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+__all__ = [
+    "merge_points",
+]
+
+
+def merge_points(
+    points: np.ndarray, min_spacing: float, groups: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Collapse points that are closer together than *min_spacing*.
+
+    Points are visited in order and each one that has not been merged yet absorbs
+    every later point within *min_spacing* of it, so points from sources earlier
+    in the list win.
+
+    Parameters
+    ----------
+    points : (N, 2) array
+        The points to merge.
+    min_spacing : float
+        Points closer than this are merged, in the same units as *points*.
+    groups : (N,) array, optional
+        Only points with equal values are merged, e.g. their exposures.
+
+    Returns
+    -------
+    keep : (M,) array of int
+        Indices of the points that are left, in increasing order.
+    inverse : (N,) array of int
+        For each point the index into *keep* of the point it was merged into, so
+        ``points[keep][inverse]`` is the closest kept point to each of *points*.
+    """
+    points = np.asarray(points)
+    n = len(points)
+    if n < 2 or not min_spacing > 0:
+        return np.arange(n), np.arange(n)
+    # pairs (i, j) with i < j, sorted so that each point's neighbours are together
+    pairs = cKDTree(points).query_pairs(min_spacing, output_type="ndarray")
+    if groups is not None:
+        groups = np.asarray(groups)
+        pairs = pairs[groups[pairs[:, 0]] == groups[pairs[:, 1]]]
+    merged_into = np.arange(n)
+    if len(pairs):
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        starts = np.searchsorted(pairs[:, 0], np.arange(n + 1))
+        absorbed = np.zeros(n, dtype=bool)
+        for i in np.unique(pairs[:, 0]).tolist():
+            if absorbed[i]:
+                continue
+            neighbours = pairs[starts[i] : starts[i + 1], 1]
+            neighbours = neighbours[~absorbed[neighbours]]
+            absorbed[neighbours] = True
+            merged_into[neighbours] = i
+    keep = np.flatnonzero(merged_into == np.arange(n))
+    return keep, np.searchsorted(keep, merged_into)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+
+import numpy as np
+
+__all__ = [
+    "PathOptimizer",
+    "optimize_path",
+]
+
+
+def _nearest_neighbour(points: np.ndarray) -> np.ndarray:
+    n = len(points)
+    tour = np.empty(n, dtype=np.intp)
+    visited = np.zeros(n, dtype=bool)
+    current = 0
+    for i in range(n):
+        tour[i] = current
+        visited[current] = True
+        if i == n - 1:
+            break
+        dist = np.einsum("ij,ij->i", points - points[current], points - points[current])
+        dist[visited] = np.inf
+        current = int(np.argmin(dist))
+    return tour
+
+
+def _two_opt(points: np.ndarray, tour: np.ndarray, max_passes: int) -> np.ndarray:
+    n = len(tour)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 2):
+            path = points[tour]
+            a, b = path[i], path[i + 1]
+            c = path[i + 2 :]
+            # the point after each candidate c, the last one has none (open path)
+            d = path[i + 3 :]
+            ab = np.linalg.norm(a - b)
+            ac = np.linalg.norm(c - a, axis=1)
+            cd = np.linalg.norm(d - c[:-1], axis=1)
+            bd = np.linalg.norm(d - b, axis=1)
+            # gain of reversing tour[i + 1 : j + 1] for every j at once
+            delta = ac - ab
+            delta[:-1] += bd - cd
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-12:
+                j += i + 2
+                tour[i + 1 : j + 1] = tour[i + 1 : j + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+    return tour
+
+
+def optimize_path(
+    points: np.ndarray, max_2opt_points: int = 2000, max_passes: int = 5
+) -> np.ndarray:
+    """
+    Find a short order to visit the points in.
+
+    A nearest neighbour tour starting from the first point, refined with 2-opt.
+    This is a heuristic so the result is short but not necessarily the shortest.
+
+    Parameters
+    ----------
+    points : (N, 2) array
+        The points to visit.
+    max_2opt_points : int, default 2000
+        Skip the 2-opt refinement for more points than this as it is O(N^2) per
+        pass.
+    max_passes : int, default 5
+        The maximum number of 2-opt passes.
+
+    Returns
+    -------
+    perm : (N,) array of int
+        Visit the points in the order ``points[perm]``.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) < 3:
+        return np.arange(len(points))
+    tour = _nearest_neighbour(points)
+    if len(points) <= max_2opt_points:
+        tour = _two_opt(points, tour, max_passes)
+    return tour
+
+
+class PathOptimizer:
+    """
+    Reorder aiming points to minimize galvo travel, remembering recent results.
+
+    Parameters
+    ----------
+    maxsize : int, default 128
+        How many point sets to remember the order of.
+    """
+
+    def __init__(self, maxsize: int = 128) -> None:
+        self._maxsize = maxsize
+        self._cache: OrderedDict[int, tuple[np.ndarray, np.ndarray]] = OrderedDict()
+
+    def clear(self):
+        self._cache.clear()
+
+    def permutation(self, points: np.ndarray) -> np.ndarray:
+        """Get the visiting order for *points*, computing it if it isn't cached."""
+        points = np.ascontiguousarray(points)
+        key = hash(points.tobytes())
+        cached = self._cache.get(key)
+        if cached is not None and np.array_equal(cached[0], points):
+            self._cache.move_to_end(key)
+            return cached[1]
+        perm = optimize_path(points)
+        self._cache[key] = (points.copy(), perm)
+        if len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+        return perm
+
+    def collect(self, collect, points: np.ndarray, *args) -> np.ndarray:
+        """
+        Call ``collect(points, *args)`` with the points in the optimized order.
+
+        The result is put back into the original order of *points*.
+        """
+        perm = self.permutation(points)
+        ordered = collect(np.asarray(points)[perm], *args)
+        spec = np.empty_like(ordered)
+        spec[perm] = ordered
+        return spec
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import time
+from datetime import timedelta
+from typing import TYPE_CHECKING, NamedTuple, Sequence
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from pymmcore_plus import CMMCorePlus
+    from useq import MDAEvent, MDASequence
+
+__all__ = [
+    "PLAN_DTYPE",
+    "DeviceLatencies",
+    "compile_plan",
+    "estimate_duration",
+    "event_key",
+    "event_overhead",
+    "interval_seconds",
+]
+
+PLAN_DTYPE = np.dtype(
+    [
+        ("p", np.int32),
+        ("t", np.int32),
+        ("z", np.int32),
+        # whether to collect raman
+        ("raman", bool),
+        # number of positions to autofocus before this event
+        ("n_autofocus", np.int32),
+        # what changes from the previous event
+        ("xy_move", bool),
+        ("z_move", bool),
+        ("config_change", bool),
+        ("n_points", np.int32),
+        # bit i is set if aiming source i is collected
+        ("sources", np.uint64),
+        # total raman exposure of all the points in seconds
+        ("dwell", np.float64),
+        # camera exposure in ms, NaN if the event doesn't set it
+        ("exposure", np.float64),
+    ]
+)
+
+
+class DeviceLatencies(NamedTuple):
+    """
+    How long the hardware takes for each step of an event, in seconds.
+
+    The defaults are rough numbers for our rig, use `measure` for real ones.
+    """
+
+    xy_move: float = 0.5
+    z_move: float = 0.05
+    config_change: float = 0.1
+    # on top of the camera exposure
+    snap: float = 0.03
+    # per position, including moving the filter
+    autofocus: float = 10.0
+    # per call to the spectra collector
+    raman_overhead: float = 0.005
+    # per point, on top of the raman exposure
+    raman_per_point: float = 0.003
+
+    @classmethod
+    def measure(
+        cls, core: CMMCorePlus, xy_step: float = 10, z_step: float = 1, **kwargs
+    ) -> DeviceLatencies:
+        """
+        Time small moves and a snap on the hardware.
+
+        The stages are returned to where they started. Latencies that can't be
+        measured this way (config changes, autofocus, raman) keep their defaults
+        unless given as keyword arguments.
+
+        Parameters
+        ----------
+        core : CMMCorePlus
+            The core to measure.
+        xy_step, z_step : float
+            The distance to move the stages in microns.
+        **kwargs
+            Values for the other latencies.
+        """
+
+        def timeit(func, *args) -> float:
+            start = time.perf_counter()
+            func(*args)
+            core.waitForSystem()
+            return time.perf_counter() - start
+
+        x, y = core.getXYPosition()
+        xy_move = timeit(core.setXYPosition, x + xy_step, y)
+        timeit(core.setXYPosition, x, y)
+        z = core.getPosition()
+        z_move = timeit(core.setPosition, z + z_step)
+        timeit(core.setPosition, z)
+        snap = timeit(core.snapImage) - core.getExposure() / 1000
+        return cls(
+            **{"xy_move": xy_move, "z_move": z_move, "snap": max(snap, 0), **kwargs}
+        )
+
+
+def event_key(event: MDAEvent) -> tuple:
+    """Key to look up an event in the plan index."""
+    return tuple(event.index.items())
+
+
+def autofocus_mode(sequence: MDASequence, mode: str | None) -> str | None:
+    """
+    Get the autofocus mode that *sequence* will actually use.
+
+    "timepoint" focuses every position whenever t changes, which only saves
+    time if all the positions are visited within each timepoint. Without
+    positions, or with t inside p in the axis order, it becomes "position".
+    """
+    if mode != "timepoint":
+        return mode
+    sizes = sequence.sizes
+    axes = [ax for ax in sequence.axis_order if sizes.get(ax, 0) > 0]
+    if not sequence.stage_positions or (
+        "t" in axes and "p" in axes and axes.index("p") < axes.index("t")
+    ):
+        return "position"
+    return mode
+
+
+def compile_plan(
+    sequence: MDASequence,
+    raman_channel: str | None = None,
+    raman_z: np.ndarray | None = None,
+    n_points: dict[int, int | Sequence[int]] | None = None,
+    autofocus: str | None = None,
+    schedules: Sequence[tuple[int, np.ndarray | None, float | None]] | None = None,
+    raman_exposure: float = 20.0,
+) -> tuple[np.ndarray, dict[tuple, int]]:
+    """
+    Work out what every event of a sequence will do ahead of time.
+
+    Parameters
+    ----------
+    sequence : MDASequence
+        The sequence to compile.
+    raman_channel : str, optional
+        The channel to collect raman on. If None, no raman is collected.
+    raman_z : array of int, optional
+        The z indices to collect raman at.
+    n_points : dict, optional
+        The number of aiming points at each position. With *schedules* this is
+        the number of points of each source at each position.
+    autofocus : {None, "position", "timepoint"}
+        The autofocus mode.
+    schedules : list of (t_stride, z, exposure), optional
+        When to collect each aiming source: every *t_stride* timepoints, at the
+        z indices *z* (None for *raman_z*), with *exposure* in ms (None for
+        *raman_exposure*). Defaults to a single source collected at every
+        timepoint.
+    raman_exposure : float, default 20
+        The raman exposure in ms of sources that don't set their own.
+
+    Returns
+    -------
+    plan : structured array of `PLAN_DTYPE`
+        One row per event, in order.
+    index : dict
+        `event_key` of each event -> its row in the plan.
+    """
+    events = list(sequence.iter_events())
+    autofocus = autofocus_mode(sequence, autofocus)
+    n_positions = max(len(sequence.stage_positions), 1)
+    n_points = n_points or {}
+    if schedules is None:
+        schedules = [(1, None, None)]
+    if len(schedules) > 64:
+        raise ValueError(f"At most 64 aiming sources, got {len(schedules)}")
+    strides = np.array([stride for stride, _, _ in schedules])
+    exposures = np.array(
+        [raman_exposure if exp is None else exp for _, _, exp in schedules]
+    )
+    plan = np.zeros(len(events), dtype=PLAN_DTYPE)
+    index = {}
+    prev = None
+    for row, event in enumerate(events):
+        p = event.index.get("p", 0)
+        t = event.index.get("t", 0)
+        z = event.index.get("z", 0)
+        channel = event.channel.config if event.channel is not None else None
+        if raman_channel is not None and channel == raman_channel:
+            active = (t % strides == 0) & [
+                bool(np.isin(z, raman_z if z_set is None else z_set))
+                for _, z_set, _ in schedules
+            ]
+        else:
+            active = np.zeros(len(schedules), dtype=bool)
+        counts = np.atleast_1d(n_points.get(p, 0)) * active
+        raman = bool(active.any())
+        if autofocus == "timepoint":
+            n_autofocus = n_positions if prev is None or t != prev[1] else 0
+        elif autofocus == "position":
+            n_autofocus = int(prev is None or p != prev[0])
+        else:
+            n_autofocus = 0
+        xy = (event.x_pos, event.y_pos)
+        plan[row] = (
+            p,
+            t,
+            z,
+            raman,
+            n_autofocus,
+            prev is None or xy != prev[2],
+            prev is None or event.z_pos != prev[3],
+            prev is None or channel != prev[4],
+            counts.sum(),
+            sum(1 << i for i in np.flatnonzero(active)),
+            (counts * exposures).sum() / 1000,
+            event.exposure if event.exposure is not None else np.nan,
+        )
+        index[event_key(event)] = row
+        prev = (p, t, xy, event.z_pos, channel)
+    return plan, index
+
+
+def interval_seconds(sequence: MDASequence) -> float:
+    """Get the interval between timepoints of a sequence in seconds, 0 if none."""
+    interval = getattr(sequence.time_plan, "interval", None)
+    if isinstance(interval, timedelta):
+        return interval.total_seconds()
+    return float(interval or 0)
+
+
+def _setup_and_snap(
+    plan: np.ndarray, latencies: DeviceLatencies, camera_exposure: float
+) -> tuple[np.ndarray, np.ndarray]:
+    lat = latencies
+    exposure = np.where(np.isnan(plan["exposure"]), camera_exposure, plan["exposure"])
+    setup = (
+        plan["xy_move"] * lat.xy_move
+        + plan["z_move"] * lat.z_move
+        + plan["config_change"] * lat.config_change
+        + plan["n_autofocus"] * lat.autofocus
+    )
+    return setup, exposure / 1000 + lat.snap
+
+
+def event_overhead(
+    plan: np.ndarray, latencies: DeviceLatencies, camera_exposure: float
+) -> np.ndarray:
+    """
+    Predict the seconds each event of a plan spends on everything except raman.
+
+    Parameters
+    ----------
+    plan : structured array of `PLAN_DTYPE`
+        From `compile_plan`.
+    latencies : DeviceLatencies
+        How long each step takes.
+    camera_exposure : float
+        Exposure in ms for events that don't set one.
+
+    Returns
+    -------
+    (n_events,) array of float
+    """
+    setup, snap = _setup_and_snap(plan, latencies, camera_exposure)
+    return setup + snap
+
+
+def estimate_duration(
+    plan: np.ndarray,
+    sequence: MDASequence,
+    latencies: DeviceLatencies,
+    camera_exposure: float,
+    overlap: bool = False,
+) -> float:
+    """
+    Predict how long a compiled sequence will take to run, in seconds.
+
+    Parameters
+    ----------
+    plan : structured array of `PLAN_DTYPE`
+        From `compile_plan`.
+    sequence : MDASequence
+        The sequence that was compiled, for the time interval.
+    latencies : DeviceLatencies
+        How long each step takes.
+    camera_exposure : float
+        Exposure in ms for events that don't set one.
+    overlap : bool, default False
+        Whether raman collection overlaps the snap.
+    """
+    lat = latencies
+    setup, snap = _setup_and_snap(plan, latencies, camera_exposure)
+    raman = plan["raman"] * (
+        lat.raman_overhead + plan["n_points"] * lat.raman_per_point + plan["dwell"]
+    )
+    acquire = np.maximum(snap, raman) if overlap else snap + raman
+    per_event = setup + acquire
+
+    # the runner waits for the interval between the start of each timepoint
+    timepoints = np.unique(plan["t"])
+    per_t = np.array([per_event[plan["t"] == t].sum() for t in timepoints])
+    interval = interval_seconds(sequence)
+    return float(np.maximum(per_t[:-1], interval).sum() + per_t[-1:].sum())
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import wrapt
+from useq import MDAEvent
+
+__all__ = [
+    "PhaseTimer",
+    "Span",
+    "timed",
+]
+
+# shared so that a disabled timer doesn't allocate anything
+_NULL_SPAN = nullcontext()
+
+
+class Span(NamedTuple):
+    """One timed phase of one event. Times are from `time.perf_counter_ns`."""
+
+    name: str
+    start: int
+    stop: int
+    thread: int
+    index: dict
+
+
+class _ActiveSpan:
+    __slots__ = ("_index", "_name", "_start", "_timer")
+
+    def __init__(self, timer: PhaseTimer, name: str, index: dict) -> None:
+        self._timer = timer
+        self._name = name
+        self._index = index
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        stop = time.perf_counter_ns()
+        self._timer.spans.append(
+            Span(self._name, self._start, stop, threading.get_ident(), self._index)
+        )
+
+
+class PhaseTimer:
+    """
+    Record how long each phase of each event takes.
+
+    Disabled by default, in which case `span` costs a single attribute check.
+
+    Parameters
+    ----------
+    enabled : bool, default False
+        Whether to record anything.
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.spans: list[Span] = []
+
+    def clear(self):
+        self.spans = []
+
+    def span(self, name: str, event: MDAEvent | None = None):
+        """
+        Time the body of a ``with`` block.
+
+        Parameters
+        ----------
+        name : str
+            The name of the phase.
+        event : MDAEvent, optional
+            The event that the phase belongs to.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        index = dict(event.index) if event is not None else {}
+        return _ActiveSpan(self, name, index)
+
+    def durations(self, name: str) -> np.ndarray:
+        """All the recorded durations of a phase, in seconds."""
+        return np.array([s.stop - s.start for s in self.spans if s.name == name]) / 1e9
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Summary statistics of each phase, in seconds.
+
+        Returns
+        -------
+        dict
+            Phase name -> {count, total, mean, p50, p95, max}
+        """
+        out = {}
+        for name in dict.fromkeys(s.name for s in self.spans):
+            dur = self.durations(name)
+            p50, p95 = np.percentile(dur, [50, 95])
+            out[name] = {
+                "count": len(dur),
+                "total": float(dur.sum()),
+                "mean": float(dur.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "max": float(dur.max()),
+            }
+        return out
+
+    def to_chrome_trace(self, path: str | Path | None = None) -> dict:
+        """
+        Export the spans in the Chrome trace event format.
+
+        Open the file with https://ui.perfetto.dev or chrome://tracing.
+
+        Parameters
+        ----------
+        path : str or Path, optional
+            If given, write the trace to this file as json.
+
+        Returns
+        -------
+        dict
+            The trace.
+        """
+        t0 = min((s.start for s in self.spans), default=0)
+        trace = {
+            "traceEvents": [
+                {
+                    "name": s.name,
+                    "ph": "X",
+                    "ts": (s.start - t0) / 1e3,
+                    "dur": (s.stop - s.start) / 1e3,
+                    "pid": 0,
+                    "tid": s.thread,
+                    "args": s.index,
+                }
+                for s in self.spans
+            ],
+            "displayTimeUnit": "ms",
+        }
+        if path is not None:
+            Path(path).write_text(json.dumps(trace))
+        return trace
+
+
+def timed(name: str):
+    """Time a method of an object with a ``timer`` attribute as phase *name*."""
+
+    @wrapt.decorator
+    def wrapper(wrapped, instance, args, kwargs):
+        event = args[0] if args and isinstance(args[0], MDAEvent) else None
+        with instance.timer.span(name, event):
+            return wrapped(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import re
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import dask.array as da
+    from dask import delayed
+except ModuleNotFoundError:
+    da = None
+try:
+    import xarray as xr
+except ModuleNotFoundError:
+    xr = None
+
+__all__ = [
+    "open_raman",
+]
+
+_NPY_NAME = re.compile(r"raman_p(\d+)_t(\d+)(?:_z(\d+))?_data\.npy")
+
+
+def open_raman(path: str | Path) -> xr.Dataset:
+    """
+    Lazily open saved Raman spectra.
+
+    Nothing is read from disk until the data is accessed (e.g. with ``.compute()``
+    or ``.values``) and then only the events that are needed.
+
+    Parameters
+    ----------
+    path : str or Path
+        Either the folder saved by `RamanTiffAndNumpyWriter` (or its ``raman``
+        subfolder) or a store saved by `RamanZarrWriter`.
+
+    Returns
+    -------
+    xarray.Dataset
+        With the variables:
+
+        - ``spectra``: (p, t, z, point, wavenumber)
+        - ``locations``: (p, t, z, point, xy)
+        - ``designation``: (p, t, z, point) name of the aiming source
+        - ``n_points``: (p, t, z) number of valid points for each event
+
+        Events have different numbers of points so the point axis is padded to
+        the largest event, with NaN for the spectra and locations and "" for the
+        designation. Use ``n_points`` to find the valid entries.
+    """
+    if da is None or xr is None:
+        raise ValueError(
+            "Reading requires dask and xarray to be installed. "
+            "Try: `pip install dask xarray`"
+        )
+    path = Path(path)
+    if (path / ".zgroup").exists():
+        return _open_zarr(path)
+    if (path / "raman").is_dir():
+        path = path / "raman"
+    return _open_npy_folder(path)
+
+
+def _open_zarr(path: Path) -> xr.Dataset:
+    import zarr
+
+    group = zarr.open_group(str(path), mode="r")
+    labels = np.asarray([*group.attrs["labels"], ""])
+    codes = da.from_zarr(group["designation"])
+    # -1 (no point) indexes the trailing ""
+    designation = codes.map_blocks(lambda c: labels[c], dtype=labels.dtype)
+    return _make_dataset(
+        da.from_zarr(group["spectra"]),
+        da.from_zarr(group["locations"]),
+        designation,
+        group["n_points"][:],
+    )
+
+
+def _load_padded(fname: str, n_points: int, fill, dtype) -> np.ndarray:
+    arr = np.load(fname)
+    out = np.full((n_points, *arr.shape[1:]), fill, dtype=dtype)
+    out[: len(arr)] = arr
+    return out
+
+
+def _lazy_stack(files: dict, shape: tuple, meta: dict, n_points: int, fill):
+    """Assemble per event lazy loads into one (p, t, z, point, ...) dask array."""
+    trailing = meta[next(iter(files.values()))][2:]
+    # e.g. the designation string length differs between events
+    dtype = np.promote_types(
+        np.result_type(*(meta[f][0] for f in files.values())),
+        np.min_scalar_type(fill),
+    )
+    empty = da.full((n_points, *trailing), fill, dtype=dtype)
+    blocks = np.empty(shape, dtype=object)
+    for idx in np.ndindex(shape):
+        if idx in files:
+            blocks[idx] = da.from_delayed(
+                delayed(_load_padded)(files[idx], n_points, fill, dtype),
+                shape=(n_points, *trailing),
+                dtype=dtype,
+            )
+        else:
+            blocks[idx] = empty
+    return da.stack(list(blocks.ravel())).reshape(*shape, n_points, *trailing)
+
+
+def _open_npy_folder(path: Path) -> xr.Dataset:
+    events = {}
+    for f in path.glob("raman_*_data.npy"):
+        m = _NPY_NAME.fullmatch(f.name)
+        if m is None:
+            continue
+        p, t, z = (int(i) if i is not None else 0 for i in m.groups())
+        events[(p, t, z)] = str(f)[: -len("_data.npy")]
+    if not events:
+        raise FileNotFoundError(f"No raman spectra found in {path}")
+
+    shape = tuple(max(idx[i] for idx in events) + 1 for i in range(3))
+    n_points = np.zeros(shape, dtype=int)
+    data, locations, designation = {}, {}, {}
+    meta = {}
+    for idx, base in events.items():
+        for files, suffix in (
+            (data, "_data.npy"),
+            (locations, "_locations.npy"),
+            (designation, "_designation.npy"),
+        ):
+            fname = base + suffix
+            # memory mapping only reads the header
+            arr = np.load(fname, mmap_mode="r")
+            meta[fname] = (arr.dtype, *arr.shape)
+            files[idx] = fname
+        n_points[idx] = meta[base + "_data.npy"][1]
+
+    max_points = int(n_points.max())
+    return _make_dataset(
+        _lazy_stack(data, shape, meta, max_points, np.nan),
+        _lazy_stack(locations, shape, meta, max_points, np.nan),
+        _lazy_stack(designation, shape, meta, max_points, ""),
+        n_points,
+    )
+
+
+def _make_dataset(spectra, locations, designation, n_points) -> xr.Dataset:
+    ptz = ("p", "t", "z")
+    return xr.Dataset(
+        {
+            "spectra": ((*ptz, "point", "wavenumber"), spectra),
+            "locations": ((*ptz, "point", "xy"), locations),
+            "designation": ((*ptz, "point"), designation),
+            "n_points": (ptz, n_points),
+        }
+    )
@@ -0,0 +1,365 @@
+"""
+Run the spectra collector on a different computer than the microscope.
+
+On the computer with the spectrometer::
+
+    from raman_control import SpectraCollector
+    from raman_mda_engine import SpectraServer
+
+    server = SpectraServer(SpectraCollector.instance(), host="0.0.0.0", port=5555)
+    server.serve_forever()
+
+and on the microscope::
+
+    engine = RamanEngine(spectra_collector=RemoteSpectraCollector("raman-box", 5555))
+
+Requests and responses are a fixed size header followed by the raw bytes of the
+array, which are sent and received without copying. Requests are answered in the
+order they were sent, so several can be in flight on one connection, see
+`RemoteSpectraCollector.submit`.
+"""
+
+from __future__ import annotations
+
+import itertools
+import queue
+import socket
+import socketserver
+import struct
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+from loguru import logger
+
+__all__ = [
+    "RemoteSpectraCollector",
+    "SpectraServer",
+]
+
+# op, request id, exposure, number of points
+_REQUEST = struct.Struct("<BIdI")
+# request id, status, rows, cols, dtype string, e.g. b"<f8\0"
+_RESPONSE = struct.Struct("<IBII4s")
+
+_COLLECT_RELATIVE = 0
+_COLLECT_VOLTS = 1
+_INSERT_FILTER = 2
+_REMOVE_FILTER = 3
+
+_OK = 0
+_ERROR = 1
+
+# exceptions that are raised as the same type on the client
+_ERRORS = {e.__name__: e for e in (ValueError, TypeError)}
+
+
+def _recv_into(sock: socket.socket, buffer) -> None:
+    """Fill *buffer* from *sock*."""
+    view = memoryview(buffer)
+    if view.nbytes == 0:
+        return
+    view = view.cast("B")
+    while len(view):
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError("connection closed")
+        view = view[n:]
+
+
+def _recv(sock: socket.socket, n: int) -> bytes:
+    buffer = bytearray(n)
+    _recv_into(sock, buffer)
+    return bytes(buffer)
+
+
+def _send_array(sock: socket.socket, header: bytes, arr: np.ndarray) -> None:
+    sock.sendall(header)
+    if arr.size:
+        sock.sendall(memoryview(arr).cast("B"))
+
+
+class _RemoteDAQ:
+    """Moves the filter of the remote collector, for `RamanEngine` autofocus."""
+
+    def __init__(self, collector: RemoteSpectraCollector) -> None:
+        self._collector = collector
+
+    def insert_filter(self):
+        self._collector._submit(_INSERT_FILTER).result()
+
+    def remove_filter(self):
+        self._collector._submit(_REMOVE_FILTER).result()
+
+
+class RemoteSpectraCollector:
+    """
+    A spectra collector that forwards to a `SpectraServer` over TCP.
+
+    The connection is kept open for the lifetime of the object.
+
+    Parameters
+    ----------
+    host : str
+        The address of the server.
+    port : int
+        The port of the server.
+    timeout : float, optional
+        Seconds to wait when connecting.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float | None = None) -> None:
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.settimeout(None)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._ids = itertools.count()
+        # requests waiting for a response, in the order they were sent
+        self._pending: deque[tuple[int, Future]] = deque()
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self.daq = _RemoteDAQ(self)
+        self._reader = threading.Thread(
+            target=self._read_responses, name="remote-collector", daemon=True
+        )
+        self._reader.start()
+
+    def _submit(
+        self, op: int, points: np.ndarray | None = None, exposure: float = 0
+    ) -> Future:
+        if points is None:
+            points = np.empty((0, 2))
+        points = np.ascontiguousarray(points, dtype=np.float64)
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError(f"points must have shape (N, 2) but has {points.shape}")
+        future: Future = Future()
+        with self._send_lock:
+            if self._closed:
+                raise ConnectionError("RemoteSpectraCollector is closed")
+            req_id = next(self._ids) & 0xFFFFFFFF
+            self._pending.append((req_id, future))
+            header = _REQUEST.pack(op, req_id, float(exposure), len(points))
+            _send_array(self._sock, header, points)
+        return future
+
+    def _read_responses(self):
+        try:
+            while True:
+                header = _recv(self._sock, _RESPONSE.size)
+                req_id, status, rows, cols, dtype = _RESPONSE.unpack(header)
+                if not self._pending:
+                    raise ConnectionError(f"unexpected response {req_id}")
+                # only removed once answered, so that it fails with the rest if
+                # the response can't be read
+                expected, future = self._pending[0]
+                if req_id != expected:
+                    raise ConnectionError(
+                        f"response {req_id} does not match request {expected}"
+                    )
+                if status == _OK:
+                    arr = np.empty((rows, cols), dtype=dtype.rstrip(b"\0").decode())
+                    _recv_into(self._sock, arr)
+                    self._pending.popleft()
+                    future.set_result(arr)
+                else:
+                    message = _recv(self._sock, rows).decode()
+                    name, _, message = message.partition(": ")
+                    self._pending.popleft()
+                    future.set_exception(_ERRORS.get(name, RuntimeError)(message))
+        except Exception as e:  # noqa: BLE001
+            if not isinstance(e, OSError) or self._pending:
+                # anything else means the stream can't be trusted any more
+                logger.error(f"remote spectra collector failed: {e!r}")
+            with self._send_lock:
+                self._closed = True
+                while self._pending:
+                    self._pending.popleft()[1].set_exception(ConnectionError(str(e)))
+
+    def submit(
+        self, points: np.ndarray, exposure: float = 20, relative: bool = True
+    ) -> Future:
+        """
+        Send a request without waiting for the spectra.
+
+        The server starts on the next request as soon as it has finished the
+        current one, so submitting the next batch before waiting on the result
+        of this one hides the network round trip.
+
+        Parameters
+        ----------
+        points : (N, 2) array
+            Where to aim the laser.
+        exposure : float, default 20
+            Exposure per point in ms.
+        relative : bool, default True
+            Whether *points* are relative coordinates or galvo volts.
+
+        Returns
+        -------
+        Future
+            Resolves to the (N, n_wavenumbers) spectra.
+        """
+        op = _COLLECT_RELATIVE if relative else _COLLECT_VOLTS
+        return self._submit(op, points, exposure)
+
+    def collect_spectra_relative(self, points, exposure=20):
+        return self.submit(points, exposure, relative=True).result()
+
+    def collect_spectra_volts(self, points, exposure=20):
+        return self.submit(points, exposure, relative=False).result()
+
+    def close(self):
+        """Close the connection, failing any requests still in flight."""
+        with self._send_lock:
+            self._closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.join()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    server: SpectraServer
+
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # responses are sent from another thread so that the next request can
+        # start collecting while the last spectra are still going over the wire
+        responses: queue.Queue = queue.Queue()
+        sender = threading.Thread(
+            target=self._send_responses, args=(sock, responses), daemon=True
+        )
+        sender.start()
+        try:
+            while True:
+                try:
+                    header = _recv(sock, _REQUEST.size)
+                    op, req_id, exposure, n = _REQUEST.unpack(header)
+                    points = np.empty((n, 2))
+                    _recv_into(sock, points)
+                except (ConnectionError, OSError):
+                    break
+                try:
+                    result = self.server._run(op, points, exposure)
+                except Exception as e:  # noqa: BLE001
+                    logger.warning(f"spectra server request {req_id} failed: {e!r}")
+                    result = e
+                responses.put((req_id, result))
+        finally:
+            responses.put(None)
+            sender.join()
+
+    @staticmethod
+    def _send_responses(sock: socket.socket, responses: queue.Queue):
+        while (item := responses.get()) is not None:
+            req_id, result = item
+            try:
+                if not isinstance(result, Exception):
+                    try:
+                        header, arr = _pack_result(req_id, result)
+                    except Exception as e:  # noqa: BLE001
+                        # nothing has been sent yet, so the client can still be
+                        # told about it without breaking the stream
+                        logger.warning(
+                            f"spectra server cannot send response {req_id}: {e!r}"
+                        )
+                        result = e
+                    else:
+                        _send_array(sock, header, arr)
+                        continue
+                message = f"{type(result).__name__}: {result}".encode()
+                sock.sendall(
+                    _RESPONSE.pack(req_id, _ERROR, len(message), 0, b"") + message
+                )
+            except OSError:
+                # the client went away, keep draining until the handler stops
+                pass
+
+
+def _pack_result(req_id: int, result) -> tuple[bytes, np.ndarray]:
+    """Get the response header and array for a successful request."""
+    arr = np.ascontiguousarray(result)
+    if arr.ndim != 2:
+        raise ValueError(f"spectra must be 2D but have shape {arr.shape}")
+    if arr.dtype.kind not in "biuf":
+        raise TypeError(f"spectra must be numeric but have dtype {arr.dtype}")
+    return _RESPONSE.pack(req_id, _OK, *arr.shape, arr.dtype.str.encode()), arr
+
+
+class SpectraServer(socketserver.ThreadingTCPServer):
+    """
+    Serve a spectra collector to `RemoteSpectraCollector` clients.
+
+    Requests from all connections are run one at a time.
+
+    Parameters
+    ----------
+    collector : SpectraCollector
+        The collector to serve, e.g. ``SpectraCollector.instance()`` or a
+        `fakeAcquirer`.
+    host : str, default "127.0.0.1"
+        The address to listen on, "0.0.0.0" for every interface.
+    port : int, default 0
+        The port to listen on, 0 to pick a free one. See `address`.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, collector, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.collector = collector
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        super().__init__((host, port), _Handler)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """The (host, port) the server is listening on."""
+        return self.server_address[:2]
+
+    def _run(self, op: int, points: np.ndarray, exposure: float) -> np.ndarray:
+        with self._lock:
+            if op == _COLLECT_RELATIVE:
+                return self.collector.collect_spectra_relative(points, exposure)
+            if op == _COLLECT_VOLTS:
+                return self.collector.collect_spectra_volts(points, exposure)
+            if op in (_INSERT_FILTER, _REMOVE_FILTER):
+                daq = getattr(self.collector, "daq", None)
+                if daq is not None:
+                    if op == _INSERT_FILTER:
+                        daq.insert_filter()
+                    else:
+                        daq.remove_filter()
+                return np.empty((0, 0))
+            raise ValueError(f"unknown op {op}")
+
+    def start(self) -> SpectraServer:
+        """Serve on a background thread."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="spectra-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stop serving and close the listening socket."""
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+
+from ._plan import PLAN_DTYPE
+
+if TYPE_CHECKING:
+    from useq import MDAEvent
+
+    from ._aiming_cache import AimingPlan
+    from .aiming import RamanAimingSource
+
+__all__ = [
+    "PointScheduler",
+    "SkippedPoints",
+]
+
+
+class SkippedPoints(NamedTuple):
+    """Points of one source that did not fit in the time budget of an event."""
+
+    index: dict
+    source: str
+    n_points: int
+    n_collected: int
+
+
+class PointScheduler:
+    """
+    Fit the raman points of each event into the time the sequence allows.
+
+    The budget of an event is either a fixed number of seconds or its share of
+    what is left of the current timepoint's interval, after the predicted time of
+    the remaining events of that timepoint. Sources are filled in order of their
+    ``priority`` attribute, highest first, and a source that only partly fits is
+    subsampled evenly. Points that were skipped are visited first the next time
+    the same source is collected at the same position, so that over a few
+    timepoints every point gets collected.
+
+    Every source that was cut short is recorded in `skipped`.
+    """
+
+    def __init__(self) -> None:
+        self.start(np.zeros(0, dtype=PLAN_DTYPE), np.zeros(0), 0)
+
+    def start(
+        self,
+        plan: np.ndarray,
+        overhead: np.ndarray,
+        interval: float,
+        budget: bool | float | None = None,
+    ):
+        """
+        Start scheduling a sequence.
+
+        Parameters
+        ----------
+        plan : structured array of `PLAN_DTYPE`
+            The compiled sequence.
+        overhead : (n_events,) array of float
+            The predicted seconds of each event excluding raman, see
+            `event_overhead`.
+        interval : float
+            Seconds between the start of each timepoint.
+        budget : bool or float, optional
+            True to fit the points into *interval*, a number for a fixed budget
+            in seconds per raman event, or None/False to collect every point.
+        """
+        self.skipped: list[SkippedPoints] = []
+        # (source name, p) -> (number of points, indices not visited yet)
+        self._pending: dict[tuple[str, int], tuple[int, np.ndarray]] = {}
+        self._plan = plan
+        self._interval = interval
+        self._budget = budget
+        self._t0 = time.perf_counter()
+
+        # the overhead from each event to the end of its timepoint and the raman
+        # events after it, so that the budget can be shared out in proportion
+        self._overhead_left = np.zeros(len(plan))
+        self._later: dict[int, np.ndarray] = {}
+        raman = np.flatnonzero(plan["raman"])
+        for t in np.unique(plan["t"]):
+            rows = np.flatnonzero(plan["t"] == t)
+            self._overhead_left[rows] = np.cumsum(overhead[rows][::-1])[::-1]
+            self._later[int(t)] = raman[plan["t"][raman] == t]
+        # p -> the number of points of its last event, for the events whose
+        # points are only known when they happen, e.g. from a segmentation
+        self._live: dict[int, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        if self._budget is None or self._budget is False:
+            return False
+        return self._budget is not True or self._interval > 0
+
+    def capacity(
+        self, row: int | None, cost: float, n_points: int | None = None
+    ) -> int | None:
+        """
+        How many points the event at *row* of the plan has time for.
+
+        Parameters
+        ----------
+        row : int or None
+            The row of the event in the plan, None for events not in the plan.
+        cost : float
+            Seconds per point.
+        n_points : int, optional
+            The number of points the event actually has. Defaults to the count
+            in the plan, which is 0 for sources that can't be cached. Later
+            events with a count of 0 are assumed to have as many points as the
+            last event at their position, or as this one.
+
+        Returns
+        -------
+        int or None
+            At least 1, or None if the points are not limited.
+        """
+        if not self.enabled:
+            return None
+        if self._budget is True:
+            if row is None:
+                return None
+            plan = self._plan
+            deadline = self._t0 + (plan["t"][row] + 1) * self._interval
+            left = deadline - time.perf_counter() - self._overhead_left[row]
+            if n_points is None:
+                n_points = int(plan["n_points"][row])
+            else:
+                self._live[int(plan["p"][row])] = n_points
+            later = self._later[int(plan["t"][row])]
+            later = later[later > row]
+            counts = plan["n_points"][later].astype(float)
+            for i in np.flatnonzero(counts == 0):
+                counts[i] = self._live.get(int(plan["p"][later[i]]), n_points)
+            share = n_points / max(n_points + counts.sum(), 1)
+            seconds = left * share
+        else:
+            seconds = float(self._budget)
+        return max(int(seconds / cost), 1)
+
+    def _choose(self, key: tuple[str, int], n: int, k: int) -> np.ndarray:
+        """Pick *k* of *n* points, preferring those skipped last time."""
+        stored = self._pending.get(key)
+        if stored is None or stored[0] != n:
+            # the points changed so start again
+            pending = np.arange(n)
+        else:
+            pending = stored[1]
+        if k >= len(pending):
+            # start the next pass over the points with evenly spaced extras
+            others = np.setdiff1d(np.arange(n), pending)
+            extra = others[_spread(len(others), k - len(pending))]
+            chosen = np.concatenate([pending, extra])
+            pending = np.setdiff1d(others, extra)
+        else:
+            take = _spread(len(pending), k)
+            chosen = pending[take]
+            pending = np.delete(pending, take)
+        if len(pending):
+            self._pending[key] = (n, pending)
+        else:
+            self._pending.pop(key, None)
+        return np.sort(chosen)
+
+    def select(
+        self,
+        event: MDAEvent,
+        row: int | None,
+        sources: list[RamanAimingSource],
+        plan: AimingPlan,
+        cost: float,
+    ) -> np.ndarray | None:
+        """
+        Choose which points of an aiming plan to collect.
+
+        Parameters
+        ----------
+        event : MDAEvent
+            The event being collected.
+        row : int or None
+            The row of the event in the compiled plan.
+        sources : list of RamanAimingSource
+            The sources that made *plan*, in order.
+        plan : AimingPlan
+            All the points of the event.
+        cost : float
+            Seconds per point.
+
+        Returns
+        -------
+        array of int or None
+            Indices into ``plan.points`` in their original order, or None to
+            collect them all.
+        """
+        capacity = self.capacity(row, cost, len(plan.points))
+        return self.fit(event, sources, plan, capacity)
+
+    def fit(
+        self,
+        event: MDAEvent,
+        sources: list[RamanAimingSource],
+        plan: AimingPlan,
+        capacity: int | None,
+    ) -> np.ndarray | None:
+        """
+        Choose at most *capacity* points of an aiming plan to collect.
+
+        The same as `select` with a capacity that was already worked out, see
+        `capacity`.
+        """
+        p = event.index.get("p", 0)
+        if capacity is None or capacity >= len(plan.points):
+            for source in sources:
+                self._pending.pop((source.name, p), None)
+            return None
+
+        order = sorted(
+            range(len(sources)),
+            key=lambda i: getattr(sources[i], "priority", 0),
+            reverse=True,
+        )
+        keep = []
+        for i in order:
+            start, stop = plan.offsets[i], plan.offsets[i + 1]
+            n = int(stop - start)
+            k = min(n, capacity)
+            capacity -= k
+            if k < n:
+                self.skipped.append(
+                    SkippedPoints(dict(event.index), sources[i].name, n, k)
+                )
+            if k:
+                keep.append(start + self._choose((sources[i].name, p), n, k))
+        return np.sort(np.concatenate(keep)) if keep else np.zeros(0, dtype=int)
+
+
+def _spread(n: int, k: int) -> np.ndarray:
+    """Pick the indices of *k* evenly spaced items out of *n*."""
+    if k <= 0:
+        return np.zeros(0, dtype=int)
+    return np.unique(np.linspace(0, n - 1, k).round().astype(int))
@@ -0,0 +1,401 @@
+from __future__ import annotations
+
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+from loguru import logger
+from pymmcore_plus import CMMCorePlus
+from useq import MDAEvent
+
+from ._engine import RamanEngine
+
+if TYPE_CHECKING:
+    from pymmcore_plus.mda import PMDAEngine
+
+__all__ = [
+    "SharedSpectra",
+    "SharedSpectraPublisher",
+    "SharedSpectraReader",
+]
+
+_MAGIC = b"RAMANRB1"
+_MAX_LABELS = 256
+_LABEL_DTYPE = np.dtype("S64")
+_INDEX_AXES = "ptcz"
+# the shared memory created by publishers in this process
+_OWNED: set[str] = set()
+
+_HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("n_slots", np.uint32),
+        ("max_points", np.uint32),
+        ("n_wavenumbers", np.uint32),
+        ("n_labels", np.uint32),
+        ("dtype", "S8"),
+        # number of events published so far
+        ("head", np.int64),
+    ]
+)
+
+_SLOT_DTYPE = np.dtype(
+    [
+        # odd while the slot is being written
+        ("seq", np.uint64),
+        # which event is in the slot, -1 if none yet
+        ("number", np.int64),
+        ("n_points", np.uint32),
+        # the p, t, c and z index of the event, -1 if not in the event
+        ("index", np.int32, len(_INDEX_AXES)),
+    ]
+)
+
+
+def _align(offset: int, to: int = 64) -> int:
+    return -(-offset // to) * to
+
+
+class _Layout:
+    """The arrays of a ring buffer, as views into its shared memory."""
+
+    def __init__(
+        self,
+        buf: memoryview,
+        n_slots: int,
+        max_points: int,
+        n_wavenumbers: int,
+        dtype: np.dtype,
+    ) -> None:
+        shapes = [
+            ("header", _HEADER_DTYPE, (1,)),
+            ("labels", _LABEL_DTYPE, (_MAX_LABELS,)),
+            ("slots", _SLOT_DTYPE, (n_slots,)),
+            ("spectra", dtype, (n_slots, max_points, n_wavenumbers)),
+            ("points", np.dtype(np.float64), (n_slots, max_points, 2)),
+            ("which", np.dtype(np.int16), (n_slots, max_points)),
+        ]
+        offset = 0
+        for name, dt, shape in shapes:
+            offset = _align(offset)
+            if buf is not None:
+                arr = np.ndarray(shape, dtype=dt, buffer=buf, offset=offset)
+                setattr(self, name, arr)
+            offset += dt.itemsize * int(np.prod(shape))
+        self.nbytes = offset
+
+    @classmethod
+    def size(cls, *args) -> int:
+        return cls(None, *args).nbytes
+
+
+class SharedSpectra(NamedTuple):
+    """
+    The raman data of one event, as read from a `SharedSpectraReader`.
+
+    Attributes
+    ----------
+    number : int
+        How many events were published before this one.
+    index : dict[str, int]
+        The index of the event, for the p, t, c and z axes.
+    spectra : (N, n_wavenumbers) array
+    points : (N, 2) array
+    which : list[str]
+        The name of the aiming source of each point.
+    """
+
+    number: int
+    index: dict
+    spectra: np.ndarray
+    points: np.ndarray
+    which: list
+
+
+class SharedSpectraPublisher:
+    """
+    Publish the spectra of every event to a ring buffer in shared memory.
+
+    Other processes can read the spectra with `SharedSpectraReader` without any
+    pickling, so that live analysis does not compete with the acquisition for the
+    GIL. The buffer holds the last *n_slots* events. Readers that fall further
+    behind than that miss events rather than slowing down the acquisition.
+
+    Each slot has a sequence number that is odd while it is being written, which
+    lets readers detect and retry torn reads without any locks.
+
+    Parameters
+    ----------
+    core : CMMCorePlus, optional
+        If not given the current core instance will be used.
+    name : str, optional
+        The name of the shared memory, random if not given. See `name`.
+    n_slots : int, default 32
+        The number of events held at once.
+    max_points : int, default 2048
+        The most points per event, extra points are not published.
+    n_wavenumbers : int, default 1340
+        The length of each spectrum.
+    dtype : str, default "float32"
+        The dtype to publish the spectra as.
+    """
+
+    def __init__(
+        self,
+        core: CMMCorePlus = None,
+        name: str | None = None,
+        n_slots: int = 32,
+        max_points: int = 2048,
+        n_wavenumbers: int = 1340,
+        dtype: str = "float32",
+    ) -> None:
+        dtype = np.dtype(dtype)
+        size = _Layout.size(n_slots, max_points, n_wavenumbers, dtype)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _OWNED.add(self._shm.name)
+        self._layout = _Layout(self._shm.buf, n_slots, max_points, n_wavenumbers, dtype)
+        header = self._layout.header
+        header["n_slots"] = n_slots
+        header["max_points"] = max_points
+        header["n_wavenumbers"] = n_wavenumbers
+        header["dtype"] = dtype.str.encode()
+        header["head"] = 0
+        self._layout.slots["number"] = -1
+        # written last so that readers never see a half made header
+        header["magic"] = _MAGIC
+        self._labels: dict[str, int] = {}
+
+        self._core = core or CMMCorePlus.instance()
+        self._core.events.mdaEngineRegistered.connect(self._on_mda_engine_registered)
+        if isinstance(self._core.mda.engine, RamanEngine):
+            self._core.mda.engine.raman_events.ramanSpectraReady.connect(self.publish)
+
+    def _on_mda_engine_registered(self, newEngine: PMDAEngine, oldEngine: PMDAEngine):
+        if isinstance(oldEngine, RamanEngine):
+            oldEngine.raman_events.ramanSpectraReady.disconnect(self.publish)
+        if isinstance(newEngine, RamanEngine):
+            newEngine.raman_events.ramanSpectraReady.connect(self.publish)
+
+    @property
+    def name(self) -> str:
+        """The name to give to `SharedSpectraReader`."""
+        return self._shm.name
+
+    def _label_codes(self, which: list[str]) -> np.ndarray:
+        labels = self._layout.labels
+        header = self._layout.header
+        for name in dict.fromkeys(which):
+            if name not in self._labels:
+                if len(self._labels) == _MAX_LABELS:
+                    raise ValueError(f"At most {_MAX_LABELS} aiming sources")
+                code = len(self._labels)
+                labels[code] = name.encode()[: _LABEL_DTYPE.itemsize]
+                self._labels[name] = code
+                header["n_labels"] = code + 1
+        return np.array([self._labels[w] for w in which], dtype=np.int16)
+
+    def publish(
+        self, event: MDAEvent, spectra: np.ndarray, points: np.ndarray, which: list
+    ):
+        """
+        Write the spectra of an event into the next slot.
+
+        Parameters
+        ----------
+        event : MDAEvent
+            The event the spectra were collected for.
+        spectra : (N, n_wavenumbers) array
+            The spectra.
+        points : (N, 2) array
+            Where the laser was aimed.
+        which : list[str]
+            The name of the aiming source of each point.
+        """
+        layout = self._layout
+        header = layout.header
+        n_slots, max_points = len(layout.slots), layout.points.shape[1]
+        n = len(spectra)
+        if n > max_points:
+            logger.warning(
+                f"shared memory only has room for {max_points} of {n} points"
+            )
+            n = max_points
+        codes = self._label_codes(which[:n])
+
+        number = int(header["head"][0])
+        i = number % n_slots
+        slot = layout.slots[i : i + 1]
+        slot["seq"] += 1
+        slot["number"] = number
+        slot["n_points"] = n
+        slot["index"] = [event.index.get(ax, -1) for ax in _INDEX_AXES]
+        layout.spectra[i, :n] = spectra[:n]
+        layout.points[i, :n] = points[:n]
+        layout.which[i, :n] = codes
+        slot["seq"] += 1
+        header["head"] = number + 1
+
+    def close(self):
+        """Stop publishing and free the shared memory."""
+        self._core.events.mdaEngineRegistered.disconnect(self._on_mda_engine_registered)
+        if isinstance(self._core.mda.engine, RamanEngine):
+            self._core.mda.engine.raman_events.ramanSpectraReady.disconnect(
+                self.publish
+            )
+        del self._layout
+        self._shm.close()
+        self._shm.unlink()
+        _OWNED.discard(self._shm.name)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    shm = shared_memory.SharedMemory(name=name)
+    if sys.platform != "win32" and shm.name not in _OWNED:
+        # Before python 3.13 attaching registers the memory with the resource
+        # tracker, which then unlinks it when this process exits even though the
+        # publisher still owns it.
+        resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+    return shm
+
+
+class SharedSpectraReader:
+    """
+    Read the spectra published by a `SharedSpectraPublisher` in another process.
+
+    Parameters
+    ----------
+    name : str
+        The `SharedSpectraPublisher.name` of the publisher.
+
+    Examples
+    --------
+    Process each event as it arrives::
+
+        reader = SharedSpectraReader(name)
+        while True:
+            for item in reader.poll():
+                analyse(item.spectra, item.which)
+            time.sleep(0.01)
+    """
+
+    def __init__(self, name: str) -> None:
+        self._shm = _attach(name)
+        header = np.ndarray(1, dtype=_HEADER_DTYPE, buffer=self._shm.buf)[0].copy()
+        if header["magic"] != _MAGIC:
+            raise ValueError(f"{name!r} is not a shared spectra ring buffer")
+        self._layout = _Layout(
+            self._shm.buf,
+            int(header["n_slots"]),
+            int(header["max_points"]),
+            int(header["n_wavenumbers"]),
+            np.dtype(header["dtype"].decode()),
+        )
+        self._label_names: list[str] = []
+        self._next = 0
+        self.missed = 0
+
+    @property
+    def head(self) -> int:
+        """The number of events published so far."""
+        return int(self._layout.header["head"][0])
+
+    def _labels(self, codes: np.ndarray) -> list[str]:
+        n_labels = int(self._layout.header["n_labels"][0])
+        if len(self._label_names) < n_labels:
+            self._label_names = [
+                b.decode() for b in self._layout.labels[:n_labels].tolist()
+            ]
+        return [self._label_names[c] for c in codes.tolist()]
+
+    def is_valid(self, number: int) -> bool:
+        """Whether event *number* is still in the buffer and not being overwritten."""
+        slot = self._layout.slots[number % len(self._layout.slots)]
+        return slot["number"] == number and slot["seq"] % 2 == 0
+
+    def read(
+        self, number: int, copy: bool = True, timeout: float = 1.0
+    ) -> SharedSpectra | None:
+        """
+        Read one event.
+
+        Parameters
+        ----------
+        number : int
+            Which event to read, counting from 0.
+        copy : bool, default True
+            If False the arrays are views of the shared memory. They are only
+            good until the publisher reuses the slot, check with `is_valid` after
+            using them.
+        timeout : float, default 1.0
+            Seconds to wait for a slot that is being written.
+
+        Returns
+        -------
+        SharedSpectra or None
+            None if the event was already overwritten.
+
+        Raises
+        ------
+        TimeoutError
+            If the slot is still being written after *timeout*, e.g. because the
+            publisher died while writing it.
+        """
+        layout = self._layout
+        i = number % len(layout.slots)
+        slot = layout.slots[i : i + 1]
+        deadline = time.monotonic() + timeout
+        while True:
+            seq = int(slot["seq"][0])
+            if seq % 2:
+                # being written, which is quick
+                if time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"slot {i} is still being written after {timeout}s"
+                    )
+                time.sleep(0)
+                continue
+            if int(slot["number"][0]) != number:
+                return None
+            n = int(slot["n_points"][0])
+            index = {
+                ax: int(v)
+                for ax, v in zip(_INDEX_AXES, slot["index"][0].tolist())
+                if v >= 0
+            }
+            spectra = layout.spectra[i, :n]
+            points = layout.points[i, :n]
+            codes = layout.which[i, :n]
+            if copy:
+                spectra, points, codes = spectra.copy(), points.copy(), codes.copy()
+            if int(slot["seq"][0]) == seq:
+                return SharedSpectra(
+                    number, index, spectra, points, self._labels(codes)
+                )
+
+    def poll(self, copy: bool = True, timeout: float = 1.0) -> list[SharedSpectra]:
+        """
+        Read every event published since the last call.
+
+        Events that were overwritten before they could be read are counted in
+        `missed`. *copy* and *timeout* are as for `read`.
+        """
+        head = self.head
+        oldest = max(head - len(self._layout.slots), 0)
+        if self._next < oldest:
+            self.missed += oldest - self._next
+            self._next = oldest
+        out = []
+        for number in range(self._next, head):
+            item = self.read(number, copy=copy, timeout=timeout)
+            if item is None:
+                self.missed += 1
+            else:
+                out.append(item)
+        self._next = head
+        return out
+
+    def close(self):
+        del self._layout
+        self._shm.close()
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import time
+from typing import Sequence
+
+import numpy as np
+
+from ._engine import fakeAcquirer
+
+__all__ = [
+    "SimulatedSpectraCollector",
+]
+
+# (center index, width in indices, height) of the default peaks
+_DEFAULT_PEAKS = (
+    (220, 6.0, 800.0),
+    (480, 10.0, 350.0),
+    (655, 4.0, 1200.0),
+    (900, 12.0, 500.0),
+    (1180, 8.0, 650.0),
+)
+
+
+class SimulatedSpectraCollector(fakeAcquirer):
+    """
+    A spectra collector that behaves like the real hardware, for development.
+
+    Each point costs a galvo move, the exposure and a readout, and the spectra
+    have Lorentzian peaks on a fluorescence baseline with noise and optional cosmic
+    ray spikes. Spectra are float32 and generated without temporaries.
+
+    Parameters
+    ----------
+    n_wavenumbers : int, default 1340
+        The length of each spectrum.
+    galvo_move : float, default 0.0005
+        Seconds to move the galvo to each point.
+    readout : float, default 0.002
+        Seconds to read out the camera for each point.
+    overhead : float, default 0.005
+        Seconds of fixed cost per call.
+    peaks : sequence of (center, width, height), optional
+        The Raman peaks, center and width in indices.
+    fluorescence : float, default 2000
+        Height of the decaying fluorescence baseline.
+    noise : float, default 20
+        Standard deviation of the noise, in counts per 20 ms of exposure.
+    cosmic_ray_rate : float, default 0
+        Probability of each spectrum having a cosmic ray spike.
+    realtime : bool, default True
+        Whether to sleep for the simulated duration. If False the duration is only
+        added to `simulated_time`.
+    seed : int, optional
+        Seed for the random number generator.
+    """
+
+    def __init__(
+        self,
+        n_wavenumbers: int = 1340,
+        galvo_move: float = 0.0005,
+        readout: float = 0.002,
+        overhead: float = 0.005,
+        peaks: Sequence[tuple[float, float, float]] = _DEFAULT_PEAKS,
+        fluorescence: float = 2000.0,
+        noise: float = 20.0,
+        cosmic_ray_rate: float = 0.0,
+        realtime: bool = True,
+        seed: int | None = None,
+    ) -> None:
+        self.galvo_move = galvo_move
+        self.readout = readout
+        self.overhead = overhead
+        self.noise = noise
+        self.cosmic_ray_rate = cosmic_ray_rate
+        self.realtime = realtime
+        self.simulated_time = 0.0
+        self._rng = np.random.default_rng(seed)
+
+        x = np.arange(n_wavenumbers, dtype=np.float32)
+        self._baseline = (fluorescence * np.exp(-x / (0.6 * n_wavenumbers))).astype(
+            np.float32
+        )
+        self._peaks = np.zeros(n_wavenumbers, dtype=np.float32)
+        for center, width, height in peaks:
+            self._peaks += height / (1 + ((x - center) / width) ** 2)
+        # scratch space, grown as needed and reused between calls
+        self._work = np.empty((0, n_wavenumbers), dtype=np.float32)
+
+    def duration(self, n_points: int, exposure: float = 20) -> float:
+        """Get the simulated seconds to collect *n_points* spectra."""
+        return self.overhead + n_points * (
+            self.galvo_move + exposure / 1000 + self.readout
+        )
+
+    def collect_spectra_relative(self, points, exposure=20, out=None):
+        """
+        Simulate collecting a spectrum at each point.
+
+        Parameters
+        ----------
+        points : (N, 2) array
+            The points, in [0, 1] of the field of view.
+        exposure : float, default 20
+            Exposure per point in ms.
+        out : (N, n_wavenumbers) float32 array, optional
+            Where to write the spectra, a new array is made if not given.
+
+        Returns
+        -------
+        (N, n_wavenumbers) array of float32
+        """
+        return self.collect_spectra_volts(
+            self._relative_to_volts(points), exposure, out=out
+        )
+
+    def collect_spectra_volts(self, points, exposure=20, out=None):
+        """
+        Simulate collecting a spectrum at each point.
+
+        Parameters
+        ----------
+        points : (N, 2) array
+            The galvo voltages.
+        exposure : float, default 20
+            Exposure per point in ms.
+        out : (N, n_wavenumbers) float32 array, optional
+            Where to write the spectra, a new array is made if not given.
+
+        Returns
+        -------
+        (N, n_wavenumbers) array of float32
+        """
+        points = np.ascontiguousarray(points)
+        assert points.shape[1] == 2
+        n = len(points)
+        n_wn = len(self._peaks)
+        if out is None:
+            out = np.empty((n, n_wn), dtype=np.float32)
+        if len(self._work) < n:
+            self._work = np.empty((n, n_wn), dtype=np.float32)
+        work = self._work[:n]
+
+        # signal scales with exposure, noise with its square root
+        scale = exposure / 20
+        self._rng.standard_normal(dtype=np.float32, out=out)
+        out *= self.noise * np.sqrt(scale)
+        # how much sample is under each point
+        amount = self._rng.uniform(0.2, 1.0, size=(n, 1)).astype(np.float32)
+        np.multiply(amount, self._peaks, out=work)
+        work += self._baseline
+        work *= scale
+        out += work
+
+        if self.cosmic_ray_rate > 0:
+            hit = np.flatnonzero(self._rng.random(n) < self.cosmic_ray_rate)
+            cols = self._rng.integers(0, n_wn, size=len(hit))
+            out[hit, cols] += self._rng.uniform(5e3, 5e4, size=len(hit))
+
+        duration = self.duration(n, exposure)
+        self.simulated_time += duration
+        if self.realtime:
+            time.sleep(duration)
+        return out
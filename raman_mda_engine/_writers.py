@@ -1,14 +1,25 @@
 from __future__ import annotations
 
+import queue
+import shutil
+import tempfile
+import threading
+import time
 from pathlib import Path
 from typing import TYPE_CHECKING
 
 import numpy as np
-from pymmcore_mda_writers import SimpleMultiFileTiffWriter
+from loguru import logger
+from pymmcore_mda_writers import BaseWriter, SimpleMultiFileTiffWriter
 from useq import MDAEvent
 
 from ._engine import RamanEngine
 
+try:
+    import zarr
+except ModuleNotFoundError:
+    zarr = None
+
 if TYPE_CHECKING:
     pass
 
@@ -18,9 +29,13 @@ if TYPE_CHECKING:
 
 __all__ = [
     "RamanTiffAndNumpyWriter",
+    "RamanZarrWriter",
 ]
 
 
+_BACKPRESSURE = ("block", "drop-oldest", "spill")
+
+
 class RamanTiffAndNumpyWriter(SimpleMultiFileTiffWriter):
     """Writer to save both images and Raman Spectra."""
 
@@ -28,8 +43,46 @@ class RamanTiffAndNumpyWriter(SimpleMultiFileTiffWriter):
         self,
         save_dir: str | Path,
         core: CMMCorePlus = None,
+        async_raman: bool = False,
+        max_queue: int = 64,
+        backpressure: str = "block",
     ):
+        """
+        Create a writer that saves images as tiffs and spectra as numpy files.
+
+        Parameters
+        ----------
+        save_dir : str or Path
+            The folder in which to save the data.
+        core : CMMCorePlus, optional
+            If not given the current core instance will be used.
+        async_raman : bool, default False
+            Whether to save spectra from a background thread rather than
+            blocking the acquisition.
+        max_queue : int, default 64
+            The number of events that can be waiting to be saved when
+            *async_raman* is True.
+        backpressure : {"block", "drop-oldest", "spill"}
+            What to do when the queue is full. "block" waits for room, "drop-oldest"
+            throws away the oldest waiting event and "spill" saves to a local
+            temporary folder that is moved into place at the end of the sequence.
+            Spilled events are written on the acquisition thread, so "spill"
+            only helps when the local disk is faster than *save_dir*.
+        """
+        if backpressure not in _BACKPRESSURE:
+            raise ValueError(
+                f"backpressure must be one of {_BACKPRESSURE}, got {backpressure!r}"
+            )
         super().__init__(save_dir, core)
+        self._async = async_raman
+        self._backpressure = backpressure
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._spill_dir: Path | None = None
+        self._writer_error: BaseException | None = None
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+        self._core.mda.events.sequenceFinished.connect(self._onMDAFinished)
         if isinstance(self._core.mda.engine, RamanEngine):
             self._core.mda.engine.raman_events.ramanSpectraReady.connect(
                 self._save_raman
@@ -42,19 +95,323 @@ class RamanTiffAndNumpyWriter(SimpleMultiFileTiffWriter):
         if isinstance(newEngine, RamanEngine):
             newEngine.raman_events.ramanSpectraReady.connect(self._save_raman)
 
+    def disconnect(self):
+        """Disconnect this writer from processing any more events."""
+        super().disconnect()
+        self._core.mda.events.sequenceFinished.disconnect(self._onMDAFinished)
+        if isinstance(self._core.mda.engine, RamanEngine):
+            self._core.mda.engine.raman_events.ramanSpectraReady.disconnect(
+                self._save_raman
+            )
+
+    def _reset_stats(self):
+        self._stats = {
+            "written": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "max_depth": 0,
+            "total_latency": 0.0,
+            "max_latency": 0.0,
+        }
+
+    @property
+    def raman_stats(self) -> dict[str, float]:
+        """
+        Counters for the raman saving of the current or most recent sequence.
+
+        Latencies are the time in seconds between an event being emitted and its
+        spectra being on disk.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        total_latency = stats.pop("total_latency")
+        stats["depth"] = self._queue.qsize()
+        stats["mean_latency"] = (
+            total_latency / stats["written"] if stats["written"] else 0.0
+        )
+        return stats
+
+    def _raman_name(self, event: MDAEvent, folder: Path) -> str:
+        pos, t = event.index["p"], event.index.get("t", 0)
+        name = f"raman_p{str(pos).zfill(3)}_t{str(t).zfill(3)}"
+        if "z" in event.index:
+            # otherwise every plane of a z: "all" run overwrites the last
+            name += f"_z{str(event.index['z']).zfill(3)}"
+        return str(folder / name)
+
+    def _write_raman(
+        self,
+        save_name_base: str,
+        spectra: np.ndarray,
+        points: np.ndarray,
+        which: list[str],
+    ):
+        np.save(save_name_base + "_data.npy", spectra)
+        np.save(save_name_base + "_locations.npy", points)
+        np.save(save_name_base + "_designation.npy", which)
+
     def _save_raman(
         self, event: MDAEvent, spectra: np.ndarray, points: np.ndarray, which: list[str]
     ):
-        # TODO zarrify this
-        pos, t = event.index["p"], event.index.get("t", 0)
-        save_name_base = (
-            self._raman_path / f"raman_p{str(pos).zfill(3)}_t{str(t).zfill(3)}"
+        if not self._async:
+            self._write_raman(
+                self._raman_name(event, self._raman_path), spectra, points, which
+            )
+            return
+
+        item = (time.perf_counter(), event, spectra, points, which)
+        if self._backpressure == "block":
+            self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                if self._backpressure == "spill":
+                    self._spill(item)
+                else:
+                    self._drop_oldest_and_put(item)
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats["max_depth"] = max(self._stats["max_depth"], depth)
+
+    def _drop_oldest_and_put(self, item: tuple):
+        while True:
+            try:
+                _, dropped, *_ = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                self._queue.task_done()
+                with self._stats_lock:
+                    self._stats["dropped"] += 1
+                logger.warning(f"raman save queue full - dropped {dropped.index}")
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                continue
+
+    def _spill(self, item: tuple):
+        emitted, event, spectra, points, which = item
+        if self._spill_dir is None:
+            self._spill_dir = Path(tempfile.mkdtemp(prefix="raman-spill-"))
+        self._write_raman(
+            self._raman_name(event, self._spill_dir), spectra, points, which
         )
-        np.save(str(save_name_base) + "_data.npy", spectra)
-        np.save(str(save_name_base) + "_locations.npy", points)
-        np.save(str(save_name_base) + "_designation.npy", which)
+        with self._stats_lock:
+            self._stats["spilled"] += 1
+        self._record_latency(emitted)
+
+    def _record_latency(self, emitted: float):
+        latency = time.perf_counter() - emitted
+        with self._stats_lock:
+            self._stats["written"] += 1
+            self._stats["total_latency"] += latency
+            self._stats["max_latency"] = max(self._stats["max_latency"], latency)
+
+    def _drain(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                emitted, event, spectra, points, which = item
+                self._write_raman(
+                    self._raman_name(event, self._raman_path), spectra, points, which
+                )
+                self._record_latency(emitted)
+            # anything, so that the thread keeps draining and the error is
+            # raised from flush() on the acquisition thread
+            except Exception as e:  # noqa: BLE001
+                logger.exception("Failed to save raman spectra")
+                self._writer_error = e
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Wait until all queued spectra have been written to disk."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._spill_dir is not None:
+            for f in self._spill_dir.iterdir():
+                shutil.move(str(f), str(self._raman_path / f.name))
+            self._spill_dir.rmdir()
+            self._spill_dir = None
+        if self._writer_error is not None:
+            err, self._writer_error = self._writer_error, None
+            raise err
 
     def _onMDAStarted(self, sequence: MDASequence):
         super()._onMDAStarted(sequence)
         self._raman_path = self._path / "raman"
         self._raman_path.mkdir()
+        self._reset_stats()
+        if self._async:
+            self._thread = threading.Thread(
+                target=self._drain, name="raman-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _onMDAFinished(self, sequence: MDASequence):
+        self.flush()
+        if self._async:
+            logger.info(f"raman writer stats: {self.raman_stats}")
+
+
+class RamanZarrWriter(BaseWriter):
+    """
+    Writer to save Raman spectra into a single chunked zarr store.
+
+    The store is a zarr group with the arrays:
+
+    - ``spectra``: (p, t, z, point, wavenumber)
+    - ``locations``: (p, t, z, point, 2) where the laser was aimed
+    - ``designation``: (p, t, z, point) integer code of the aiming source. The
+      names are stored in the ``labels`` attribute of the group.
+    - ``n_points``: (p, t, z) number of valid points for each event
+
+    The point axis grows as needed and unused entries are filled with NaN (-1 for
+    ``designation``). Only spectra are saved, use alongside an image writer.
+    """
+
+    def __init__(
+        self,
+        store_name: str | Path,
+        core: CMMCorePlus = None,
+        dtype: str = "float32",
+        n_wavenumbers: int = 1340,
+        point_chunk: int = 256,
+        compressor=None,
+    ):
+        """
+        Save the spectra of every sequence to a new zarr store.
+
+        Parameters
+        ----------
+        store_name : str or Path
+            The base name of the store. A unique suffix and .zarr are added.
+        core : CMMCorePlus, optional
+            If not given the current core instance will be used.
+        dtype : str, default "float32"
+            The dtype to save the spectra as.
+        n_wavenumbers : int, default 1340
+            The length of each spectrum.
+        point_chunk : int, default 256
+            Number of points per chunk. Every array is chunked one event along p,
+            t and z so writing an event never rewrites another event's data.
+        compressor : numcodecs codec, optional
+            Defaults to zstd Blosc with bitshuffle, which does well on the
+            smooth spectra.
+        """
+        if zarr is None:
+            raise ValueError(
+                "This writer requires zarr to be installed. Try: `pip install zarr`"
+            )
+        super().__init__(core)
+        self._store_name = str(store_name)
+        self._dtype = dtype
+        self._n_wn = n_wavenumbers
+        self._point_chunk = point_chunk
+        if compressor is None:
+            from numcodecs import Blosc
+
+            compressor = Blosc(cname="zstd", clevel=3, shuffle=Blosc.BITSHUFFLE)
+        self._compressor = compressor
+        self._labels: dict[str, int] = {}
+        if isinstance(self._core.mda.engine, RamanEngine):
+            self._core.mda.engine.raman_events.ramanSpectraReady.connect(
+                self._save_raman
+            )
+
+    def _on_mda_engine_registered(self, newEngine: PMDAEngine, oldEngine: PMDAEngine):
+        if isinstance(oldEngine, RamanEngine):
+            oldEngine.raman_events.ramanSpectraReady.disconnect(self._save_raman)
+        if isinstance(newEngine, RamanEngine):
+            newEngine.raman_events.ramanSpectraReady.connect(self._save_raman)
+
+    def disconnect(self):
+        """Disconnect this writer from processing any more events."""
+        super().disconnect()
+        if isinstance(self._core.mda.engine, RamanEngine):
+            self._core.mda.engine.raman_events.ramanSpectraReady.disconnect(
+                self._save_raman
+            )
+
+    def _onMDAStarted(self, sequence: MDASequence):
+        sizes = dict(zip(self.sequence_axis_order(sequence), sequence.shape))
+        ptz = tuple(max(sizes.get(ax, 1), 1) for ax in "ptz")
+        pc = self._point_chunk
+
+        self._path = self.get_unique_folder(self._store_name, suffix=".zarr")
+        self._group = zarr.open_group(str(self._path), mode="w")
+        self._spectra = self._group.create_dataset(
+            "spectra",
+            shape=(*ptz, 0, self._n_wn),
+            chunks=(1, 1, 1, pc, self._n_wn),
+            dtype=self._dtype,
+            fill_value=np.nan,
+            compressor=self._compressor,
+        )
+        # the companion arrays are chunked the same way so that each event
+        # only writes its own chunks
+        self._locations = self._group.create_dataset(
+            "locations",
+            shape=(*ptz, 0, 2),
+            chunks=(1, 1, 1, pc, 2),
+            dtype="float64",
+            fill_value=np.nan,
+            compressor=self._compressor,
+        )
+        self._designation = self._group.create_dataset(
+            "designation",
+            shape=(*ptz, 0),
+            chunks=(1, 1, 1, pc),
+            dtype="int16",
+            fill_value=-1,
+            compressor=self._compressor,
+        )
+        self._n_points = self._group.create_dataset(
+            "n_points",
+            shape=ptz,
+            chunks=(1, 1, 1),
+            dtype="int32",
+            fill_value=0,
+        )
+        self._labels = {}
+        self._group.attrs["dims"] = ["p", "t", "z", "point", "wavenumber"]
+        self._group.attrs["labels"] = []
+        self._group.attrs["useq-sequence"] = sequence.json()
+
+    def _grow_points(self, n_points: int):
+        n_have = self._spectra.shape[3]
+        if n_points <= n_have:
+            return
+        # resizing only touches the metadata, round up to whole chunks so
+        # that this happens rarely
+        pc = self._point_chunk
+        n_new = -(-n_points // pc) * pc
+        for arr in (self._spectra, self._locations, self._designation):
+            shape = list(arr.shape)
+            shape[3] = n_new
+            arr.resize(*shape)
+
+    def _label_codes(self, which: list[str]) -> np.ndarray:
+        new = [w for w in dict.fromkeys(which) if w not in self._labels]
+        if new:
+            for name in new:
+                self._labels[name] = len(self._labels)
+            self._group.attrs["labels"] = list(self._labels)
+        return np.fromiter((self._labels[w] for w in which), np.int16, len(which))
+
+    def _save_raman(
+        self, event: MDAEvent, spectra: np.ndarray, points: np.ndarray, which: list[str]
+    ):
+        idx = tuple(event.index.get(ax, 0) for ax in "ptz")
+        n = len(spectra)
+        self._grow_points(n)
+        self._spectra[(*idx, slice(0, n))] = spectra
+        self._locations[(*idx, slice(0, n))] = points
+        self._designation[(*idx, slice(0, n))] = self._label_codes(which)
+        self._n_points[idx] = n
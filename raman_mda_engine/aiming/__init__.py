@@ -1,17 +1,27 @@
 from ._sources import (
+    AdaptiveGridSource,
+    DriftCorrectedSource,
+    DriftShift,
     LabelsLayerSource,
     PointsLayerSource,
     RamanAimingSource,
+    Schedule,
+    SegmentationSource,
     ShapesLayerSource,
     SimpleGridSource,
     SnappableRamanAimingSource,
 )
 
 __all__ = [
+    "Schedule",
     "SnappableRamanAimingSource",
     "RamanAimingSource",
     "SimpleGridSource",
     "PointsLayerSource",
     "ShapesLayerSource",
     "LabelsLayerSource",
+    "SegmentationSource",
+    "DriftCorrectedSource",
+    "DriftShift",
+    "AdaptiveGridSource",
 ]
@@ -0,0 +1,93 @@
+"""
+The loop implementations that `polygon_laser_focus` replaced.
+
+They make one shapely `Point` per lattice point, so they are slow, but they
+define what the vectorized versions must return. Used by the tests and by
+``benchmarks/bench_aiming.py``.
+"""
+
+from __future__ import annotations
+
+from math import floor
+
+import numpy as np
+from shapely.geometry import Point, Polygon
+
+__all__ = [
+    "loop_rectangle",
+    "loop_ellipse",
+    "loop_polygon",
+]
+
+
+def loop_rectangle(rect, d_r):
+    """Get the lattice of a napari rectangle, one point at a time."""
+    h, w = abs(rect[2, 0] - rect[1, 0]), abs(rect[1, 1] - rect[0, 1])
+    if h > w:
+        n_r = int((rect[2, 0] - rect[1, 0]) / d_r)
+        heights = np.linspace(rect[1, 0], rect[2, 0], n_r)
+        n_h = floor(w / (h / (n_r - 1)))
+        if n_h != 0:
+            widths = np.linspace(rect[0, 1], rect[1, 1], n_h + 2)
+        else:
+            widths = np.array([rect[0, 1], rect[1, 1]])
+    else:
+        n_r = int((rect[1, 1] - rect[0, 1]) / d_r)
+        widths = np.linspace(rect[0, 1], rect[1, 1], n_r)
+        n_w = floor(h / (w / (n_r - 1)))
+        if n_w != 0:
+            heights = np.linspace(rect[1, 0], rect[2, 0], n_w + 2)
+        else:
+            heights = np.array([rect[1, 0], rect[2, 0]])
+    points = []
+    for width in widths:
+        for height in heights:
+            points.append([height, width])
+    return np.array(points)
+
+
+def loop_ellipse(circ, d_c):
+    """Get the lattice of a napari ellipse, one point at a time."""
+    points = []
+    y_cm, x_cm = (circ[2, 0] + circ[0, 0]) / 2, (circ[1, 1] + circ[0, 1]) / 2
+    rady, radx = abs(circ[2, 0] - circ[0, 0]) / 2, abs(circ[1, 1] - circ[0, 1]) / 2
+    if radx > rady:
+        n_c = int(abs(circ[0, 1] - circ[1, 1]) / d_c)
+        rxs = np.linspace(circ[1, 1], circ[0, 1], n_c)
+        for i, rx in enumerate(rxs):
+            if i == 0 or i == len(rxs) - 1:
+                curr_y = y_cm
+            else:
+                curr_y = rady * np.sqrt(1 - (rx - x_cm) ** 2 / radx**2) + y_cm
+            n_y = floor((curr_y - y_cm) / (radx / (n_c - 1)))
+            for ry in np.linspace(2 * y_cm - curr_y, curr_y, n_y + 2):
+                points.append([ry, rx])
+    else:
+        n_c = int(abs(circ[2, 0] - circ[0, 0]) / d_c)
+        rys = np.linspace(circ[0, 0], circ[2, 0], n_c)
+        for j, ry in enumerate(rys):
+            if j == 0 or j == len(rys) - 1:
+                curr_x = x_cm
+            else:
+                curr_x = radx * np.sqrt(1 - (ry - y_cm) ** 2 / rady**2) + x_cm
+            n_x = floor((curr_x - x_cm) / (rady / (n_c - 1)))
+            for rx in np.linspace(2 * x_cm - curr_x, curr_x, n_x + 2):
+                points.append([ry, rx])
+    return np.array(points)
+
+
+def loop_polygon(irr, d_i):
+    """Get the lattice inside a napari polygon, one point at a time."""
+    y_min, y_max = min(irr[:, 1]), max(irr[:, 1])
+    x_min, x_max = min(irr[:, 0]), max(irr[:, 0])
+    rect_points = loop_rectangle(
+        np.array([[x_min, y_min], [x_min, y_max], [x_max, y_max], [x_max, y_min]]),
+        d_i,
+    )
+    polygon = Polygon(irr)
+    points = []
+    for rect_point in rect_points:
+        if polygon.contains(Point(rect_point[0], rect_point[1])) is True:
+            points.append(rect_point)
+    # the loop gave shape (0,) when nothing was inside
+    return np.array(points).reshape(-1, 2)
@@ -3,9 +3,12 @@ from __future__ import annotations
 import numbers
 import uuid
 from abc import abstractmethod
-from typing import Protocol, runtime_checkable
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from functools import partial
+from typing import NamedTuple, Protocol, Sequence, runtime_checkable
 
 import numpy as np
+from loguru import logger
 from napari import current_viewer
 from napari.layers import Labels, Shapes
 from napari_broadcastable_points import BroadcastablePoints
@@ -13,14 +16,29 @@ from pymmcore_plus import CMMCorePlus
 from useq import MDAEvent
 
 from .transformers import Identity, Transformer
-from .util import brush_laser_focus, polygon_laser_focus
+from .util import (
+    band_intensity,
+    brush_laser_focus,
+    downsample,
+    labels_laser_focus,
+    phase_correlation,
+    phase_correlation_fft,
+    polygon_laser_focus,
+    segment_cells,
+)
 
 __all__ = [
+    "Schedule",
     "SnappableRamanAimingSource",
     "RamanAimingSource",
     "SimpleGridSource",
     "PointsLayerSource",
     "ShapesLayerSource",
+    "LabelsLayerSource",
+    "SegmentationSource",
+    "DriftCorrectedSource",
+    "DriftShift",
+    "AdaptiveGridSource",
 ]
 
 
@@ -60,8 +78,39 @@ class SnappableRamanAimingSource(RamanAimingSource, Protocol):
         """
 
 
+class Schedule(NamedTuple):
+    """
+    When the engine collects raman from an aiming source.
+
+    Attributes
+    ----------
+    t_stride : int, default 1
+        Collect at every *t_stride*-th timepoint, starting with the first.
+    z : "all", "center", list of int or None
+        The z indices to collect at, in the same form as the ``z`` of the raman
+        metadata. None to use the sequence's.
+    exposure : float or None
+        The raman exposure in ms, or None for the engine's default.
+    """
+
+    t_stride: int = 1
+    z: str | Sequence[int] | None = None
+    exposure: float | None = None
+
+
 class BaseSource:
+    # Whether the engine may reuse the points of this source for later events at
+    # the same position. Sources whose points change during an acquisition should
+    # set this to False, or call `_invalidate` whenever they change.
+    cacheable = True
+    # Sources with a higher priority are collected first when the engine has to
+    # drop points to stay within the time budget.
+    priority = 0
+    # Replace with a different `Schedule` to collect this source less often.
+    schedule = Schedule()
+
     def __init__(self, name: str = None, transformer: Transformer = None) -> None:
+        self._version = 0
         if name is None:
             self._name = str(uuid.uuid1())
         else:
@@ -75,6 +124,14 @@ class BaseSource:
     def name(self) -> str:
         return self._name
 
+    @property
+    def version(self) -> int:
+        """Counter that increases whenever the points of this source may change."""
+        return self._version + getattr(self._transformer, "version", 0)
+
+    def _invalidate(self, *args):
+        self._version += 1
+
     @property
     def transformer(self) -> Transformer:
         return self._transformer
@@ -83,7 +140,11 @@ class BaseSource:
     def transformer(self, val: Transformer):
         if not isinstance(val, Transformer):
             raise TypeError("That's not a Transfomer!! grrr")
+        old = getattr(self, "_transformer", None)
+        # keep the version increasing even if the new transformer's is lower
+        self._version += getattr(old, "version", 0)
         self._transformer = val
+        self._invalidate()
 
 
 class SimpleGridSource(BaseSource):
@@ -151,25 +212,42 @@ class PointsLayerSource(BaseSource):
         if name is None:
             name = f"points-{uuid.uuid1()}"
         super().__init__(name, transformer=transformer)
-
-    def _get_pos_points(self, points: np.ndarray, pos: int):
-        return points[points[:, self._pos_idx] == pos][:, -2:]
+        # position -> read only (N, 2) relative points at that position
+        self._pos_index: dict[float, np.ndarray] | None = None
+        self._points.events.data.connect(self._on_data_changed)
+
+    def _on_data_changed(self, *args):
+        # rebuilt lazily so that a burst of edits only costs one rebuild
+        self._pos_index = None
+        self._invalidate()
+
+    def _build_pos_index(self) -> dict[float, np.ndarray]:
+        data = np.asarray(self._points.data)
+        pos = data[:, self._pos_idx]
+        # stable so that points keep their layer order within a position
+        order = np.argsort(pos, kind="stable")
+        # put into [0, 1] for spectra collector
+        rel = data[order, -2:] / np.asarray(self._img_shape, dtype=float)
+        rel.flags.writeable = False
+        keys, starts = np.unique(pos[order], return_index=True)
+        stops = np.append(starts[1:], len(order))
+        return {k: rel[start:stop] for k, start, stop in zip(keys, starts, stops)}
+
+    def _get_pos_points(self, pos: int) -> np.ndarray:
+        """Get the relative points at a position without scanning the whole layer."""
+        if self._pos_index is None:
+            self._pos_index = self._build_pos_index()
+        return self._pos_index.get(pos, np.empty((0, 2)))
 
     def get_current_points(self) -> np.ndarray:
-        points = self._points.last_displayed()
+        points = np.asarray(self._points.last_displayed(), dtype=float)
         # put into [0, 1] for spectra collector
-        points[:, 0] /= self._img_shape[0]
-        points[:, 1] /= self._img_shape[1]
+        points = points / np.asarray(self._img_shape, dtype=float)
         return self.transformer.transform(points)
 
     def get_mda_points(self, event: MDAEvent) -> np.ndarray:
         p = event.index.get("p")
-        points = self._get_pos_points(self._points.data, p)
-
-        # put into [0, 1] for spectra collector
-        points[:, 0] /= self._img_shape[0]
-        points[:, 1] /= self._img_shape[1]
-        return self.transformer.transform(points)
+        return self.transformer.transform(self._get_pos_points(p))
 
 
 class ShapesLayerSource(BaseSource):
@@ -271,6 +349,7 @@ class LabelsLayerSource(BaseSource):
         position_idx: int = 1,
         img_shape: tuple[int, int] = None,
         spacing: int = 15,
+        per_label: bool = True,
     ) -> None:
         """
         A Source based on napari labels layer.
@@ -287,9 +366,16 @@ class LabelsLayerSource(BaseSource):
             The shape of the BF images
         spacing: int, default 15
             Number of pixels between points
+        per_label : bool, default True
+            Sample each label on its own, so that every label gets points and
+            `label_ids` says which label each point is in. If False sample one
+            lattice over all the labels.
         """
         self._pos_idx = position_idx
         self._labels = labels_layer
+        self._per_label = per_label
+        # the label of each of the last points, only when per_label is True
+        self.label_ids: np.ndarray | None = None
         self._spacing = spacing
         if img_shape is None:
             core = CMMCorePlus.instance()
@@ -324,11 +410,14 @@ class LabelsLayerSource(BaseSource):
 
         label_data = self._labels.data[current_viewer().dims.current_step[:-2]]
 
-        points = brush_laser_focus(
-            label_data=label_data,
-            density=spacing,
-            plot=False,
-        )
+        if self._per_label:
+            points, self.label_ids = labels_laser_focus(label_data, spacing)
+        else:
+            points = brush_laser_focus(
+                label_data=label_data,
+                density=spacing,
+                plot=False,
+            )
         points[:, 0] /= self._img_shape[0]
         points[:, 1] /= self._img_shape[1]
 
@@ -339,3 +428,443 @@ class LabelsLayerSource(BaseSource):
     #     TODO : waiting until broadcastable-labels-exists.
     #     """
     #     return self.get_current_points()
+
+
+class SegmentationSource(BaseSource):
+    # the points change with every image
+    cacheable = False
+
+    def __init__(
+        self,
+        channel: str | None = None,
+        name: str | None = None,
+        spacing: int = 15,
+        z: int | None = None,
+        dark: bool = False,
+        sigma: float = 1.0,
+        threshold: float | None = None,
+        min_size: int = 50,
+        timeout: float = 5.0,
+        transformer: Transformer = None,
+    ) -> None:
+        """
+        Aim at the cells found by segmenting the acquired images.
+
+        The engine passes every image it snaps to `image_ready`. Images of
+        *channel* are segmented on a background thread, see `segment_cells`, and
+        the cells of the most recent one at each position are sampled like
+        `LabelsLayerSource`. The engine collects raman before snapping, so the
+        image comes from an earlier channel of the same timepoint, or from the
+        previous timepoint if *channel* is the raman channel. Positions without
+        an image yet get no points.
+
+        Parameters
+        ----------
+        channel : str, optional
+            The channel config to segment, e.g. "BF". Defaults to every image.
+        name : str, optional
+            Name of the source.
+        spacing : int, default 15
+            Number of pixels between points
+        z : int, optional
+            Only segment images at this z index. Defaults to every z.
+        dark : bool, default False
+            Whether the cells are darker than the background.
+        sigma, threshold, min_size
+            Passed to `segment_cells`.
+        timeout : float, default 5
+            Seconds to wait for a segmentation that is still running before
+            falling back to the previous one at that position.
+        transformer : Transformer, optional
+            Transformer to use when giving points for a mda.
+        """
+        self._channel = channel
+        self._spacing = spacing
+        self._z = z
+        self._segment_kwargs = {
+            "dark": dark,
+            "sigma": sigma,
+            "threshold": threshold,
+            "min_size": min_size,
+        }
+        self.timeout = timeout
+        self._executor: ThreadPoolExecutor | None = None
+        # position -> the segmentation of the latest image
+        self._futures: dict[int, Future] = {}
+        # position -> the last finished (labels, relative points, label ids)
+        self._results: dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        # the label of each of the last points
+        self.label_ids: np.ndarray | None = None
+        if name is None:
+            name = f"segmentation-{uuid.uuid1()}"
+        super().__init__(name, transformer=transformer)
+
+    @property
+    def spacing(self) -> int:
+        return self._spacing
+
+    @spacing.setter
+    def spacing(self, val: int):
+        if not isinstance(val, numbers.Integral):
+            raise TypeError("spacing must be an integer")
+        self._spacing = val
+
+    def _segment(self, image: np.ndarray, spacing: int):
+        labels = segment_cells(image, **self._segment_kwargs)
+        points, label_ids = labels_laser_focus(labels, spacing)
+        # put into [0, 1] for spectra collector
+        points /= np.asarray(labels.shape, dtype=float)
+        return labels, points, label_ids
+
+    def image_ready(self, event: MDAEvent, image: np.ndarray):
+        """
+        Start segmenting *image* if it is one this source uses.
+
+        Called by `RamanEngine` with every image it snaps.
+        """
+        if self._channel is not None and (
+            event.channel is None or event.channel.config != self._channel
+        ):
+            return
+        if self._z is not None and event.index.get("z") != self._z:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="segmentation"
+            )
+        p = event.index.get("p")
+        self._futures[p] = self._executor.submit(
+            self._segment, np.array(image), self._spacing
+        )
+        self._invalidate()
+
+    def reset(self, p: int | None = None):
+        """
+        Forget the segmentation of position *p*, or of every position if None.
+
+        Called by `RamanEngine` at the start of every sequence, so that a new
+        sequence does not aim at the cells of the last one.
+        """
+        futures = self._futures.values() if p is None else [self._futures.get(p)]
+        for future in futures:
+            if future is not None:
+                future.cancel()
+        if p is None:
+            self._futures.clear()
+            self._results.clear()
+        else:
+            self._futures.pop(p, None)
+            self._results.pop(p, None)
+        self._invalidate()
+
+    def labels(self, p: int | None = None) -> np.ndarray | None:
+        """Get the labels of the last finished segmentation at position *p*."""
+        result = self._results.get(p)
+        return None if result is None else result[0]
+
+    def get_mda_points(self, event: MDAEvent) -> np.ndarray:
+        p = event.index.get("p")
+        future = self._futures.get(p)
+        if future is not None:
+            try:
+                self._results[p] = future.result(timeout=self.timeout)
+            except TimeoutError:
+                logger.warning(
+                    f"segmentation at {p=} took longer than {self.timeout} s,"
+                    " using the previous one"
+                )
+            except Exception as e:  # noqa: BLE001
+                logger.warning(f"segmentation at {p=} failed: {e!r}")
+                self._futures.pop(p, None)
+        result = self._results.get(p)
+        if result is None:
+            self.label_ids = np.empty(0, dtype=int)
+            return np.empty((0, 2))
+        self.label_ids = result[2]
+        return self.transformer.transform(result[1])
+
+    def close(self):
+        """Stop the background thread."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+class DriftShift(NamedTuple):
+    """The drift measured from one image, see `DriftCorrectedSource.shifts`."""
+
+    index: dict
+    shift: tuple
+
+
+class DriftCorrectedSource:
+    def __init__(
+        self,
+        source: RamanAimingSource,
+        channel: str | None = None,
+        z: int | None = None,
+        downsample: int = 2,
+        name: str | None = None,
+    ) -> None:
+        """
+        Move the points of another source to follow the drift of the sample.
+
+        The first image of *channel* at each position is kept as its reference.
+        The shift of every later image from the reference is estimated by phase
+        correlation, and the points of *source* at that position are moved by
+        it. Points moved outside of the field of view are dropped. The engine
+        passes the images to `image_ready` after collecting raman, so the shift
+        is always that of the latest image before the raman event.
+
+        Anything not defined here, e.g. ``schedule`` or ``priority``, is looked
+        up on *source*. If *source* can ``refine`` its points, the collected
+        points are moved back before it sees them and the refined points are
+        moved like the rest.
+
+        Parameters
+        ----------
+        source : RamanAimingSource
+            The source whose points to move.
+        channel : str, optional
+            The channel config to track, e.g. "BF". Defaults to every image.
+        z : int, optional
+            Only track images at this z index. Defaults to every z.
+        downsample : int, default 2
+            Average over blocks of this many pixels before correlating, which
+            is faster at some cost in precision.
+        name : str, optional
+            Name of the source. Defaults to the name of *source* so that its
+            points keep their label.
+        """
+        self._source = source
+        self._channel = channel
+        self._z = z
+        self.downsample = downsample
+        self.name = source.name if name is None else name
+        self._version = 0
+        # position -> (FFT of the reference, shape of the reference)
+        self._references: dict[int, tuple[np.ndarray, tuple[int, int]]] = {}
+        # position -> the latest (row, col) shift in relative coordinates
+        self._shifts: dict[int, np.ndarray] = {}
+        # the shift in pixels measured from every image, for QC
+        self.shifts: list[DriftShift] = []
+
+    def __getattr__(self, name: str):
+        # only called for attributes not found on the wrapper
+        if name.startswith("__") or name == "_source":
+            raise AttributeError(name)
+        if name == "refine" and callable(getattr(self._source, "refine", None)):
+            # only a refiner if the wrapped source is one
+            return self._refine
+        return getattr(self._source, name)
+
+    def _refine(
+        self, event: MDAEvent, points: np.ndarray, spectra: np.ndarray
+    ) -> np.ndarray:
+        shift = self._shifts.get(event.index.get("p"))
+        if shift is None:
+            return self._source.refine(event, points, spectra)
+        new = np.asarray(
+            self._source.refine(event, np.asarray(points) - shift, spectra),
+            dtype=float,
+        )
+        if not len(new):
+            return new
+        new = new + shift
+        return new[np.all((new >= 0) & (new <= 1), axis=1)]
+
+    @property
+    def source(self) -> RamanAimingSource:
+        return self._source
+
+    @property
+    def cacheable(self) -> bool:
+        return getattr(self._source, "cacheable", False)
+
+    @property
+    def version(self) -> int:
+        """Counter that increases whenever the points of this source may change."""
+        return self._version + getattr(self._source, "version", 0)
+
+    def reset(self, p: int | None = None):
+        """
+        Forget the reference of position *p*, or of every position if None.
+
+        Also resets *source* if it has a ``reset`` method. Called by
+        `RamanEngine` at the start of every sequence.
+        """
+        hook = getattr(self._source, "reset", None)
+        if hook is not None:
+            hook(p)
+        if p is None:
+            self._references.clear()
+            self._shifts.clear()
+        else:
+            self._references.pop(p, None)
+            self._shifts.pop(p, None)
+        self._version += 1
+
+    def image_ready(self, event: MDAEvent, image: np.ndarray):
+        """
+        Measure the drift of *image* if it is one this source tracks.
+
+        Called by `RamanEngine` with every image it snaps.
+        """
+        hook = getattr(self._source, "image_ready", None)
+        if hook is not None:
+            hook(event, image)
+        if self._channel is not None and (
+            event.channel is None or event.channel.config != self._channel
+        ):
+            return
+        if self._z is not None and event.index.get("z") != self._z:
+            return
+        p = event.index.get("p")
+        small = downsample(image, self.downsample)
+        image_fft = phase_correlation_fft(small)
+        reference = self._references.get(p)
+        if reference is None or reference[1] != small.shape:
+            self._references[p] = (image_fft, small.shape)
+            shift = np.zeros(2)
+        else:
+            shift = phase_correlation(reference[0], image_fft, small.shape)
+        shift *= max(self.downsample, 1)
+        self.shifts.append(DriftShift(dict(event.index), tuple(shift.tolist())))
+        self._shifts[p] = shift / np.shape(image)[:2]
+        self._version += 1
+
+    def get_mda_points(self, event: MDAEvent) -> np.ndarray:
+        points = self._source.get_mda_points(event)
+        shift = self._shifts.get(event.index.get("p"))
+        if shift is None or not len(points):
+            return points
+        points = points + shift
+        return points[np.all((points >= 0) & (points <= 1), axis=1)]
+
+
+class AdaptiveGridSource(SimpleGridSource):
+    """
+    Sample a coarse grid, then refine around the points with the most signal.
+
+    The engine collects the coarse grid first and passes the spectra to
+    `refine`, which scores them with *metric* and asks for a finer grid over the
+    cells of the best points. That repeats with the new points for up to
+    *max_rounds* rounds, or until *max_points* have been collected at the event.
+
+    Parameters
+    ----------
+    N_x, N_y : int
+        The size of the coarse grid.
+    name : str, optional
+        Name of the source.
+    metric : callable, optional
+        Maps (N, n_wavenumbers) spectra to (N,) scores, higher is better.
+        Defaults to `band_intensity` over *band*.
+    band : slice, optional
+        The band for the default metric, e.g. ``slice(600, 700)``.
+    fraction : float, default 0.25
+        Refine around this fraction of each round's points, the best ones.
+    threshold : float, optional
+        Only refine around points that score above this.
+    factor : int, default 3
+        Each refined cell is split into *factor* x *factor* points.
+    max_rounds : int, default 2
+        How many times to refine.
+    max_points : int, default 500
+        The most points to collect at one event, including the coarse grid.
+    """
+
+    def __init__(
+        self,
+        N_x: int,
+        N_y: int,
+        name: str | None = None,
+        metric=None,
+        band: slice | None = None,
+        fraction: float = 0.25,
+        threshold: float | None = None,
+        factor: int = 3,
+        max_rounds: int = 2,
+        max_points: int = 500,
+    ) -> None:
+        if name is None:
+            name = f"adaptive-{N_x}_{N_y}-{uuid.uuid1()}"
+        super().__init__(N_x, N_y, name=name)
+        if metric is None:
+            metric = partial(band_intensity, band=band)
+        self.metric = metric
+        self.fraction = fraction
+        self.threshold = threshold
+        self.factor = factor
+        self.max_rounds = max_rounds
+        self.max_points = max_points
+        # spacing between the points of the coarse grid
+        self._spacing = np.array(
+            [1 / max(N_x - 1, 1), 1 / max(N_y - 1, 1)], dtype=float
+        )
+        # index of each event being refined -> (round, points collected so far)
+        self._progress: dict[tuple, tuple[int, int]] = {}
+
+    def reset(self, p: int | None = None):
+        """
+        Forget the refinement of the events at position *p*, or of every event.
+
+        Called by `RamanEngine` at the start of every sequence, so that a new
+        sequence refines its events from the coarse grid again.
+        """
+        if p is None:
+            self._progress.clear()
+        else:
+            for key in [k for k in self._progress if dict(k).get("p") == p]:
+                del self._progress[key]
+
+    def _offsets(self, spacing: np.ndarray) -> np.ndarray:
+        """Get the offsets of the points of a refined cell, except its center."""
+        steps = np.arange(self.factor) - (self.factor - 1) / 2
+        X, Y = np.meshgrid(steps * spacing[0], steps * spacing[1])
+        offsets = np.column_stack([X.ravel(), Y.ravel()]) / self.factor
+        return offsets[np.any(offsets != 0, axis=1)]
+
+    def refine(
+        self, event: MDAEvent, points: np.ndarray, spectra: np.ndarray
+    ) -> np.ndarray:
+        """
+        Choose where to collect next from the spectra of the last round.
+
+        Parameters
+        ----------
+        event : MDAEvent
+            The event being collected.
+        points : (N, 2) array
+            The points of this source collected in the last round.
+        spectra : (N, n_wavenumbers) array
+            Their spectra.
+
+        Returns
+        -------
+        (M, 2) array
+            The points to collect next, empty when done.
+        """
+        # the first round of an event not seen yet is the coarse grid
+        key = tuple(sorted(event.index.items()))
+        round_, n_collected = self._progress.get(key, (0, 0))
+        round_ += 1
+        n_collected += len(points)
+        self._progress[key] = (round_, n_collected)
+        if round_ > self.max_rounds or not len(points):
+            return np.empty((0, 2))
+
+        spacing = self._spacing / self.factor ** (round_ - 1)
+        offsets = self._offsets(spacing)
+        scores = np.asarray(self.metric(spectra), dtype=float)
+        order = np.argsort(scores, kind="stable")[::-1]
+        n_cells = int(np.ceil(self.fraction * len(points)))
+        if len(offsets):
+            n_cells = min(n_cells, (self.max_points - n_collected) // len(offsets))
+        best = order[: max(n_cells, 0)]
+        if self.threshold is not None:
+            best = best[scores[best] > self.threshold]
+        if not len(best) or not len(offsets):
+            return np.empty((0, 2))
+        new = (points[best][:, None, :] + offsets[None, :, :]).reshape(-1, 2)
+        return new[np.all((new >= 0) & (new <= 1), axis=1)]
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import numbers
 from typing import Protocol, runtime_checkable
 
@@ -9,16 +11,53 @@ __all__ = [
     "Crosshair",
     "Square",
     "Circle",
+    "Compose",
 ]
 
 
+def _apply(xy, stencil: np.ndarray) -> np.ndarray:
+    """Add every offset of *stencil* to every point, grouped by point."""
+    xy = np.asanyarray(xy)
+    return (xy + stencil[:, None, :]).reshape(-1, 2, order="F")
+
+
 @runtime_checkable
 class Transformer(Protocol):
-    """Base class for transformers."""
+    """
+    Base class for transformers.
+
+    Transformers that add the same offsets to every point only need to implement
+    `_make_stencil`. The offsets are computed once and cached until
+    `_invalidate` is called, which setters of parameters that change the
+    offsets must do.
+    """
 
     def __init__(self):
         pass
 
+    def _make_stencil(self) -> np.ndarray:
+        """Return the (M, 2) offsets to add to each point."""
+        raise NotImplementedError
+
+    @property
+    def stencil(self) -> np.ndarray:
+        """The cached (M, 2) offsets that `transform` adds to each point."""
+        stencil = getattr(self, "_stencil", None)
+        if stencil is None:
+            stencil = np.asarray(self._make_stencil(), dtype=float).reshape(-1, 2)
+            stencil.setflags(write=False)
+            self._stencil = stencil
+        return stencil
+
+    @property
+    def version(self) -> int:
+        """Counter that increases whenever the parameters change."""
+        return getattr(self, "_version", 0)
+
+    def _invalidate(self):
+        self._stencil = None
+        self._version = self.version + 1
+
     def transform(self, xy: np.ndarray) -> np.ndarray:
         """Run xy through the transform.
 
@@ -27,17 +66,23 @@ class Transformer(Protocol):
         xy : numpy array
             An (N, 2) array of the points to transform.
         """
-        raise NotImplementedError
+        return _apply(xy, self.stencil)
 
     @property
     def multiplier(self) -> int:
         """Multiplier for how much this transformer changes the number of points."""
-        return self.transform(np.array([[1, 1]])).shape[0]
+        try:
+            return len(self.stencil)
+        except NotImplementedError:
+            return self.transform(np.array([[1, 1]])).shape[0]
 
 
 class Identity(Transformer):
     """Transform without making changes."""
 
+    def _make_stencil(self) -> np.ndarray:
+        return np.zeros((1, 2))
+
     def transform(self, xy) -> np.ndarray:
         """Return xy as a numpy array."""
         return np.asarray(xy)
@@ -63,8 +108,14 @@ class Crosshair(Transformer):
 
     @spacing.setter
     def spacing(self, val: float):
-        if not val > 0 and val <= 1:
+        if not 0 < val <= 1:
             raise ValueError("Must be between 0 and 1")
+        self._spacing = val
+        self._invalidate()
+
+    def _make_stencil(self, spacing: float | None = None) -> np.ndarray:
+        spacing = spacing or self.spacing
+        return np.array([[-spacing, 0, 0, 0, spacing], [0, spacing, 0, -spacing, 0]]).T
 
     def transform(self, xy, spacing: float = None):
         """
@@ -82,11 +133,9 @@ class Crosshair(Transformer):
         -------
         xy (N*spacing, 2)
         """
-        xy = np.asanyarray(xy)
-        spacing = spacing or self.spacing
-        mod = np.array([[-spacing, 0, 0, 0, spacing], [0, spacing, 0, -spacing, 0]]).T
-
-        return (xy + mod[:, None, :]).reshape(-1, 2, order="F")
+        if spacing:
+            return _apply(xy, self._make_stencil(spacing))
+        return _apply(xy, self.stencil)
 
 
 class Square(Transformer):
@@ -122,6 +171,7 @@ class Square(Transformer):
             The new edge length
         """
         self._edge_length = val
+        self._invalidate()
 
     @property
     def N_points(self) -> int:
@@ -131,6 +181,16 @@ class Square(Transformer):
     def N_points(self, val: int):
         if not isinstance(val, numbers.Integral) or val <= 0:
             raise TypeError("N_points must be a positive integer")
+        self._N_points = val
+        self._invalidate()
+
+    def _make_stencil(self, edge_length=None, N_points=None) -> np.ndarray:
+        edge_length = edge_length or self.edge_length
+        N_points = N_points or self.N_points
+
+        edge = np.linspace(-edge_length / 2, edge_length / 2, N_points)
+        X, Y = np.meshgrid(edge, edge)
+        return np.column_stack([X.ravel(), Y.ravel()])
 
     def transform(self, xy, edge_length=None, N_points=None):
         """
@@ -149,15 +209,9 @@ class Square(Transformer):
         -------
         xy (N*N_points**2, 2)
         """
-        xy = np.asanyarray(xy)
-        edge_length = edge_length or self.edge_length
-        N_points = N_points or self.N_points
-
-        edge = np.linspace(-edge_length / 2, edge_length / 2, N_points)
-        X, Y = np.meshgrid(edge, edge)
-        stacked = np.vstack([X.ravel(), Y.ravel()])
-
-        return (xy + stacked.T[:, None, :]).reshape(-1, 2, order="F")
+        if edge_length or N_points:
+            return _apply(xy, self._make_stencil(edge_length, N_points))
+        return _apply(xy, self.stencil)
 
 
 class Circle(Transformer):
@@ -185,6 +239,7 @@ class Circle(Transformer):
     @radius.setter
     def radius(self, val: float):
         self._radius = val
+        self._invalidate()
 
     @property
     def N_on_radius(self) -> int:
@@ -195,6 +250,18 @@ class Circle(Transformer):
         if not isinstance(val, numbers.Integral) or val <= 0:
             raise TypeError("N_on_radius must be a positive integer")
         self._N_on_radius = val
+        self._invalidate()
+
+    def _make_stencil(
+        self, radius: float | None = None, N_on_radius: int | None = None
+    ):
+        radius = radius or self.radius
+        N = N_on_radius or self.N_on_radius
+
+        diam = np.linspace(-radius, radius, N)
+        X, Y = np.meshgrid(diam, diam)
+        idx = np.sqrt(X**2 + Y**2) <= radius
+        return np.column_stack([X[idx], Y[idx]])
 
     def transform(self, xy, radius: float = None, N_on_radius: int = None):
         """
@@ -215,13 +282,66 @@ class Circle(Transformer):
         xy (N_new, 2)
             In a circle shape.
         """
-        xy = np.asanyarray(xy)
-        radius = radius or self.radius
-        N = N_on_radius or self.N_on_radius
+        if radius or N_on_radius:
+            return _apply(xy, self._make_stencil(radius, N_on_radius))
+        return _apply(xy, self.stencil)
 
-        diam = np.linspace(-radius, radius, N)
-        X, Y = np.meshgrid(diam, diam)
-        idx = np.sqrt(X**2 + Y**2) <= radius
-        stacked = np.vstack([X[idx].ravel(), Y[idx].ravel()])
 
-        return (xy + stacked.T[:, None, :]).reshape(-1, 2, order="F")
+class Compose(Transformer):
+    """
+    Apply several transformers one after the other.
+
+    When every transformer is a stencil their stencils are fused into one, so
+    transforming costs a single broadcast add however many are chained. The
+    fused stencil is rebuilt when any of the transformers change.
+
+    Parameters
+    ----------
+    *transformers : Transformer
+        The transformers, applied first to last. E.g. ``Compose(Circle(0.05, 5),
+        Crosshair(0.01))`` puts a crosshair on every point of a circle.
+    """
+
+    def __init__(self, *transformers: Transformer):
+        super().__init__()
+        for t in transformers:
+            if not isinstance(t, Transformer):
+                raise TypeError(f"{t!r} is not a Transformer")
+        self._transformers = tuple(transformers)
+        self._parts: tuple = ()
+
+    @property
+    def transformers(self) -> tuple:
+        return self._transformers
+
+    @property
+    def version(self) -> int:
+        return super().version + sum(t.version for t in self._transformers)
+
+    @property
+    def stencil(self) -> np.ndarray:
+        parts = tuple(t.stencil for t in self._transformers)
+        if len(parts) != len(self._parts) or any(
+            a is not b for a, b in zip(parts, self._parts)
+        ):
+            self._stencil = None
+            self._parts = parts
+        return super().stencil
+
+    def _make_stencil(self) -> np.ndarray:
+        stencil = np.zeros((1, 2))
+        for part in self._parts:
+            # the offsets of the later transformer vary fastest, as they would
+            # when applying the transformers one at a time
+            stencil = (stencil[:, None, :] + part[None, :, :]).reshape(-1, 2)
+        return stencil
+
+    def transform(self, xy) -> np.ndarray:
+        """Apply every transformer to xy."""
+        try:
+            stencil = self.stencil
+        except NotImplementedError:
+            for t in self._transformers:
+                xy = t.transform(xy)
+            return np.asarray(xy)
+        return _apply(xy, stencil)
@@ -1,9 +1,102 @@
+from __future__ import annotations
+
 from math import floor
 
 import numpy as np
-from shapely.geometry import Point
+from scipy import fft, ndimage
 from shapely.geometry.polygon import Polygon
 
+try:
+    from shapely import contains_xy
+except ImportError:
+    # shapely < 2
+    from shapely.vectorized import contains as contains_xy
+
+
+def _ragged_linspace(start, stop, num) -> np.ndarray:
+    """
+    Concatenate ``np.linspace(start[i], stop[i], num[i])`` for every i.
+
+    Gives exactly the same values as calling linspace in a loop.
+    """
+    start, stop = np.asarray(start, dtype=float), np.asarray(stop, dtype=float)
+    num = np.asarray(num, dtype=int)
+    offsets = np.cumsum(num) - num
+    k = np.arange(num.sum()) - np.repeat(offsets, num)
+    div = np.repeat(num - 1, num)
+    delta = np.repeat(stop - start, num)
+    # same operations as np.linspace, including the exact endpoint
+    out = k * (delta / np.maximum(div, 1)) + np.repeat(start, num)
+    last = k == div
+    out[last] = np.repeat(stop, num)[last]
+    return out
+
+
+def _rectangle(rect, d_r) -> np.ndarray:
+    """Lattice of (row, col) points covering a napari rectangle, column major."""
+    h, w = abs(rect[2, 0] - rect[1, 0]), abs(rect[1, 1] - rect[0, 1])
+    if h > w:
+        n_r = int((rect[2, 0] - rect[1, 0]) / d_r)
+        heights = np.linspace(rect[1, 0], rect[2, 0], n_r)
+        n_h = floor(w / (h / (n_r - 1)))
+        if n_h != 0:
+            widths = np.linspace(rect[0, 1], rect[1, 1], n_h + 2)
+        else:
+            widths = np.array([rect[0, 1], rect[1, 1]])
+
+    else:
+        n_r = int((rect[1, 1] - rect[0, 1]) / d_r)
+        widths = np.linspace(rect[0, 1], rect[1, 1], n_r)
+        n_w = floor(h / (w / (n_r - 1)))
+        if n_w != 0:
+            heights = np.linspace(rect[1, 0], rect[2, 0], n_w + 2)
+        else:
+            heights = np.array([rect[1, 0], rect[2, 0]])
+
+    # every height for the first width, then the next width...
+    W, H = np.meshgrid(widths, heights, indexing="ij")
+    return np.column_stack([H.ravel(), W.ravel()])
+
+
+def _ellipse(circ, d_c) -> np.ndarray:
+    """Lattice of (row, col) points covering a napari ellipse."""
+    y_cm, x_cm = (circ[2, 0] + circ[0, 0]) / 2, (circ[1, 1] + circ[0, 1]) / 2
+    rady, radx = abs(circ[2, 0] - circ[0, 0]) / 2, abs(circ[1, 1] - circ[0, 1]) / 2
+    if radx > rady:
+        # columns across the long axis, each with a row of points
+        n_c = int(abs(circ[0, 1] - circ[1, 1]) / d_c)
+        across = np.linspace(circ[1, 1], circ[0, 1], n_c)
+        center, rad, other_center, other_rad = x_cm, radx, y_cm, rady
+    else:
+        n_c = int(abs(circ[2, 0] - circ[0, 0]) / d_c)
+        across = np.linspace(circ[0, 0], circ[2, 0], n_c)
+        center, rad, other_center, other_rad = y_cm, rady, x_cm, radx
+    if n_c == 0:
+        return np.empty((0, 2))
+
+    # the ends are pinned to the center as the sqrt may come out as NaN there
+    with np.errstate(invalid="ignore"):
+        edge = other_rad * np.sqrt(1 - (across - center) ** 2 / rad**2) + other_center
+    edge[[0, -1]] = other_center
+    n = np.floor((edge - other_center) / (rad / (n_c - 1))).astype(int) + 2
+    along = _ragged_linspace(2 * other_center - edge, edge, n)
+    across = np.repeat(across, n)
+    if radx > rady:
+        return np.column_stack([along, across])
+    return np.column_stack([across, along])
+
+
+def _polygon(irr, d_i) -> np.ndarray:
+    """Lattice of (row, col) points strictly inside a napari polygon."""
+    y_min, y_max = irr[:, 1].min(), irr[:, 1].max()
+    x_min, x_max = irr[:, 0].min(), irr[:, 0].max()
+    rect_points = _rectangle(
+        np.array([[x_min, y_min], [x_min, y_max], [x_max, y_max], [x_max, y_min]]),
+        d_i,
+    )
+    inside = contains_xy(Polygon(irr), rect_points[:, 0], rect_points[:, 1])
+    return rect_points[inside]
+
 
 def polygon_laser_focus(shape_data, shape_type: str, density: int, plot: bool = True):
     """
@@ -25,94 +118,12 @@ def polygon_laser_focus(shape_data, shape_type: str, density: int, plot: bool =
     np.array
         The points the shape has been broken up into.
     """
-
-    def rectangle(rect, d_r):
-        h, w = abs(rect[2, 0] - rect[1, 0]), abs(rect[1, 1] - rect[0, 1])
-        if h > w:
-            n_r = int((rect[2, 0] - rect[1, 0]) / d_r)
-            heights = np.linspace(rect[1, 0], rect[2, 0], n_r)
-            n_h = floor(w / (h / (n_r - 1)))
-            if n_h != 0:
-                widths = np.linspace(rect[0, 1], rect[1, 1], n_h + 2)
-            else:
-                widths = np.array([rect[0, 1], rect[1, 1]])
-
-        else:
-            n_r = int((rect[1, 1] - rect[0, 1]) / d_r)
-            widths = np.linspace(rect[0, 1], rect[1, 1], n_r)
-            n_w = floor(h / (w / (n_r - 1)))
-            if n_w != 0:
-                heights = np.linspace(rect[1, 0], rect[2, 0], n_w + 2)
-            else:
-                heights = np.array([rect[1, 0], rect[2, 0]])
-
-        points = []
-        for width in widths:
-            for height in heights:
-                points.append([height, width])
-
-        return np.array(points)
-
-    def circle(circ, d_c):
-        (circ[2, 0] - circ[0, 0]) / 2
-        points = []
-        y_cm, x_cm = (circ[2, 0] + circ[0, 0]) / 2, (circ[1, 1] + circ[0, 1]) / 2
-        rady, radx = abs(circ[2, 0] - circ[0, 0]) / 2, abs(circ[1, 1] - circ[0, 1]) / 2
-        if radx > rady:
-            n_c = int(abs(circ[0, 1] - circ[1, 1]) / d_c)
-            rxs = np.linspace(circ[1, 1], circ[0, 1], n_c)
-            for i, rx in enumerate(rxs):
-                if i == 0 or i == len(rxs) - 1:
-                    curr_y = y_cm
-                else:
-                    curr_y = rady * np.sqrt(1 - (rx - x_cm) ** 2 / radx**2) + y_cm
-
-                n_y = floor((curr_y - y_cm) / (radx / (n_c - 1)))
-                rys = np.linspace(2 * y_cm - curr_y, curr_y, n_y + 2)
-                for ry in rys:
-                    points.append([ry, rx])
-        else:
-            n_c = int(abs(circ[2, 0] - circ[0, 0]) / d_c)
-            rys = np.linspace(circ[0, 0], circ[2, 0], n_c)
-            for j, ry in enumerate(rys):
-                if j == 0 or j == len(rys) - 1:
-                    curr_x = x_cm
-                else:
-                    curr_x = radx * np.sqrt(1 - (ry - y_cm) ** 2 / rady**2) + x_cm
-
-                n_x = floor((curr_x - x_cm) / (rady / (n_c - 1)))
-                rxs = np.linspace(2 * x_cm - curr_x, curr_x, n_x + 2)
-                for rx in rxs:
-                    points.append([ry, rx])
-
-        return np.array(points)
-
-    def irregular(irr, d_i):
-        y_min, y_max, x_min, x_max = (
-            min(irr[:, 1]),
-            max(irr[:, 1]),
-            min(irr[:, 0]),
-            max(irr[:, 0]),
-        )
-        rect_points = rectangle(
-            np.array([[x_min, y_min], [x_min, y_max], [x_max, y_max], [x_max, y_min]]),
-            d_i,
-        )
-        polygon = Polygon(irr)
-        points = []
-        for rect_point in rect_points:
-            P = Point(rect_point[0], rect_point[1])
-            if polygon.contains(P) is True:
-                points.append(rect_point)
-
-        return np.array(points)
-
     if shape_type == "rectangle":
-        points = rectangle(shape_data, density)
+        points = _rectangle(shape_data, density)
     elif shape_type == "ellipse":
-        points = circle(shape_data, density)
+        points = _ellipse(shape_data, density)
     elif shape_type == "polygon":
-        points = irregular(shape_data, density)
+        points = _polygon(shape_data, density)
 
     if plot:
         import matplotlib.pyplot as plt
@@ -122,7 +133,6 @@ def polygon_laser_focus(shape_data, shape_type: str, density: int, plot: bool =
         plt.scatter(shape_data.T[0], shape_data.T[1])
         plt.axis("scaled")
 
-    # return points
     return points
 
 
@@ -144,46 +154,13 @@ def brush_laser_focus(label_data, density: int, plot: bool = True):
     np.array
         The points the shape has been broken up into.
     """
-
-    def rectangle(rect, d_r):
-        h, w = abs(rect[2, 0] - rect[1, 0]), abs(rect[1, 1] - rect[0, 1])
-        if h > w:
-            n_r = int((rect[2, 0] - rect[1, 0]) / d_r)
-            heights = np.linspace(rect[1, 0], rect[2, 0], n_r)
-            n_h = floor(w / (h / (n_r - 1)))
-            if n_h != 0:
-                widths = np.linspace(rect[0, 1], rect[1, 1], n_h + 2)
-            else:
-                widths = np.array([rect[0, 1], rect[1, 1]])
-
-        else:
-            n_r = int((rect[1, 1] - rect[0, 1]) / d_r)
-            widths = np.linspace(rect[0, 1], rect[1, 1], n_r)
-            n_w = floor(h / (w / (n_r - 1)))
-            if n_w != 0:
-                heights = np.linspace(rect[1, 0], rect[2, 0], n_w + 2)
-            else:
-                heights = np.array([rect[1, 0], rect[2, 0]])
-
-        points = []
-        for width in widths:
-            for height in heights:
-                points.append([height, width])
-
-        return np.array(points)
-
-    ones = np.ones(label_data.shape[0])
-    y_min, y_max = (
-        np.nonzero(np.matrix(label_data) @ ones)[1][0],
-        np.nonzero(np.matrix(label_data) @ ones)[1][-1],
-    )
-    x_min, x_max = (
-        np.nonzero(np.matrix(label_data).T @ ones)[1][0],
-        np.nonzero(np.matrix(label_data).T @ ones)[1][-1],
-    )
+    label_data = np.asarray(label_data)
+    # the bounding box of everything that is labelled
+    y_min, y_max = np.flatnonzero(label_data.any(axis=1))[[0, -1]]
+    x_min, x_max = np.flatnonzero(label_data.any(axis=0))[[0, -1]]
 
     rect = np.rint(
-        rectangle(
+        _rectangle(
             np.array([[x_min, y_min], [x_min, y_max], [x_max, y_max], [x_max, y_min]]),
             density,
         )
@@ -201,3 +178,260 @@ def brush_laser_focus(label_data, density: int, plot: bool = True):
         plt.axis("scaled")
 
     return points
+
+
+def labels_laser_focus(
+    label_data, density: int, labels=None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Convert each label of a labels image into points.
+
+    Each label is sampled on its own lattice over its bounding box, so sparse
+    labels on a large image don't cost a lattice over the whole image. Every
+    label gets at least one point.
+
+    Parameters
+    ----------
+    label_data : (rows, cols) array of int
+        The labels image, 0 is background.
+    density : int
+        Pixels between lattice points.
+    labels : sequence of int, optional
+        Only sample these labels. Defaults to all of them.
+
+    Returns
+    -------
+    points : (N, 2) array of float
+        The (row, col) of each point, grouped by label in increasing order.
+    label_ids : (N,) array of int
+        The label of each point.
+    """
+    label_data = np.asarray(label_data)
+    if not np.issubdtype(label_data.dtype, np.integer):
+        label_data = label_data.astype(np.intp)
+    slices = ndimage.find_objects(label_data)
+    if labels is None:
+        ids = np.array([i + 1 for i, sl in enumerate(slices) if sl is not None])
+    else:
+        ids = np.unique(
+            [i for i in labels if 0 < i <= len(slices) and slices[i - 1] is not None]
+        ).astype(int)
+    if len(ids) == 0:
+        return np.empty((0, 2)), np.empty(0, dtype=int)
+
+    bounds = np.array(
+        [
+            [s.start for s in slices[i - 1]] + [s.stop for s in slices[i - 1]]
+            for i in ids
+        ]
+    )
+    start, size = bounds[:, :2], bounds[:, 2:] - bounds[:, :2]
+    # the number of lattice rows and columns and where the first one is, so that
+    # each lattice is centered in its box
+    n = -(-size // density)
+    first = start + (size - 1 - (n - 1) * density) // 2
+    counts = n.prod(axis=1)
+
+    # every lattice point of every label without looping over the labels
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    n_cols = np.repeat(n[:, 1], counts)
+    rows = np.repeat(first[:, 0], counts) + (k // n_cols) * density
+    cols = np.repeat(first[:, 1], counts) + (k % n_cols) * density
+    label_ids = np.repeat(ids, counts)
+    keep = label_data[rows, cols] == label_ids
+    rows, cols, label_ids = rows[keep], cols[keep], label_ids[keep]
+
+    # labels too thin for their lattice get their middle pixel
+    missing = np.setdiff1d(ids, label_ids)
+    if len(missing):
+        extra = []
+        for i in missing:
+            sl = slices[i - 1]
+            inside = np.argwhere(label_data[sl] == i)
+            extra.append(inside[len(inside) // 2] + [s.start for s in sl])
+        extra = np.array(extra)
+        rows = np.concatenate([rows, extra[:, 0]])
+        cols = np.concatenate([cols, extra[:, 1]])
+        label_ids = np.concatenate([label_ids, missing])
+        # back into label order
+        order = np.argsort(label_ids, kind="stable")
+        rows, cols, label_ids = rows[order], cols[order], label_ids[order]
+
+    points = np.column_stack([rows, cols]).astype(float)
+    return points, label_ids
+
+
+def _otsu(image: np.ndarray, nbins: int = 256) -> float:
+    """Find the threshold that best separates the two classes of *image*."""
+    hist, edges = np.histogram(image, bins=nbins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    w0 = np.cumsum(hist).astype(float)
+    w1 = w0[-1] - w0
+    m = np.cumsum(hist * centers)
+    mu0 = m / np.maximum(w0, 1)
+    mu1 = (m[-1] - m) / np.maximum(w1, 1)
+    between = w0 * w1 * (mu0 - mu1) ** 2
+    return float(centers[np.argmax(between[:-1])])
+
+
+def segment_cells(
+    image,
+    sigma: float = 1.0,
+    threshold: float | None = None,
+    dark: bool = False,
+    min_size: int = 50,
+    min_distance: int = 5,
+) -> np.ndarray:
+    """
+    Label the cells of an image by thresholding and a watershed.
+
+    The image is smoothed, thresholded, cleaned up, and touching cells are split
+    by a watershed on the distance to the background.
+
+    Parameters
+    ----------
+    image : (rows, cols) array
+        The image to segment.
+    sigma : float, default 1
+        Standard deviation of the gaussian smoothing in pixels, 0 for none.
+    threshold : float, optional
+        Defaults to Otsu's threshold of the smoothed image.
+    dark : bool, default False
+        Whether the cells are darker than the background.
+    min_size : int, default 50
+        Labels with fewer pixels are removed.
+    min_distance : int, default 5
+        Minimum distance in pixels between the centers of touching cells that
+        are split apart, 0 to not split them.
+
+    Returns
+    -------
+    labels : (rows, cols) array of int
+        0 is background and the cells are labelled from 1.
+    """
+    image = np.asarray(image, dtype=np.float32)
+    if sigma:
+        image = ndimage.gaussian_filter(image, sigma)
+    if threshold is None:
+        threshold = _otsu(image)
+    mask = image < threshold if dark else image > threshold
+    mask = ndimage.binary_opening(mask)
+    mask = ndimage.binary_fill_holes(mask)
+
+    labels, _ = ndimage.label(mask)
+    if min_distance:
+        # one marker per peak of the distance to the background, then give each
+        # pixel the nearest marker of the same cell, which splits touching cells
+        # halfway between their centers
+        dist = ndimage.distance_transform_edt(mask)
+        peaks = mask & (dist == ndimage.maximum_filter(dist, size=2 * min_distance + 1))
+        markers, _ = ndimage.label(peaks)
+        _, (rows, cols) = ndimage.distance_transform_edt(
+            markers == 0, return_indices=True
+        )
+        nearest = markers[rows, cols]
+        # keep the cell's own label where the nearest marker is in another cell
+        same = labels[rows, cols] == labels
+        labels = np.where(mask & same, nearest, labels + markers.max() * ~same)
+        labels[~mask] = 0
+
+    sizes = np.bincount(labels.ravel())
+    keep = sizes >= min_size
+    keep[0] = False
+    # relabel the cells that are left from 1
+    lookup = np.zeros(len(sizes), dtype=np.int32)
+    lookup[keep] = np.arange(1, keep.sum() + 1)
+    return lookup[labels]
+
+
+def downsample(image, factor: int) -> np.ndarray:
+    """Average *image* over *factor* x *factor* blocks, cropping the remainder."""
+    image = np.asarray(image, dtype=np.float32)
+    if factor <= 1:
+        return image
+    rows, cols = image.shape[0] // factor, image.shape[1] // factor
+    blocks = image[: rows * factor, : cols * factor]
+    return blocks.reshape(rows, factor, cols, factor).mean(axis=(1, 3))
+
+
+def phase_correlation_fft(image) -> np.ndarray:
+    """
+    Get the windowed and normalized FFT of an image, for `phase_correlation`.
+
+    Computing this once for a reference image saves an FFT per comparison.
+    """
+    image = np.asarray(image, dtype=np.float32)
+    image = image - image.mean()
+    # taper the edges so that they don't dominate the correlation
+    window = np.outer(np.hanning(image.shape[0]), np.hanning(image.shape[1]))
+    f = fft.rfft2(image * window, workers=-1)
+    return f / np.maximum(np.abs(f), 1e-12)
+
+
+def phase_correlation(reference_fft: np.ndarray, image, shape=None) -> np.ndarray:
+    """
+    Estimate how far *image* is shifted relative to a reference image.
+
+    Parameters
+    ----------
+    reference_fft : array
+        `phase_correlation_fft` of the reference image.
+    image : (rows, cols) array or array
+        The image, or its `phase_correlation_fft`, with the same shape as the
+        reference.
+    shape : tuple of int, optional
+        The shape of the images, needed when *image* is already an FFT.
+
+    Returns
+    -------
+    shift : (2,) array of float
+        The (row, col) shift in pixels, to sub-pixel precision, such that
+        ``image`` is about ``reference`` moved by *shift*.
+    """
+    if shape is None:
+        shape = np.shape(image)
+        image = phase_correlation_fft(image)
+    corr = fft.irfft2(image * np.conj(reference_fft), s=shape, workers=-1)
+    peak = np.unravel_index(np.argmax(corr), corr.shape)
+    shift = np.zeros(2)
+    for axis, (i, n) in enumerate(zip(peak, shape)):
+        # fit a parabola through the peak and its neighbours
+        before = list(peak)
+        after = list(peak)
+        before[axis] = (i - 1) % n
+        after[axis] = (i + 1) % n
+        y0, y1, y2 = corr[tuple(before)], corr[peak], corr[tuple(after)]
+        denom = y0 - 2 * y1 + y2
+        sub = 0.5 * (y0 - y2) / denom if denom < 0 else 0.0
+        # past halfway is a negative shift
+        shift[axis] = (i + n // 2) % n - n // 2 + sub
+    return shift
+
+
+def band_intensity(spectra, band: slice | None = None) -> np.ndarray:
+    """
+    Integrated intensity of a band of each spectrum above a linear baseline.
+
+    The baseline is the line between the first and last value of the band, so
+    this is cheap and ignores a sloping background.
+
+    Parameters
+    ----------
+    spectra : (N, n_wavenumbers) array
+        The spectra.
+    band : slice, optional
+        The indices of the band. Defaults to the whole spectrum.
+
+    Returns
+    -------
+    (N,) array of float
+    """
+    spectra = np.asarray(spectra, dtype=float)
+    if band is not None:
+        spectra = spectra[:, band]
+    n = spectra.shape[1]
+    if n < 2:
+        return spectra.sum(axis=1)
+    t = np.linspace(0, 1, n)
+    baseline = spectra[:, :1] + (spectra[:, -1:] - spectra[:, :1]) * t
+    return (spectra - baseline).sum(axis=1)
@@ -0,0 +1,54 @@
+import numpy as np
+from useq import MDAEvent
+
+from raman_mda_engine._aiming_cache import AimingPlanCache
+from raman_mda_engine.aiming import SimpleGridSource
+
+
+class CountingGrid(SimpleGridSource):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.n_calls = 0
+
+    def get_mda_points(self, event=None):
+        self.n_calls += 1
+        return super().get_mda_points(event) + event.index["p"]
+
+
+def test_aiming_plan_cache():
+    cached = CountingGrid(2, 2, name="cached")
+    dynamic = CountingGrid(1, 3, name="dynamic")
+    dynamic.cacheable = False
+    cache = AimingPlanCache()
+    cache.build([cached], range(2))
+    assert cached.n_calls == 2
+
+    event = MDAEvent(index={"p": 1, "t": 5})
+    plan = cache.get([cached], event)
+    assert cached.n_calls == 2
+    np.testing.assert_array_equal(plan.points, cached._grid + 1)
+    assert plan.which == ["cached"] * 4
+    assert cache.get([cached], event) is plan
+
+    plan = cache.get([cached, dynamic], event)
+    plan = cache.get([cached, dynamic], event)
+    assert (cached.n_calls, dynamic.n_calls) == (2, 2)
+    assert list(plan.offsets) == [0, 4, 7]
+    assert plan.which == ["cached"] * 4 + ["dynamic"] * 3
+
+    # a change to the source recomputes its points
+    cached._invalidate()
+    cache.get([cached], event)
+    assert cached.n_calls == 3
+
+
+def test_build_skips_dynamic_sources():
+    cached = CountingGrid(2, 2, name="cached")
+    dynamic = CountingGrid(1, 3, name="dynamic")
+    dynamic.cacheable = False
+    cache = AimingPlanCache()
+    cache.build([cached, dynamic], range(2))
+    assert (cached.n_calls, dynamic.n_calls) == (2, 0)
+    # the counts reuse the built points and don't ask the dynamic source
+    np.testing.assert_array_equal(cache.counts([cached, dynamic], 1), [4, 0])
+    assert (cached.n_calls, dynamic.n_calls) == (2, 0)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from raman_mda_engine.aiming._reference import (
+    loop_ellipse,
+    loop_polygon,
+    loop_rectangle,
+)
+from raman_mda_engine.aiming.util import (
+    brush_laser_focus,
+    labels_laser_focus,
+    polygon_laser_focus,
+)
+
+
+def _box(r0, c0, r1, c1):
+    return np.array([[r0, c0], [r0, c1], [r1, c1], [r1, c0]], dtype=float)
+
+
+@pytest.mark.parametrize("box", [(10, 20, 200, 90), (5, 5, 60, 300), (0, 0, 50, 50)])
+@pytest.mark.parametrize("density", [3, 7, 15])
+def test_matches_loop(box, density):
+    data = _box(*box)
+    np.testing.assert_array_equal(
+        polygon_laser_focus(data, "rectangle", density, plot=False),
+        loop_rectangle(data, density),
+    )
+    np.testing.assert_array_equal(
+        polygon_laser_focus(data, "ellipse", density, plot=False),
+        loop_ellipse(data, density),
+    )
+
+    # a star so that plenty of the lattice is outside
+    rng = np.random.default_rng(density)
+    angle = np.sort(rng.uniform(0, 2 * np.pi, 12))
+    radius = rng.uniform(0.3, 1, 12)
+    center = data.mean(axis=0)
+    half = np.ptp(data, axis=0) / 2
+    star = (
+        center
+        + np.column_stack([np.cos(angle), np.sin(angle)]) * radius[:, None] * half
+    )
+    np.testing.assert_array_equal(
+        polygon_laser_focus(star, "polygon", density, plot=False),
+        loop_polygon(star, density),
+    )
+
+
+def test_labels_laser_focus():
+    data = np.zeros((2048, 2048), dtype=np.uint16)
+    data[100:160, 200:230] = 1
+    data[1500:1600, 40:140] = 3
+    # an L, so that some of its bounding box is outside
+    data[900:1000, 900:910] = 4
+    data[990:1000, 900:1000] = 4
+    # smaller than the lattice spacing
+    data[5, 7] = 6
+
+    points, label_ids = labels_laser_focus(data, 15)
+    assert points.shape == (len(label_ids), 2)
+    assert np.all(np.diff(label_ids) >= 0)
+    np.testing.assert_array_equal(np.unique(label_ids), [1, 3, 4, 6])
+    idx = points.astype(int)
+    np.testing.assert_array_equal(data[idx[:, 0], idx[:, 1]], label_ids)
+    np.testing.assert_array_equal(points[label_ids == 6], [[5, 7]])
+
+    # one lattice per label, centered in its bounding box
+    for label, (rows, cols) in {1: (4, 2), 3: (7, 7)}.items():
+        pts = points[label_ids == label]
+        assert len(pts) == rows * cols
+        assert len(np.unique(np.diff(np.unique(pts[:, 0])))) <= 1
+
+    points, label_ids = labels_laser_focus(data, 15, labels=[4, 2])
+    assert set(label_ids) == {4}
+
+
+def test_brush_laser_focus():
+    data = np.zeros((100, 100), dtype=np.uint8)
+    data[10:30, 50:60] = 1
+    data[60:70, 5:40] = 2
+    points = brush_laser_focus(data, 5, plot=False)
+    assert len(points)
+    rows, cols = points.astype(int).T
+    assert np.all(data[rows, cols] > 0)
+    # the points only depend on the labelled part of the image
+    wide = np.zeros((100, 300), dtype=np.uint8)
+    wide[:, :100] = data
+    np.testing.assert_array_equal(brush_laser_focus(wide, 5, plot=False), points)
@@ -0,0 +1,37 @@
+import pytest
+
+from raman_mda_engine._focus import FocusDriftModel
+
+
+def test_focus_drift_model(tmp_path):
+    model = FocusDriftModel(window=3, min_history=3)
+    assert model.predict(0) is None
+    for t in range(5):
+        model.record(0, 10 + 0.5 * t, xy=(0, 0), timestamp=t)
+    # only the latest window is fit, extrapolated linearly
+    assert model.predict(0, timestamp=6) == pytest.approx(13)
+    assert model.predicted_drift(0, timestamp=6) == pytest.approx(1)
+
+    # unknown positions borrow from their nearest neighbour
+    model.record(1, 50, xy=(1000, 1000), timestamp=0)
+    assert model.predict(2, xy=(10, 10)) == pytest.approx(12)
+    assert model.predict(2, xy=(900, 900)) == 50
+    assert model.predicted_drift(1) is None
+
+    model.save(tmp_path / "focus.json")
+    loaded = FocusDriftModel.load(tmp_path / "focus.json")
+    assert loaded.predict(0, timestamp=6) == pytest.approx(13)
+    assert loaded.predict(2, xy=(900, 900)) == 50
+
+
+def test_focus_drift_model_moved_position():
+    model = FocusDriftModel(min_history=2, xy_tolerance=10)
+    for t in range(3):
+        model.record(0, 10, xy=(0, 0), timestamp=t)
+    assert model.predicted_drift(0, timestamp=3, xy=(5, 0)) == 0
+    # position 0 of another sequence somewhere else
+    assert model.predicted_drift(0, timestamp=3, xy=(500, 0)) is None
+    assert model.predict(0, xy=(500, 0)) == 10  # nearest known focus
+    model.record(0, 20, xy=(500, 0), timestamp=4)
+    assert model.predicted_drift(0, timestamp=5) is None
+    assert model.predict(0, timestamp=5) == 20
@@ -0,0 +1,27 @@
+import numpy as np
+from scipy.spatial.distance import cdist
+
+from raman_mda_engine._merge import merge_points
+
+
+def test_merge_points():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(size=(500, 2))
+    keep, inverse = merge_points(points, 0.05)
+    kept = points[keep]
+    # no two kept points are closer than the spacing
+    dist = cdist(kept, kept)
+    assert dist[np.triu_indices(len(kept), 1)].min() >= 0.05
+    # every point was merged into a nearby kept point
+    assert np.linalg.norm(kept[inverse] - points, axis=1).max() < 0.05
+    np.testing.assert_array_equal(inverse[keep], np.arange(len(keep)))
+
+
+def test_merge_points_groups():
+    points = np.array([[0, 0], [0.001, 0], [0, 0.001], [0.5, 0.5]])
+    keep, inverse = merge_points(points, 0.01, groups=[20, 20, 50, 20])
+    np.testing.assert_array_equal(keep, [0, 2, 3])
+    np.testing.assert_array_equal(inverse, [0, 0, 1, 2])
+
+    keep, inverse = merge_points(points, 0)
+    np.testing.assert_array_equal(keep, np.arange(4))
@@ -0,0 +1,30 @@
+import numpy as np
+
+from raman_mda_engine import fakeAcquirer
+from raman_mda_engine._path import PathOptimizer, optimize_path
+
+
+def _length(points):
+    return np.linalg.norm(np.diff(points, axis=0), axis=1).sum()
+
+
+def test_optimize_path():
+    points = np.random.default_rng(0).uniform(size=(200, 2))
+    perm = optimize_path(points)
+    np.testing.assert_array_equal(np.sort(perm), np.arange(200))
+    assert _length(points[perm]) < _length(points) / 4
+
+
+def test_path_optimizer_restores_order():
+    points = np.random.default_rng(1).uniform(size=(50, 2))
+
+    def collect(pts, exposure):
+        # a spectrum that identifies the point it was taken at
+        return np.repeat(pts[:, :1], 1340, axis=1) * exposure
+
+    optimizer = PathOptimizer()
+    spec = optimizer.collect(collect, points, 2)
+    np.testing.assert_allclose(spec[:, 0], points[:, 0] * 2)
+    assert optimizer.permutation(points) is optimizer.permutation(points.copy())
+    spec = optimizer.collect(fakeAcquirer().collect_spectra_relative, points)
+    assert spec.shape == (50, 1340)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from useq import MDASequence
+
+from raman_mda_engine._plan import DeviceLatencies, compile_plan, estimate_duration
+
+
+def test_compile_plan_and_estimate():
+    seq = MDASequence(
+        channels=["BF", "DAPI"],
+        time_plan={"interval": 10, "loops": 2},
+        z_plan={"relative": [-1, 0, 1]},
+        axis_order="tpcz",
+        stage_positions=[(0, 1, 1), (512, 128, 0)],
+    )
+    plan, index = compile_plan(
+        seq,
+        raman_channel="BF",
+        raman_z=np.array(1),
+        n_points={0: 10, 1: 20},
+        autofocus="position",
+        raman_exposure=100,
+    )
+    assert len(plan) == len(index) == 24
+    raman = plan[plan["raman"]]
+    np.testing.assert_array_equal(raman["p"], [0, 1, 0, 1])
+    np.testing.assert_array_equal(raman["n_points"], [10, 20, 10, 20])
+    # autofocus and xy moves only when the position changes
+    assert plan["n_autofocus"].sum() == plan["xy_move"].sum() == 4
+    # the channel switches at every position as the axis order is tpcz
+    assert plan["config_change"].sum() == 8
+
+    lat = DeviceLatencies(
+        xy_move=1, z_move=0, config_change=0, snap=0, autofocus=0, raman_per_point=0
+    )
+    kwargs = {"camera_exposure": 0, "overlap": False}
+    # the first timepoint is shorter than the interval
+    expected = 10 + 2 + lat.raman_overhead * 2 + 30 * 0.1
+    assert estimate_duration(plan, seq, lat, **kwargs) == pytest.approx(expected)
@@ -0,0 +1,39 @@
+import json
+import time
+
+from useq import MDAEvent
+
+from raman_mda_engine._profiling import PhaseTimer, timed
+
+
+class Timed:
+    def __init__(self):
+        self.timer = PhaseTimer()
+
+    @timed("work")
+    def work(self, event):
+        time.sleep(0.001)
+
+
+def test_phase_timer(tmp_path):
+    obj = Timed()
+    obj.work(MDAEvent(index={"p": 0}))
+    assert obj.timer.spans == []
+
+    obj.timer.enabled = True
+    for t in range(3):
+        obj.work(MDAEvent(index={"p": 0, "t": t}))
+    with obj.timer.span("other"):
+        pass
+
+    summary = obj.timer.summary()
+    assert summary["work"]["count"] == 3
+    assert summary["work"]["p50"] >= 0.001
+    assert summary["other"]["count"] == 1
+
+    obj.timer.to_chrome_trace(tmp_path / "trace.json")
+    trace = json.loads((tmp_path / "trace.json").read_text())
+    events = trace["traceEvents"]
+    assert [e["name"] for e in events] == ["work"] * 3 + ["other"]
+    assert events[2]["args"] == {"p": 0, "t": 2}
+    assert events[0]["dur"] >= 1000
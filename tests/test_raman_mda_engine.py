@@ -1,11 +1,76 @@
+from __future__ import annotations
+
+import time
 from unittest.mock import MagicMock
 
+import numpy as np
 import pytest
 from pymmcore_plus import CMMCorePlus
+from pymmcore_plus.core.events import CMMCoreSignaler
 from useq import MDASequence
 
-from raman_mda_engine import RamanEngine
-from raman_mda_engine.aiming import SimpleGridSource, SnappableRamanAimingSource
+from raman_mda_engine import RamanEngine, SimulatedSpectraCollector, fakeAcquirer
+from raman_mda_engine._hardware_state import HardwareStateCache
+from raman_mda_engine._plan import DeviceLatencies
+from raman_mda_engine.aiming import (
+    AdaptiveGridSource,
+    Schedule,
+    SegmentationSource,
+    SimpleGridSource,
+    SnappableRamanAimingSource,
+)
+
+
+def _zeros(points, exposure):
+    return np.zeros((len(points), 5))
+
+
+@pytest.fixture
+def make_engine():
+    """Make engines that drive a mock core, see `engine.mmcore`."""
+
+    def make(*sources, collector=None, **kwargs) -> RamanEngine:
+        core = MagicMock()
+        core.getPosition.return_value = 5.0
+        core.getExposure.return_value = 10
+        # read by the base engine to set up and tear down a sequence
+        core.getPixelSizeUm.return_value = 1.0
+        core.getROI.return_value = (0, 0, 64, 64)
+        core.getImageBitDepth.return_value = 16
+        core.getNumberOfComponents.return_value = 1
+        core.getNumberOfCameraChannels.return_value = 1
+        core.getBytesPerPixel.return_value = 2
+        core.getXYPosition.return_value = (0.0, 0.0)
+        core.getZPosition.return_value = 0.0
+        if collector is None:
+            collector = MagicMock(spec=fakeAcquirer)
+            collector.collect_spectra_relative.side_effect = _zeros
+        return RamanEngine(
+            core, spectra_collector=collector, sources=list(sources), **kwargs
+        )
+
+    return make
+
+
+def raman_sequence(raman: dict | None = None, **kwargs) -> MDASequence:
+    """Get a sequence of raman at every z, one BF event at one position by default."""
+    kwargs.setdefault("channels", ["BF"])
+    kwargs.setdefault("z_plan", {"relative": [0]})
+    kwargs.setdefault("stage_positions", [(0, 0, 0)])
+    return MDASequence(metadata={"raman": {"z": "all", **(raman or {})}}, **kwargs)
+
+
+def run(engine: RamanEngine, sequence: MDASequence) -> list[tuple]:
+    """Run *sequence* and get the arguments of every `ramanSpectraReady`."""
+    rm_mock = MagicMock()
+    engine.raman_events.ramanSpectraReady.connect(rm_mock)
+    engine.setup_sequence(sequence)
+    for event in sequence.iter_events():
+        engine.setup_event(event)
+        engine.exec_event(event)
+    engine.teardown_sequence(sequence)
+    engine.raman_events.ramanSpectraReady.disconnect(rm_mock)
+    return [call.args for call in rm_mock.call_args_list]
 
 
 def test_snappable():
@@ -40,4 +105,406 @@ def test_mda_no_autofocus(core: CMMCorePlus, engine: RamanEngine):
         core.mda.run(seq)
 
 
-# TODO: test with autofocus!!
+def test_mda_overlap(core: CMMCorePlus, engine: RamanEngine):
+    seq = MDASequence(
+        metadata={"raman": {"z": "all", "overlap": True}},
+        channels=["BF"],
+        time_plan={"interval": 0, "loops": 2},
+        z_plan={"relative": [-15, 0, 15]},
+        axis_order="tpcz",
+        stage_positions=[(0, 1, 1), (512, 128, 0)],
+    )
+
+    rm_mock = MagicMock()
+    engine.raman_events.ramanSpectraReady.connect(rm_mock)
+    core.mda.run(seq)
+    assert rm_mock.call_count == 12
+    # spectra are emitted in event order even though collected on a worker
+    emitted = [call.args[0] for call in rm_mock.call_args_list]
+    assert emitted == list(seq.iter_events())
+
+
+def test_overlap_waits_for_raman_when_snap_fails(make_engine):
+    finished = []
+
+    def collect(points, exp):
+        time.sleep(0.2)
+        finished.append(True)
+        return np.zeros((len(points), 5))
+
+    collector = MagicMock(spec=fakeAcquirer)
+    collector.collect_spectra_relative.side_effect = collect
+    engine = make_engine(SimpleGridSource(2, 2), collector=collector)
+    engine.mmcore.snapImage.side_effect = RuntimeError("camera error")
+    seq = raman_sequence({"overlap": True})
+    engine.setup_sequence(seq)
+    with pytest.raises(RuntimeError, match="camera error"):
+        engine.exec_event(next(seq.iter_events()))
+    # the galvo was done before the error got out
+    assert finished == [True]
+
+    engine.teardown_sequence(seq)
+    assert engine._executor is None
+
+
+def test_autofocus_per_timepoint(make_engine):
+    settle = MagicMock()
+    collector = MagicMock()
+    engine = make_engine(collector=collector, filter_settle=settle)
+    seq = MDASequence(
+        metadata={
+            "autofocus": {
+                "autofocus_device": "PFS-Offset",
+                "rel_focus_device": "Z",
+                "mode": "timepoint",
+            }
+        },
+        time_plan={"interval": 0, "loops": 2},
+        z_plan={"relative": [-1, 0, 1]},
+        stage_positions=[(0, 1, 1), (512, 128, 0), (3, 3, 3)],
+        axis_order="tpz",
+    )
+    engine.setup_sequence(seq)
+    for event in seq.iter_events():
+        engine.setup_event(event)
+
+    # the filter moves once in and once out per timepoint
+    assert collector.daq.insert_filter.call_count == 2
+    assert collector.daq.remove_filter.call_count == 2
+    assert settle.call_count == 4
+    assert engine.mmcore.fullFocus.call_count == 6
+    assert engine._ref_z == {0: 5.0, 1: 5.0, 2: 5.0}
+
+
+def test_autofocus_skip_before_filter(make_engine):
+    collector = MagicMock()
+    engine = make_engine(collector=collector, filter_settle=MagicMock())
+    positions = [(0, 1, 1), (512, 128, 0), (3, 30, 3)]
+    for pos, (x, y, _) in enumerate(positions):
+        for t in range(3):
+            engine.focus_model.record(pos, 5.0, (x, y), timestamp=time.time() - t)
+    seq = MDASequence(
+        metadata={
+            "autofocus": {
+                "autofocus_device": "PFS-Offset",
+                "rel_focus_device": "Z",
+                "mode": "timepoint",
+                "skip_tolerance": 0.1,
+                "max_skips": 2,
+            }
+        },
+        time_plan={"interval": 0, "loops": 4},
+        stage_positions=positions,
+        axis_order="tp",
+    )
+    engine.setup_sequence(seq)
+    for event in seq.iter_events():
+        engine.setup_event(event)
+    # two timepoints skipped without moving the filter, then one measured
+    # because of max_skips, then skipped again
+    assert collector.daq.insert_filter.call_count == 1
+    assert engine.mmcore.fullFocus.call_count == 3
+    assert engine._ref_z == pytest.approx({0: 5.0, 1: 5.0, 2: 5.0})
+
+
+def test_autofocus_timepoint_falls_back_to_position(make_engine):
+    engine = make_engine(filter_settle=MagicMock())
+    seq = MDASequence(
+        metadata={
+            "autofocus": {
+                "autofocus_device": "PFS-Offset",
+                "rel_focus_device": "Z",
+                "mode": "timepoint",
+            }
+        },
+        time_plan={"interval": 0, "loops": 3},
+        z_plan={"relative": [-1, 0, 1]},
+        stage_positions=[(0, 1, 1), (512, 128, 0)],
+        # t changes at every position so a pass per timepoint would focus
+        # every position at almost every event
+        axis_order="ptz",
+    )
+    engine.setup_sequence(seq)
+    assert engine._af_mode == "position"
+    for event in seq.iter_events():
+        engine.setup_event(event)
+    assert engine.mmcore.fullFocus.call_count == 2
+    assert engine._plan["n_autofocus"].sum() == 2
+
+
+def test_autofocus_timepoint_without_z(make_engine):
+    engine = make_engine(filter_settle=MagicMock())
+    seq = MDASequence(
+        metadata={
+            "autofocus": {
+                "autofocus_device": "PFS-Offset",
+                "rel_focus_device": "Z",
+                "mode": "timepoint",
+            }
+        },
+        time_plan={"interval": 0, "loops": 2},
+        stage_positions=[(0, 1, None), (512, 128, None)],
+        axis_order="tp",
+    )
+    engine.setup_sequence(seq)
+    for event in seq.iter_events():
+        engine.setup_event(event)
+    assert engine.mmcore.fullFocus.call_count == 4
+    # the offset is left where it is when there is no z to go on
+    calls = engine.mmcore.setPosition.call_args_list
+    assert "PFS-Offset" not in {call.args[0] for call in calls}
+
+
+def test_hardware_state_cache():
+    mmc = MagicMock()
+    mmc.events = CMMCoreSignaler()
+    mmc.getFocusDevice.return_value = "Z"
+    mmc.getXYStageDevice.return_value = "XY"
+    mmc.getCurrentConfigFromCache.side_effect = lambda group: "BF"
+    state = HardwareStateCache(mmc)
+
+    assert state.set_xy(1, 2)
+    assert not state.set_xy(1, 2)
+    assert state.set_position(10)
+    assert not state.set_position(10)
+    assert state.set_config("Channel", "BF")
+    assert not state.set_config("Channel", "BF")
+    assert state.set_exposure(10)
+    assert not state.set_exposure(10)
+    assert mmc.setXYPosition.call_count == 1
+    assert mmc.setConfig.call_count == 1
+
+    # moves from elsewhere invalidate the cache, jitter does not
+    mmc.events.XYStagePositionChanged.emit("XY", 1.01, 2)
+    assert not state.set_xy(1, 2)
+    mmc.events.XYStagePositionChanged.emit("XY", 50, 2)
+    assert state.set_xy(1, 2)
+    mmc.events.stagePositionChanged.emit("Z", 20)
+    assert state.set_position(10)
+    mmc.getCurrentConfigFromCache.side_effect = lambda group: "DAPI"
+    assert state.set_config("Channel", "BF")
+
+
+def test_hardware_state_cache_close():
+    core = CMMCorePlus()
+    signal = core.events.XYStagePositionChanged
+    engine = RamanEngine(core, spectra_collector=MagicMock(spec=fakeAcquirer))
+    assert len(signal) == 1
+    engine.teardown_sequence(MDASequence())
+    assert len(signal) == 0
+    # tearing down twice is fine
+    engine.teardown_sequence(MDASequence())
+
+    mmc = MagicMock()
+    mmc.events = CMMCoreSignaler()
+    state = HardwareStateCache(mmc)
+    state.close()
+    # without the signals moves can't be seen so every call is issued
+    assert state.set_xy(1, 2)
+    assert state.set_xy(1, 2)
+    state.connect()
+    assert state.set_xy(1, 2)
+    assert not state.set_xy(1, 2)
+
+
+def test_source_schedules(make_engine):
+    collector = MagicMock(spec=fakeAcquirer)
+    collector.collect_spectra_relative.side_effect = lambda points, exp: np.full(
+        (len(points), 5), exp
+    )
+    cells = SimpleGridSource(2, 2, name="cells")
+    bkd = SimpleGridSource(3, 3, name="bkd")
+    bkd.schedule = Schedule(t_stride=2, z="center", exposure=50)
+    engine = make_engine(cells, bkd, collector=collector)
+    seq = raman_sequence(
+        time_plan={"interval": 0, "loops": 4},
+        z_plan={"relative": [-1, 0, 1]},
+        axis_order="tpcz",
+    )
+    emitted = run(engine, seq)
+
+    assert len(emitted) == 12
+    with_bkd = [event.index for event, _, _, which in emitted if "bkd" in which]
+    assert with_bkd == [
+        {"t": 0, "p": 0, "c": 0, "z": 1},
+        {"t": 2, "p": 0, "c": 0, "z": 1},
+    ]
+    # one call per exposure
+    assert collector.collect_spectra_relative.call_count == 14
+    event, spec, points, which = emitted[1]
+    assert len(points) == len(which) == 13
+    np.testing.assert_array_equal(spec[:, 0], [20] * 4 + [50] * 9)
+
+
+def test_min_spacing(make_engine):
+    collector = MagicMock(spec=fakeAcquirer)
+    collector.collect_spectra_relative.side_effect = lambda points, exp: np.repeat(
+        points[:, :1], 5, axis=1
+    )
+    cells = SimpleGridSource(2, 2, name="cells")
+    bkd = SimpleGridSource(3, 3, name="bkd")
+    engine = make_engine(cells, bkd, collector=collector)
+    ((_, spec, points, which),) = run(engine, raman_sequence({"min_spacing": 0.1}))
+
+    # the four corners of the background grid are shared with the cells
+    (collected, _), _ = collector.collect_spectra_relative.call_args
+    assert len(collected) == 9
+    assert len(points) == len(which) == len(spec) == 13
+    assert which.count("cells") == 4
+    np.testing.assert_array_equal(spec[:, 0], points[:, 0])
+
+
+def test_min_spacing_locations(make_engine):
+    class Fixed:
+        def __init__(self, name, points):
+            self.name = name
+            self.points = np.array(points, dtype=float)
+
+        def get_mda_points(self, event):
+            return self.points
+
+    collector = MagicMock(spec=fakeAcquirer)
+    collector.collect_spectra_relative.side_effect = _zeros
+    cells = Fixed("cells", [[0.5, 0.5], [0.2, 0.2]])
+    bkd = Fixed("bkd", [[0.51, 0.5], [0.8, 0.8]])
+    engine = make_engine(cells, bkd, collector=collector)
+    ((_, _, points, which),) = run(engine, raman_sequence({"min_spacing": 0.05}))
+
+    # every point is reported where the laser was actually aimed
+    (collected, _), _ = collector.collect_spectra_relative.call_args
+    assert which == ["cells", "cells", "bkd", "bkd"]
+    np.testing.assert_array_equal(collected, [[0.5, 0.5], [0.2, 0.2], [0.8, 0.8]])
+    np.testing.assert_array_equal(points, collected[[0, 1, 0, 2]])
+
+
+def test_image_hooks(make_engine):
+    source = SegmentationSource(channel="DAPI", min_size=10)
+    engine = make_engine(source)
+    image = np.zeros((64, 64))
+    image[20:40, 20:40] = 1
+    engine.mmcore.getImage.return_value = image
+    seq = raman_sequence({"channel": "BF"}, channels=["DAPI", "BF"])
+    ((event, _, points, _),) = run(engine, seq)
+
+    # aimed at the square segmented from the DAPI image
+    assert event.channel.config == "BF"
+    assert len(points)
+    assert np.all((points >= 20 / 64) & (points < 40 / 64))
+    source.close()
+
+
+def test_segmentation_without_image(make_engine):
+    # segmenting the raman channel only gives points from the next timepoint
+    source = SegmentationSource(channel="BF", min_size=10)
+    engine = make_engine(source, collector=fakeAcquirer())
+    image = np.zeros((64, 64))
+    image[20:40, 20:40] = 1
+    engine.mmcore.getImage.return_value = image
+    seq = raman_sequence({"channel": "BF"}, time_plan={"interval": 0, "loops": 2})
+    (_, spec0, points0, _), (_, spec1, points1, _) = run(engine, seq)
+
+    assert spec0.shape == (0, 1340)
+    assert points0.shape == (0, 2)
+    assert len(points1)
+    assert spec1.shape == (len(points1), 1340)
+
+    # a new sequence doesn't aim at the cells of the last one
+    engine.setup_sequence(seq)
+    assert source.labels(0) is None
+    assert not len(source.get_mda_points(next(seq.iter_events())))
+    source.close()
+
+
+def test_adaptive_refinement(make_engine):
+    hotspot = np.array([0.6, 0.4])
+
+    def collect(points, exp):
+        spec = np.zeros((len(points), 30)) + np.linspace(0, 5, 30)
+        signal = np.exp(-np.sum((points - hotspot) ** 2, axis=1) / 0.01)
+        spec[:, 12:18] += 100 * signal[:, None]
+        return spec
+
+    collector = MagicMock(spec=fakeAcquirer)
+    collector.collect_spectra_relative.side_effect = collect
+    source = AdaptiveGridSource(5, 5, name="adaptive", band=slice(10, 20))
+    source.fraction = 0.1
+    bkd = SimpleGridSource(2, 2, name="bkd")
+    engine = make_engine(bkd, source, collector=collector)
+    ((_, spec, points, which),) = run(engine, raman_sequence())
+
+    # the grids, then two rounds of 3 cells split into 8 new points each
+    assert collector.collect_spectra_relative.call_count == 3
+    assert len(spec) == len(points) == len(which) == 4 + 25 + 24 + 24
+    assert which.count("bkd") == 4
+    np.testing.assert_allclose(spec, collect(points, 20))
+    # the last round is around the hotspot
+    distance = np.linalg.norm(points[-24:] - hotspot, axis=1)
+    assert distance.max() < 0.3
+
+
+def test_adaptive_refinement_budget(make_engine):
+    # 10 ms per point, so 30 points fit in the budget
+    collector = SimulatedSpectraCollector(
+        galvo_move=0, readout=0, overhead=0, realtime=False
+    )
+    engine = make_engine(
+        AdaptiveGridSource(5, 5, name="adaptive"),
+        collector=collector,
+        default_rm_exp=10,
+    )
+    engine.latencies = DeviceLatencies(raman_per_point=0)
+    ((_, spec, points, which),) = run(engine, raman_sequence({"budget": 0.3}))
+
+    # the refined points only fill what the grid left of the 30 point budget
+    assert len(spec) == len(points) == len(which) == 30
+    assert collector.simulated_time == pytest.approx(collector.duration(30, 10))
+    (skipped,) = engine.scheduler.skipped
+    assert skipped.n_collected == 5
+
+
+def test_refine_sources_with_same_name(make_engine):
+    class Refiner(SimpleGridSource):
+        def refine(self, event, points, spectra):
+            self.given = len(points)
+            return np.empty((0, 2))
+
+    small, big = Refiner(2, 2, name="grid"), Refiner(3, 3, name="grid")
+    run(make_engine(small, big), raman_sequence())
+    assert (small.given, big.given) == (4, 9)
+
+
+def test_budget_with_uncacheable_source(make_engine):
+    class LiveGrid(SimpleGridSource):
+        cacheable = False
+
+    engine = make_engine(LiveGrid(4, 5))
+    seq = raman_sequence(
+        {"budget": True},
+        time_plan={"interval": 60, "loops": 1},
+        stage_positions=[(0, 0, 0), (1, 1, 0)],
+    )
+    emitted = run(engine, seq)
+
+    # the points are only known at the event, but easily fit in the interval
+    assert [len(points) for _, _, points, _ in emitted] == [20, 20]
+    assert not engine.scheduler.skipped
+
+
+def test_adaptive_refinement_interval_budget(make_engine):
+    # 10 ms per point, so about 100 points fit in the 1 s interval
+    engine = make_engine(
+        AdaptiveGridSource(5, 5, max_points=1000),
+        collector=SimulatedSpectraCollector(galvo_move=0, readout=0, overhead=0),
+        default_rm_exp=10,
+    )
+    engine.mmcore.getExposure.return_value = 0
+    engine.latencies = DeviceLatencies(0, 0, 0, 0, 0, 0, 0)
+    seq = raman_sequence(
+        {"budget": True, "max_rounds": 10}, time_plan={"interval": 1, "loops": 1}
+    )
+    start = time.perf_counter()
+    ((_, spec, _, _),) = run(engine, seq)
+    elapsed = time.perf_counter() - start
+
+    assert 90 <= len(spec) <= 100
+    assert elapsed < 1.5
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from pymmcore_plus import CMMCorePlus
+from useq import MDASequence
+
+from raman_mda_engine import RamanTiffAndNumpyWriter, RamanZarrWriter, open_raman
+
+pytest.importorskip("dask")
+pytest.importorskip("xarray")
+
+
+@pytest.mark.parametrize("writer_cls", [RamanTiffAndNumpyWriter, RamanZarrWriter])
+def test_open_raman(tmp_path, writer_cls):
+    if writer_cls is RamanZarrWriter:
+        pytest.importorskip("zarr")
+    writer = writer_cls(tmp_path / "data", core=CMMCorePlus())
+    seq = MDASequence(
+        time_plan={"interval": 0, "loops": 2},
+        z_plan={"relative": [-1, 0, 1]},
+        stage_positions=[(0, 0, 0), (1, 1, 1)],
+        axis_order="tpz",
+    )
+    writer._onMDAStarted(seq)
+    for event in seq.iter_events():
+        p, t, z = (event.index[ax] for ax in "ptz")
+        n = 2 + p + z
+        spec = np.full((n, 1340), 100 * p + 10 * t + z, dtype="float32")
+        which = ["grid"] * (n - 1) + ["cells"]
+        writer._save_raman(event, spec, np.full((n, 2), 0.5), which)
+
+    ds = open_raman(writer._path)
+    assert ds.spectra.dims == ("p", "t", "z", "point", "wavenumber")
+    assert ds.spectra.shape[:3] == (2, 2, 3)
+    assert ds.spectra.chunks is not None  # still lazy
+    assert ds.spectra.dtype == np.float32
+
+    np.testing.assert_array_equal(ds.n_points.sel(p=1, t=0), [3, 4, 5])
+    event = ds.isel(p=1, t=1, z=2)
+    n = int(event.n_points)
+    np.testing.assert_array_equal(event.spectra[:n].values, 112)
+    assert np.isnan(event.spectra[n:].values).all()
+    np.testing.assert_array_equal(event.locations[:n].values, 0.5)
+    assert list(event.designation[:n].values) == ["grid"] * (n - 1) + ["cells"]
@@ -0,0 +1,110 @@
+import socket
+import threading
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+from pymmcore_plus import CMMCorePlus
+
+from raman_mda_engine import (
+    RamanEngine,
+    RemoteSpectraCollector,
+    SimulatedSpectraCollector,
+    SpectraServer,
+    fakeAcquirer,
+)
+from raman_mda_engine._remote import _REQUEST, _RESPONSE
+from raman_mda_engine.aiming import SimpleGridSource
+
+
+@pytest.fixture
+def server():
+    collector = SimulatedSpectraCollector(realtime=False, seed=0)
+    with SpectraServer(collector).start() as server:
+        yield server
+
+
+def test_remote_collector(server: SpectraServer):
+    local = SimulatedSpectraCollector(realtime=False, seed=0)
+    rng = np.random.default_rng(0)
+    batches = [rng.random((n, 2)) for n in (5, 1, 100)]
+    with RemoteSpectraCollector(*server.address) as remote:
+        # all in flight at once and answered in order
+        futures = [remote.submit(points, 10) for points in batches]
+        for points, future in zip(batches, futures):
+            expected = local.collect_spectra_relative(points, 10)
+            spec = future.result()
+            assert spec.dtype == np.float32
+            np.testing.assert_array_equal(spec, expected)
+
+        volts = remote.collect_spectra_volts(batches[0], 10)
+        np.testing.assert_array_equal(
+            volts, local.collect_spectra_volts(batches[0], 10)
+        )
+
+        # errors are raised on the client and the connection stays usable
+        with pytest.raises(ValueError, match="Points must be in"):
+            remote.collect_spectra_relative(batches[0] + 2)
+        remote.daq.insert_filter()
+        assert remote.collect_spectra_relative(batches[0]).shape == (5, 1340)
+
+
+def test_remote_fake_acquirer():
+    with SpectraServer(fakeAcquirer()).start() as server:
+        remote = RemoteSpectraCollector(*server.address)
+        assert remote.collect_spectra_relative(np.full((3, 2), 0.5)).shape == (3, 1340)
+        remote.close()
+        with pytest.raises(ConnectionError):
+            remote.submit(np.zeros((1, 2)))
+
+
+def test_remote_bad_result():
+    collector = fakeAcquirer()
+    server = SpectraServer(collector).start()
+    with server, RemoteSpectraCollector(*server.address) as remote:
+        collector.collect_spectra_relative = lambda points, exposure: np.zeros(3)
+        with pytest.raises(ValueError, match="must be 2D"):
+            remote.collect_spectra_relative(np.full((3, 2), 0.5))
+        del collector.collect_spectra_relative
+        spec = remote.collect_spectra_relative(np.full((3, 2), 0.5))
+        assert spec.shape == (3, 1340)
+
+
+def test_engine_pipelines_requests(server: SpectraServer):
+    collector = MagicMock(wraps=server.collector)
+    server.collector = collector
+    with RemoteSpectraCollector(*server.address) as remote:
+        engine = RamanEngine(
+            CMMCorePlus(), spectra_collector=remote, sources=[SimpleGridSource(20, 20)]
+        )
+        engine.submit_batch = 100
+        spec, _, _ = engine.snap_raman(optimize_path=True)
+    assert spec.shape == (400, 1340)
+    # sent as four requests without waiting on each
+    assert collector.collect_spectra_relative.call_count == 4
+    assert {
+        len(c.args[0]) for c in collector.collect_spectra_relative.call_args_list
+    } == {100}
+
+
+def test_remote_bad_response():
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        conn, _ = listener.accept()
+        with conn:
+            header = conn.recv(_REQUEST.size)
+            _, req_id, _, n = _REQUEST.unpack(header)
+            conn.recv(n * 16)
+            conn.sendall(_RESPONSE.pack(req_id + 1, 0, 0, 0, b"<f8"))
+            conn.recv(1)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    with RemoteSpectraCollector(*listener.getsockname()) as remote:
+        future = remote.submit(np.zeros((1, 2)))
+        # fails instead of leaving the caller waiting forever
+        with pytest.raises(ConnectionError, match="does not match"):
+            future.result(timeout=5)
+    thread.join()
+    listener.close()
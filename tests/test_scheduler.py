@@ -0,0 +1,62 @@
+import numpy as np
+from useq import MDAEvent, MDASequence
+
+from raman_mda_engine._aiming_cache import make_plan
+from raman_mda_engine._plan import PLAN_DTYPE, compile_plan
+from raman_mda_engine._scheduler import PointScheduler
+from raman_mda_engine.aiming import SimpleGridSource
+
+
+def test_priority_and_carry_over():
+    cells = SimpleGridSource(2, 2, name="cells")
+    cells.priority = 1
+    bkd = SimpleGridSource(4, 4, name="bkd")
+    sources = [bkd, cells]
+    plan = make_plan(sources, [s.get_mda_points() for s in sources])
+
+    scheduler = PointScheduler()
+    # a fixed budget of 0.1 s per event
+    scheduler.start(np.zeros(0, dtype=PLAN_DTYPE), np.zeros(0), 0, budget=0.1)
+    event = MDAEvent(index={"p": 0, "t": 0})
+    seen = []
+    for _ in range(4):
+        # room for all the cells and 4 of the 16 background points
+        keep = scheduler.select(event, None, sources, plan, cost=0.0125)
+        assert len(keep) == 8
+        assert np.all(np.diff(keep) > 0)
+        which = np.array(plan.which)[keep]
+        assert (which == "cells").sum() == 4
+        seen.extend(keep[which == "bkd"])
+    # every background point was collected once over the four timepoints
+    np.testing.assert_array_equal(np.sort(seen), np.arange(16))
+
+    assert len(scheduler.skipped) == 4
+    assert scheduler.skipped[0] == (event.index, "bkd", 16, 4)
+
+
+def test_interval_budget():
+    seq = MDASequence(time_plan={"interval": 1, "loops": 2}, channels=["BF"])
+    plan, _ = compile_plan(seq, raman_channel="BF", raman_z=0, n_points={0: 100})
+    scheduler = PointScheduler()
+    scheduler.start(plan, np.full(len(plan), 0.5), 1, budget=True)
+    # half the interval goes on the snap which leaves about 50 points
+    assert 40 < scheduler.capacity(0, cost=0.01) <= 50
+
+    scheduler.start(plan, np.full(len(plan), 0.5), 0, budget=True)
+    assert not scheduler.enabled
+    assert scheduler.capacity(0, cost=0.01) is None
+
+
+def test_interval_budget_unknown_counts():
+    seq = MDASequence(
+        time_plan={"interval": 1, "loops": 1},
+        channels=["BF"],
+        stage_positions=[(0, 0), (1, 1)],
+    )
+    # points that are only known at the event are compiled as 0
+    plan, _ = compile_plan(seq, raman_channel="BF", raman_z=0, n_points={})
+    scheduler = PointScheduler()
+    scheduler.start(plan, np.zeros(len(plan)), 1, budget=True)
+    # the second position is assumed to have as many points as the first
+    assert 40 < scheduler.capacity(0, cost=0.01, n_points=100) <= 50
+    assert 90 < scheduler.capacity(1, cost=0.01, n_points=100) <= 100
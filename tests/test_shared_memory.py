@@ -0,0 +1,80 @@
+import subprocess
+import sys
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+from useq import MDAEvent
+
+from raman_mda_engine import SharedSpectraPublisher, SharedSpectraReader
+
+
+@pytest.fixture
+def publisher():
+    publisher = SharedSpectraPublisher(MagicMock(), n_slots=4, max_points=10)
+    yield publisher
+    publisher.close()
+
+
+def publish(publisher, t: int, n: int = 3):
+    spec = np.full((n, 1340), t, dtype=np.float32)
+    points = np.full((n, 2), t / 10)
+    which = ["cell"] * (n - 1) + ["bkd"]
+    publisher.publish(MDAEvent(index={"p": 1, "t": t}), spec, points, which)
+
+
+def test_ring_buffer(publisher):
+    reader = SharedSpectraReader(publisher.name)
+    assert reader.poll() == []
+
+    for t in range(3):
+        publish(publisher, t)
+    items = reader.poll()
+    assert [item.number for item in items] == [0, 1, 2]
+    item = items[2]
+    assert item.index == {"p": 1, "t": 2}
+    np.testing.assert_array_equal(item.spectra, 2)
+    np.testing.assert_array_equal(item.points, 0.2)
+    assert item.which == ["cell", "cell", "bkd"]
+
+    # falling more than n_slots behind misses the oldest events
+    for t in range(3, 9):
+        publish(publisher, t, n=12)
+    items = reader.poll(copy=False)
+    assert [item.number for item in items] == [5, 6, 7, 8]
+    assert reader.missed == 2
+    # only max_points are published
+    assert items[-1].spectra.shape == (10, 1340)
+    assert reader.is_valid(8)
+    publish(publisher, 9)
+    assert not reader.is_valid(5)
+    assert reader.read(5) is None
+    del items, item
+    reader.close()
+
+
+def test_torn_slot(publisher):
+    publish(publisher, 0)
+    reader = SharedSpectraReader(publisher.name)
+    # as if the publisher died halfway through writing the slot
+    publisher._layout.slots["seq"][0] += 1
+    with pytest.raises(TimeoutError):
+        reader.read(0, timeout=0.01)
+    publisher._layout.slots["seq"][0] += 1
+    assert reader.read(0).index == {"p": 1, "t": 0}
+    reader.close()
+
+
+def test_other_process(publisher):
+    publish(publisher, 7)
+    code = (
+        "from raman_mda_engine import SharedSpectraReader;"
+        f"item = SharedSpectraReader({publisher.name!r}).read(0);"
+        "print(item.index['t'], item.spectra.sum(), *item.which)"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert out.stdout.split() == ["7", str(7.0 * 3 * 1340), "cell", "cell", "bkd"]
+    # the other process exiting didn't free the memory
+    assert SharedSpectraReader(publisher.name).read(0).index == {"p": 1, "t": 7}
@@ -0,0 +1,21 @@
+import numpy as np
+
+from raman_mda_engine import SimulatedSpectraCollector
+
+
+def test_simulated_spectra_collector():
+    sim = SimulatedSpectraCollector(realtime=False, cosmic_ray_rate=1, seed=0)
+    points = np.random.default_rng(0).uniform(size=(10, 2))
+    spec = sim.collect_spectra_relative(points, 20)
+    assert spec.shape == (10, 1340)
+    assert spec.dtype == np.float32
+    assert sim.simulated_time == sim.duration(10, 20)
+    # every spectrum got a cosmic ray well above the peaks
+    assert (spec.max(axis=1) > 3000).all()
+
+    again = SimulatedSpectraCollector(realtime=False, cosmic_ray_rate=1, seed=0)
+    np.testing.assert_array_equal(again.collect_spectra_relative(points, 20), spec)
+
+    out = np.empty((10, 1340), dtype=np.float32)
+    assert sim.collect_spectra_volts(points, out=out) is out
+    assert sim.collect_spectra_relative(points, out=out) is out
@@ -0,0 +1,151 @@
+import numpy as np
+from napari.layers import Points
+from scipy import ndimage
+from useq import MDAEvent
+
+from raman_mda_engine.aiming import (
+    AdaptiveGridSource,
+    DriftCorrectedSource,
+    PointsLayerSource,
+    SegmentationSource,
+    SimpleGridSource,
+)
+
+
+def test_points_layer_source_index():
+    rng = np.random.default_rng(0)
+    data = np.column_stack(
+        [np.zeros(50), rng.integers(0, 5, 50), rng.uniform(0, 512, (50, 2))]
+    )
+    layer = Points(data)
+    original = layer.data.copy()
+    source = PointsLayerSource(layer, img_shape=(512, 512))
+
+    for p in range(6):
+        points = source.get_mda_points(MDAEvent(index={"p": p}))
+        expected = data[data[:, 1] == p][:, -2:] / 512
+        np.testing.assert_array_equal(points, expected)
+    # the layer data is not modified in place
+    np.testing.assert_array_equal(layer.data, original)
+
+    version = source.version
+    layer.add([0, 5, 256, 256])
+    assert source.version > version
+    points = source.get_mda_points(MDAEvent(index={"p": 5}))
+    np.testing.assert_array_equal(points, [[0.5, 0.5]])
+
+
+def _cells_image():
+    rows, cols = np.mgrid[:256, :256]
+    image = np.zeros((256, 256))
+    # two touching cells and one on its own
+    for r, c, radius in [(60, 60, 25), (60, 105, 25), (180, 180, 35)]:
+        image[(rows - r) ** 2 + (cols - c) ** 2 < radius**2] = 100
+    return image + np.random.default_rng(0).normal(0, 5, image.shape)
+
+
+def test_segmentation_source():
+    source = SegmentationSource(channel="DAPI", spacing=10)
+    assert source.get_mda_points(MDAEvent(index={"p": 0})).shape == (0, 2)
+
+    # images of other channels are ignored
+    source.image_ready(MDAEvent(index={"p": 0}, channel="BF"), np.zeros((256, 256)))
+    assert source.get_mda_points(MDAEvent(index={"p": 0})).shape == (0, 2)
+
+    version = source.version
+    source.image_ready(MDAEvent(index={"p": 0}, channel="DAPI"), _cells_image())
+    assert source.version > version
+    points = source.get_mda_points(MDAEvent(index={"p": 0}, channel="BF"))
+    assert len(np.unique(source.label_ids)) == 3
+    assert len(points) == len(source.label_ids)
+    # every point is inside a cell
+    labels = source.labels(0)
+    pixels = (points * 256).astype(int)
+    assert np.all(labels[pixels[:, 0], pixels[:, 1]] == source.label_ids)
+    # other positions have no image yet
+    assert source.get_mda_points(MDAEvent(index={"p": 1})).shape == (0, 2)
+    source.close()
+
+
+def test_drift_corrected_source():
+    grid = SimpleGridSource(5, 5, name="grid")
+    grid.priority = 2
+    source = DriftCorrectedSource(grid, channel="BF")
+    assert source.name == "grid"
+    assert source.priority == 2
+
+    rng = np.random.default_rng(0)
+    reference = ndimage.gaussian_filter(rng.normal(size=(256, 256)), 3)
+    bf = MDAEvent(index={"p": 0, "t": 0}, channel="BF")
+    source.image_ready(bf, reference)
+    np.testing.assert_array_equal(source.get_mda_points(bf), grid.get_mda_points())
+
+    version = source.version
+    drifted = ndimage.shift(reference, (8, -12), mode="wrap")
+    source.image_ready(MDAEvent(index={"p": 0, "t": 1}, channel="BF"), drifted)
+    assert source.version > version
+    np.testing.assert_allclose(source.shifts[-1].shift, (8, -12), atol=0.5)
+    assert source.shifts[-1].index == {"p": 0, "t": 1}
+
+    points = source.get_mda_points(MDAEvent(index={"p": 0, "t": 2}))
+    shifted = grid.get_mda_points() + np.array([8, -12]) / 256
+    inside = np.all((shifted >= 0) & (shifted <= 1), axis=1)
+    np.testing.assert_allclose(points, shifted[inside], atol=0.5 / 256)
+    # other positions have their own reference
+    points = source.get_mda_points(MDAEvent(index={"p": 1}))
+    np.testing.assert_array_equal(points, grid.get_mda_points())
+
+
+def test_drift_corrected_refine():
+    assert not hasattr(DriftCorrectedSource(SimpleGridSource(2, 2)), "refine")
+
+    grid = SimpleGridSource(5, 5, name="grid")
+    seen = []
+
+    def refine(event, points, spectra):
+        seen.append(points)
+        # refine in the source's own frame, e.g. around its center
+        return np.array([[0.5, 0.5], [0.01, 0.01]])
+
+    grid.refine = refine
+    source = DriftCorrectedSource(grid)
+    reference = ndimage.gaussian_filter(
+        np.random.default_rng(0).normal(size=(256, 256)), 3
+    )
+    source.image_ready(MDAEvent(index={"p": 0, "t": 0}), reference)
+    drifted = ndimage.shift(reference, (8, -12), mode="wrap")
+    source.image_ready(MDAEvent(index={"p": 0, "t": 1}), drifted)
+    shift = np.array(source.shifts[-1].shift) / 256
+
+    event = MDAEvent(index={"p": 0, "t": 2})
+    points = source.get_mda_points(event)
+    new = source.refine(event, points, np.zeros((len(points), 1)))
+    # the source sees its own points and its refined points follow the drift,
+    # the one moved out of the field of view is dropped
+    np.testing.assert_allclose(seen[0], points - shift)
+    np.testing.assert_allclose(new, [[0.5, 0.5] + shift])
+
+
+def test_adaptive_grid_source():
+    source = AdaptiveGridSource(3, 3, metric=lambda spec: spec[:, 0], factor=2)
+    source.max_points = 9 + 4 + 4
+    event = MDAEvent(index={"p": 0})
+    coarse = source.get_mda_points(event)
+    scores = np.zeros((9, 1))
+    scores[4], scores[1] = 2, 1
+    # 3 cells of the coarse grid are refined, with a budget for only 2
+    new = source.refine(event, coarse, scores)
+    np.testing.assert_allclose(
+        np.sort(new[:4], axis=0),
+        np.sort(coarse[4] + np.array([[-1, -1], [-1, 1], [1, -1], [1, 1]]) / 8, axis=0),
+    )
+    # half of the second cell is outside of the field of view
+    np.testing.assert_allclose(new[4:, 1], [1 / 8, 1 / 8])
+    # the budget is used up, also for another object of the same event
+    assert len(source.refine(MDAEvent(index={"p": 0}), new, np.zeros((6, 1)))) == 0
+    # a new event starts over
+    later = MDAEvent(index={"p": 0, "t": 1})
+    assert len(source.refine(later, coarse, scores)) == 6
+    # as does the same event after a reset
+    source.reset(p=0)
+    assert len(source.refine(event, coarse, scores)) == 6
@@ -1,7 +1,8 @@
 import numpy as np
 from scipy.spatial.distance import cdist
 
-from raman_mda_engine.aiming.transformers import Circle
+from raman_mda_engine.aiming import SimpleGridSource
+from raman_mda_engine.aiming.transformers import Circle, Compose, Crosshair, Square
 
 
 def test_ordering():
@@ -13,3 +14,38 @@ def test_ordering():
     # FIXME: add parameterize for other transformer types
     distances = cdist(out[: transformer.multiplier], out[: transformer.multiplier])
     assert distances.max() <= radius * 2
+
+
+def test_stencil_cache():
+    transformer = Square(0.1, 3)
+    stencil = transformer.stencil
+    assert transformer.stencil is stencil
+    assert transformer.multiplier == 9
+
+    # the setters rebuild the stencil
+    transformer.N_points = 4
+    assert transformer.multiplier == 16
+    crosshair = Crosshair(0.1)
+    crosshair.spacing = 0.2
+    np.testing.assert_allclose(np.abs(crosshair.stencil).max(), 0.2)
+
+    source = SimpleGridSource(2, 2)
+    source.transformer = transformer
+    version = source.version
+    transformer.edge_length = 0.2
+    assert source.version > version
+
+
+def test_compose():
+    circle, crosshair = Circle(0.05, 5), Crosshair(0.01)
+    composed = Compose(circle, crosshair)
+    xy = np.random.default_rng(0).random((7, 2))
+    np.testing.assert_allclose(
+        composed.transform(xy), crosshair.transform(circle.transform(xy))
+    )
+    assert composed.multiplier == circle.multiplier * crosshair.multiplier
+
+    crosshair.spacing = 0.02
+    np.testing.assert_allclose(
+        composed.transform(xy), crosshair.transform(circle.transform(xy))
+    )
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from pymmcore_plus import CMMCorePlus
+from useq import MDAEvent, MDASequence
+
+from raman_mda_engine import RamanTiffAndNumpyWriter
+
+
+@pytest.mark.parametrize("backpressure", ["block", "drop-oldest", "spill"])
+def test_async_raman_writer(tmp_path, backpressure):
+    writer = RamanTiffAndNumpyWriter(
+        tmp_path / "data",
+        core=CMMCorePlus(),
+        async_raman=True,
+        max_queue=1,
+        backpressure=backpressure,
+    )
+    seq = MDASequence(time_plan={"interval": 0, "loops": 10})
+    writer._onMDAStarted(seq)
+    for t in range(10):
+        event = MDAEvent(index={"p": 0, "t": t})
+        spec = np.full((4, 1340), t, dtype=float)
+        writer._save_raman(event, spec, np.zeros((4, 2)), ["grid"] * 4)
+    writer._onMDAFinished(seq)
+
+    stats = writer.raman_stats
+    assert stats["depth"] == 0
+    saved = sorted(writer._raman_path.glob("*_data.npy"))
+    assert len(saved) == stats["written"] == 10 - stats["dropped"]
+    if backpressure != "drop-oldest":
+        assert stats["dropped"] == 0
+        last = np.load(writer._raman_path / "raman_p000_t009_data.npy")
+        np.testing.assert_array_equal(last, 9)
+
+
+def test_raman_zarr_writer(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    from raman_mda_engine import RamanZarrWriter
+
+    writer = RamanZarrWriter(tmp_path / "raman", core=CMMCorePlus(), point_chunk=4)
+    seq = MDASequence(
+        time_plan={"interval": 0, "loops": 2},
+        z_plan={"relative": [-1, 0, 1]},
+        stage_positions=[(0, 0, 0), (1, 1, 1)],
+        axis_order="tpz",
+    )
+    writer._onMDAStarted(seq)
+    for event in seq.iter_events():
+        n = 3 + event.index["z"] * 2
+        spec = np.full((n, 1340), event.index["z"], dtype=float)
+        which = ["grid"] * (n - 1) + ["cells"]
+        writer._save_raman(event, spec, np.zeros((n, 2)), which)
+
+    group = zarr.open_group(str(writer._path), mode="r")
+    assert group["spectra"].shape == (2, 2, 3, 8, 1340)
+    assert group.attrs["labels"] == ["grid", "cells"]
+    np.testing.assert_array_equal(group["n_points"][1, 1], [3, 5, 7])
+    # earlier z planes are not overwritten
+    np.testing.assert_array_equal(group["spectra"][1, 1, 0, :3], 0)
+    assert np.isnan(group["spectra"][1, 1, 0, 3:]).all()
+    np.testing.assert_array_equal(
+        group["designation"][0, 0, 0], [0, 0, 1, -1] + [-1] * 4
+    )
+    # one event per chunk in every array
+    for name in ("spectra", "locations", "designation", "n_points"):
+        assert group[name].chunks[:3] == (1, 1, 1)
+
+
+def test_writer_disconnect(tmp_path):
+    from raman_mda_engine import RamanEngine, SimulatedSpectraCollector
+
+    core = CMMCorePlus()
+    engine = RamanEngine(core, spectra_collector=SimulatedSpectraCollector(seed=0))
+    core.register_mda_engine(engine)
+    writer = RamanTiffAndNumpyWriter(tmp_path / "data", core=core)
+    writer.disconnect()
+
+    # would fail in _save_raman if the writer were still connected
+    event = MDAEvent(index={"p": 0})
+    engine.raman_events.ramanSpectraReady.emit(
+        event, np.zeros((1, 1340)), np.zeros((1, 2)), ["grid"]
+    )
+    core.mda.events.sequenceFinished.emit(MDASequence())
+    assert not list(tmp_path.iterdir())